@@ -0,0 +1,71 @@
+'''
+Benchmark: the columnar form of the tree (cf. tangolib.arena),
+conversion, size and queries, compared with the markup tree
+'''
+
+import os
+import sys
+import time
+import tracemalloc
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+
+from bench_lexer import synthetic_document
+
+def timed(function, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (result, best)
+
+def tree_find(doc, markup_type, name):
+    found = []
+    elements = [ doc ]
+    while elements:
+        element = elements.pop()
+        if element.markup_type == markup_type and getattr(element, "cmd_name", None) == name:
+            found.append(element)
+        content = getattr(element, "content", None)
+        if isinstance(content, list):
+            elements.extend(reversed(content))
+    return found
+
+def bench(name, input):
+    parser = Parser()
+    tracemalloc.start()
+    doc = parser.parse_from_string(input)
+    (tree_size, _) = tracemalloc.get_traced_memory()
+    arena = doc.to_arena()
+    (total_size, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("{} ({} chars): {} nodes".format(name, len(input), len(arena)))
+    print("    tree  {:8.1f} MB   arena {:8.1f} MB (traced)".format(tree_size / 2**20, (total_size - tree_size) / 2**20))
+
+    (_, elapsed) = timed(doc.to_arena)
+    print("    to_arena     {:.4f} s".format(elapsed))
+    (_, elapsed) = timed(arena.to_document)
+    print("    to_document  {:.4f} s".format(elapsed))
+
+    (found, tree_elapsed) = timed(lambda: tree_find(doc, "command", "emph"))
+    (indices, arena_elapsed) = timed(lambda: arena.find("command", "emph"))
+    (indexed, index_elapsed) = timed(lambda: doc.index.commands("emph"))
+    assert len(found) == len(indices) == len(indexed)
+    print("    find emph    {:.4f} s (tree)   {:.4f} s (arena)   {:.6f} s (index)   {} nodes".format(
+        tree_elapsed, arena_elapsed, index_elapsed, len(indices)))
+
+    offset = len(input) // 2
+    (_, elapsed) = timed(lambda: arena.covering(offset))
+    print("    covering     {:.4f} s".format(elapsed))
+    (_, elapsed) = timed(arena.subtree_sizes)
+    print("    subtree sizes {:.4f} s".format(elapsed))
+
+if __name__ == "__main__":
+    bench("synthetic", synthetic_document(400))
+    bench("synthetic (x10)", synthetic_document(4000))
@@ -0,0 +1,35 @@
+'''
+Benchmark: parsing of large preformated blocks ({{{ }}}) and
+macro definitions (\defCommand, \defEnvironment bodies)
+'''
+
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+
+def listings_document(nb_listings, nb_lines=200):
+    listing = "".join("    x{0} = {{'key': [{0}, {{}}]}} # line {0}\n".format(i) for i in range(nb_lines))
+    return "".join("Listing {}:\n\\code{{{{{{\n{}}}}}}}\n\n".format(i, listing) for i in range(nb_listings))
+
+def macros_document(nb_macros, body_size=50):
+    body = "".join("<b>#1 {{@{{emit('{}')}}}}</b> ".format(i) for i in range(body_size))
+    return "".join("\\defCommand{{\\m{0}}}[1]{{{1}}}\n\\defEnvironment{{e{0}}}[1]{{{{{1}}}}}{{{1}}}\n".format(i, body)
+                   for i in range(nb_macros))
+
+def bench(label, input, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        Parser().parse_from_string(input)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("{:<10} ({:>8} chars)  {:8.4f} s".format(label, len(input), best))
+
+if __name__ == "__main__":
+    bench("listings", listings_document(100))
+    bench("macros", macros_document(500))
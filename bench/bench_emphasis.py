@@ -0,0 +1,66 @@
+'''
+Benchmark: adversarial lines for the emphasis delimiters (long single
+lines full of underscores or asterisks, most of them never closed on
+their line), the parsing time should grow linearly with the length
+of the line
+'''
+
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+import tangolib.lexer as lexer
+import tangolib.parser as parser
+
+ADVERSARIAL_UNITS = [ ("unclosed strong stars", "**a *b "),
+                      ("unclosed strong underscores", "__a _b "),
+                      ("triple stars", "*** "),
+                      ("identifiers", "my_var_name "),
+                      ("underscores", "_ "),
+                      ("stars", "* "),
+                      ("double stars", "** "),
+                      ("products", "a*b "),
+                      ("ascii table", "|--*--|__x__"),
+                      ("math", "x*y_z ") ]
+
+class LookaheadEmphasis(lexer.Regexp):
+    '''The (previous) emphasis recognizer, a regexp with lookahead.'''
+    def recognize(self, tokenizer):
+        token = super().recognize(tokenizer)
+        if token is not None:
+            token.value = token.value.group(1)
+        return token
+
+def lookahead_recognizer_set():
+    """The recognizers of the parser, with the lookahead regexps
+    instead of the delimiter runs."""
+    regexps = { ("strong", '*'): parser.REGEX_STRONG_STAR, ("strong", '_'): parser.REGEX_STRONG_UNDER,
+                ("emph", '*'): parser.REGEX_EMPH_STAR, ("emph", '_'): parser.REGEX_EMPH_UNDER }
+    recognizers = parser.Parser.prepare_recognizers()
+    for (index, rec) in enumerate(recognizers):
+        if isinstance(rec, lexer.DelimiterRun):
+            recognizers[index] = LookaheadEmphasis(rec.token_type, regexps[(rec.token_type, rec.char)])
+    return lexer.RecognizerSet(recognizers)
+
+def parse_time(recognizer_set, input):
+    start = time.perf_counter()
+    try:
+        parser.Parser(recognizer_set=recognizer_set).parse_from_string(input)
+    except parser.ParseError:
+        pass # e.g. unclosed emphasis at end of input
+    return time.perf_counter() - start
+
+def bench(name, unit, nb_units=20000, nb_lines=1):
+    print("{} ({!r})".format(name, unit))
+    for (label, recognizer_set) in (("DelimiterRun", parser.Parser.recognizers_of_process()),
+                                    ("Lookahead", lookahead_recognizer_set())):
+        times = [ parse_time(recognizer_set, (unit * (nb_units * scale) + "\n") * nb_lines) for scale in (1, 4) ]
+        print("    {:<16} {:8.3f} s  {:8.3f} s (x4 input)  growth = {:.1f}"
+              .format(label, times[0], times[1], times[1] / times[0]))
+
+if __name__ == "__main__":
+    for (name, unit) in ADVERSARIAL_UNITS:
+        bench(name, unit)
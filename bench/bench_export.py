@@ -0,0 +1,50 @@
+'''
+Benchmark: the XML and JSON lines exports of the tree
+(cf. tangolib.export), on large and on deep trees
+'''
+
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+from tangolib.markup import Command, CommandArg, Text
+from tangolib.export import write_xml, write_jsonl
+
+from bench_lexer import synthetic_document
+
+def deep_document(depth):
+    # \emph{word \emph{word ...}} nested `depth` times
+    doc = Parser().parse_from_string("")
+    parent = doc
+    for _ in range(depth):
+        cmd = Command(doc, "emph", None, doc.start_pos, doc.start_pos)
+        parent.append(cmd)
+        arg = CommandArg(doc, cmd, doc.start_pos)
+        cmd.add_argument(arg)
+        arg.append(Text(doc, "word", doc.start_pos, doc.start_pos))
+        parent = arg
+    return doc
+
+def bench(name, doc, nb_nodes):
+    with open(os.devnull, "w") as out:
+        for (export_name, export) in (("xml", write_xml), ("jsonl", write_jsonl)):
+            start = time.perf_counter()
+            export(doc, out)
+            elapsed = time.perf_counter() - start
+            print("{:<24} {:>6} {:8.4f} s  {:6.2f} us per node".format(name, export_name, elapsed, elapsed / nb_nodes * 1e6))
+
+    start = time.perf_counter()
+    doc.toxml()
+    elapsed = time.perf_counter() - start
+    print("{:<24} {:>6} {:8.4f} s  {:6.2f} us per node".format(name, "toxml", elapsed, elapsed / nb_nodes * 1e6))
+
+if __name__ == "__main__":
+    for nb_sections in (400, 4000):
+        doc = Parser().parse_from_string(synthetic_document(nb_sections))
+        bench("synthetic ({})".format(nb_sections), doc, len(doc.to_arena()))
+    for depth in (500, 2000, 8000):
+        bench("deep ({})".format(depth), deep_document(depth), 3 * depth + 1)
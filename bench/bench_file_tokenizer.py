@@ -0,0 +1,56 @@
+'''
+Benchmark: tokenizing a large file, read in memory (string tokenizer)
+vs. streamed (memory-mapped file tokenizer)
+'''
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+import tangolib.lexer as lexer
+from tangolib.parser import Parser
+
+from bench_lexer import synthetic_document
+
+def tokenize(tokens):
+    lex = lexer.CompiledLexer(tokens, *Parser().recognizers)
+    nb_tokens = 0
+    while True:
+        tok = lex.next_token()
+        if tok is None:
+            lex.next_text_run()
+        elif tok.token_type == "end_of_input":
+            return nb_tokens
+        else:
+            nb_tokens += 1
+
+def read_string_tokenizer(filename):
+    with open(filename) as f:
+        return lexer.make_string_tokenizer(f.read())
+
+def bench(name, make_tokenizer, filename):
+    start = time.perf_counter()
+    nb_tokens = tokenize(make_tokenizer(filename))
+    elapsed = time.perf_counter() - start
+    # memory is measured by a second (slower) run
+    tracemalloc.start()
+    tokenize(make_tokenizer(filename))
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("    {:<8} {:>9} tokens  {:8.2f} s  peak {:8.2f} MB".format(name, nb_tokens, elapsed, peak / 2**20))
+
+if __name__ == "__main__":
+    nb_sections = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    with tempfile.NamedTemporaryFile("w", suffix=".tango.tex", delete=False) as f:
+        f.write(synthetic_document(nb_sections))
+    try:
+        print("{} ({:.1f} MB)".format(f.name, os.path.getsize(f.name) / 2**20))
+        bench("string", read_string_tokenizer, f.name)
+        bench("file", lexer.make_file_tokenizer, f.name)
+    finally:
+        os.remove(f.name)
@@ -0,0 +1,52 @@
+'''
+Benchmark: processing of a root document including many chapter files,
+sequentially vs. with the parallel prefetch of the included files
+'''
+
+import os
+import sys
+import tempfile
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+from tangolib.processor import DocumentProcessor
+from tangolib.processors import core
+from tangolib.includecache import get_include_cache, prefetch_includes
+
+from bench_lexer import synthetic_document
+
+def process(input, prefetch):
+    get_include_cache().clear()
+    doc = Parser().parse_from_string(input)
+    if prefetch:
+        prefetch_includes(doc)
+    processor = DocumentProcessor(doc)
+    core.register_core_processors(processor)
+    processor.process()
+
+def bench(nb_chapters, nb_sections):
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # the chapters are included by a relative name: the path
+        # of the temporary directory may contain markup (e.g. a `_`)
+        os.chdir(tmp_dir)
+        input = ""
+        for i in range(nb_chapters):
+            filename = "chapter{}.tango.tex".format(i)
+            with open(filename, "w") as f:
+                f.write(synthetic_document(nb_sections))
+            input += "\\include{{{}}}\n".format(filename)
+
+        print("{} chapters of {} sections ({} CPUs)".format(nb_chapters, nb_sections, os.cpu_count()))
+        for (label, prefetch) in (("sequential", False), ("prefetch", True)):
+            start = time.perf_counter()
+            process(input, prefetch)
+            print("    {:<12} {:8.4f} s".format(label, time.perf_counter() - start))
+        os.chdir(old_cwd)
+
+if __name__ == "__main__":
+    bench(40, 20)
+    bench(40, 100)
@@ -0,0 +1,73 @@
+'''
+Benchmark: sequential lexer vs. compiled (master regexp) lexer
+'''
+
+import glob
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+import tangolib.lexer as lexer
+from tangolib.parser import Parser
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "examples")
+
+def synthetic_document(nb_sections=400):
+    parts = []
+    for i in range(nb_sections):
+        parts.append(r"""
+\section{Section {0}}
+
+This is a paragraph of plain prose for section {0}, with some \emph{emphasis},
+a \cmd[key=value]{first}{second} command and `inline code` here.
+Another line of text, *starred emphasis* and __strong__ words % a comment
+% a full comment line
+
+\begin{itemize}
+\item first item with my_var_name
+\item second item
+\end{itemize}
+
+  - a markdown item
+  - another one
+
+""".replace("{0}", str(i)))
+    return "".join(parts)
+
+def tokenize(lexer_class, input):
+    lex = lexer_class(lexer.Tokenizer(lexer.StringTokenizer(input)), *Parser().recognizers)
+    nb_tokens = 0
+    while True:
+        tok = lex.next_token()
+        if tok is None: # text: consumed by runs, as in the parser
+            lex.skip_text_run()
+        elif tok.token_type == "end_of_input":
+            return nb_tokens
+        else:
+            nb_tokens += 1
+
+def bench(name, input, repeat=3):
+    results = []
+    for lexer_class in (lexer.Lexer, lexer.CompiledLexer):
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            nb_tokens = tokenize(lexer_class, input)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append((lexer_class.__name__, nb_tokens, best))
+
+    print("{} ({} chars)".format(name, len(input)))
+    for (lexer_name, nb_tokens, best) in results:
+        print("    {:<14} {:>8} tokens  {:8.4f} s".format(lexer_name, nb_tokens, best))
+    print("    speedup = {:.2f}x".format(results[0][2] / results[1][2]))
+
+if __name__ == "__main__":
+    for filename in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.tex"))):
+        with open(filename) as f:
+            bench(os.path.basename(filename), f.read(), repeat=20)
+
+    bench("synthetic", synthetic_document())
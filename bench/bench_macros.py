@@ -0,0 +1,33 @@
+'''
+Benchmark: processing of a document with many macro-command calls
+(each call parses the expansion of the macro)
+'''
+
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+from tangolib.processor import DocumentProcessor
+
+def macro_document(nb_calls):
+    return (r"\defCommand{\hello}[1]{brave #1 *world*}" + "\n"
+            + "".join(r"\hello{w" + str(i) + "} text\n" for i in range(nb_calls)))
+
+def bench(nb_calls, repeat=3):
+    input = macro_document(nb_calls)
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        doc = Parser().parse_from_string(input)
+        DocumentProcessor(doc).process()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("{:>6} macro calls  {:8.4f} s".format(nb_calls, best))
+
+if __name__ == "__main__":
+    for nb_calls in (100, 1000, 10000):
+        bench(nb_calls)
@@ -0,0 +1,38 @@
+'''
+Benchmark: paragraphs and markdown lists in deeply nested environments
+(each blank line checks for markdown lists to close)
+'''
+
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+
+def nested_document(depth, nb_blocks):
+    block = ("A paragraph of text.\n\n"
+             "  - item one\n"
+             "    * nested item\n"
+             "      1. more nested\n"
+             "  - item two\n\n"
+             "Another paragraph.\n\n\n")
+    return ("\\begin{block}\n" * depth
+            + block * nb_blocks
+            + "\\end{block}\n" * depth)
+
+def bench(depth, nb_blocks, repeat=3):
+    input = nested_document(depth, nb_blocks)
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        Parser().parse_from_string(input)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("depth {:>4}, {:>5} blocks ({:>8} chars)  {:8.4f} s".format(depth, nb_blocks, len(input), best))
+
+if __name__ == "__main__":
+    for depth in (1, 100, 1000):
+        bench(depth, 5000)
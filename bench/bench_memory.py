@@ -0,0 +1,62 @@
+'''
+Benchmark: memory of the parsed tree, by node class
+(node counts, bytes per node, and the whole tree)
+'''
+
+import collections
+import os
+import sys
+import time
+import tracemalloc
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+
+from bench_lexer import synthetic_document
+
+def node_size(node):
+    # the node itself and its attribute dictionary (if any),
+    # not the objects it refers to
+    size = sys.getsizeof(node)
+    if hasattr(node, "__dict__"):
+        size += sys.getsizeof(node.__dict__)
+    return size
+
+def nodes_of(doc):
+    nodes = []
+    elements = [ doc ]
+    while elements:
+        element = elements.pop()
+        nodes.append(element)
+        content = getattr(element, "content", None)
+        if isinstance(content, list):
+            elements.extend(content)
+    return nodes
+
+def bench(name, input):
+    parser = Parser()
+    tracemalloc.start()
+    start = time.perf_counter()
+    doc = parser.parse_from_string(input)
+    elapsed = time.perf_counter() - start
+    (tree_size, peak_size) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    nodes = nodes_of(doc)
+    print("{} ({} chars): {} nodes, parsed in {:.4f} s (traced)".format(name, len(input), len(nodes), elapsed))
+    print("    tree {:8.1f} MB   {:6.0f} bytes per node (with positions, strings, etc.)".format(
+        tree_size / 2**20, tree_size / len(nodes)))
+
+    counts = collections.Counter()
+    sizes = collections.Counter()
+    for node in nodes:
+        counts[type(node).__name__] += 1
+        sizes[type(node).__name__] += node_size(node)
+    for (class_name, count) in counts.most_common():
+        print("    {:<12} {:8} nodes {:6.0f} bytes per node".format(class_name, count, sizes[class_name] / count))
+
+if __name__ == "__main__":
+    bench("synthetic", synthetic_document(400))
+    bench("synthetic (x10)", synthetic_document(4000))
@@ -0,0 +1,36 @@
+'''
+Benchmark: parsing time of the examples and of a large synthetic document
+'''
+
+import glob
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+
+from bench_lexer import EXAMPLES_DIR, synthetic_document
+
+def bench(name, input, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        Parser().parse_from_string(input, name)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("{:<24} {:>9} chars  {:8.4f} s".format(name, len(input), best))
+
+if __name__ == "__main__":
+    for filename in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.tex"))):
+        with open(filename) as f:
+            input = f.read()
+        try:
+            bench(os.path.basename(filename), input, repeat=20)
+        except Exception as e:
+            print("{:<24} cannot be parsed: {}".format(os.path.basename(filename), e))
+
+    bench("synthetic", synthetic_document())
+    bench("synthetic (x10)", synthetic_document(4000), repeat=1)
@@ -0,0 +1,37 @@
+'''
+Benchmark: incremental reparse after a one-character edit vs. full parse
+'''
+
+import os
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+
+from bench_lexer import synthetic_document
+
+def bench(nb_sections):
+    input = synthetic_document(nb_sections)
+    parser = Parser()
+
+    start = time.perf_counter()
+    doc = parser.parse_from_string(input)
+    full_time = time.perf_counter() - start
+    print("synthetic ({} chars)".format(len(input)))
+    print("    full parse          {:8.4f} s".format(full_time))
+
+    # type one character in a paragraph, at several places
+    for ratio in (0.1, 0.5, 0.9):
+        offset = input.index("plain prose", int(len(input) * ratio))
+        start = time.perf_counter()
+        doc = parser.reparse(doc, offset, offset, "x")
+        elapsed = time.perf_counter() - start
+        input = input[:offset] + "x" + input[offset:]
+        print("    reparse at {:3.0%}      {:8.4f} s".format(ratio, elapsed))
+
+if __name__ == "__main__":
+    bench(400)
+    bench(4000)
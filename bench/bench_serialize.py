@@ -0,0 +1,44 @@
+'''
+Benchmark: the binary format of the trees (cf. tangolib.serialize),
+compared with parsing again and with pickling the tree
+'''
+
+import os
+import pickle
+import sys
+import time
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+from tangolib import serialize
+
+from bench_lexer import synthetic_document
+
+def timed(function, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (result, best)
+
+def bench(name, input):
+    (doc, elapsed) = timed(lambda: Parser().parse_from_string(input), repeat=3)
+    print("{} ({} chars): parsed in {:.4f} s".format(name, len(input), elapsed))
+
+    (data, dump_elapsed) = timed(lambda: serialize.dumps(doc))
+    (_, load_elapsed) = timed(lambda: serialize.loads(data))
+    print("    binary  {:9} bytes   dump {:.4f} s   load {:.4f} s".format(len(data), dump_elapsed, load_elapsed))
+
+    # the lexer is not part of the pickled tree (as in the include cache)
+    doc.lex = None
+    (data, dump_elapsed) = timed(lambda: pickle.dumps(doc, pickle.HIGHEST_PROTOCOL))
+    (_, load_elapsed) = timed(lambda: pickle.loads(data))
+    print("    pickle  {:9} bytes   dump {:.4f} s   load {:.4f} s".format(len(data), dump_elapsed, load_elapsed))
+
+if __name__ == "__main__":
+    bench("synthetic", synthetic_document(400))
+    bench("synthetic (x10)", synthetic_document(4000))
@@ -0,0 +1,57 @@
+'''
+Benchmark: parsing with the text as spans of the input vs. as strings
+(time, memory of the tree, and time to read all the text afterwards)
+'''
+
+import os
+import sys
+import time
+import tracemalloc
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+from tangolib.parser import Parser
+
+from bench_lexer import synthetic_document
+
+def read_all_text(doc):
+    nb_chars = 0
+    elements = [ doc ]
+    while elements:
+        element = elements.pop()
+        if element.markup_type == "text":
+            nb_chars += len(element.text)
+        elif element.markup_type == "spaces":
+            nb_chars += len(element.spaces)
+        elif element.markup_type == "newlines":
+            nb_chars += len(element.newlines)
+        content = getattr(element, "content", None)
+        if isinstance(content, list):
+            elements.extend(content)
+    return nb_chars
+
+def bench(name, input, repeat=5):
+    print("{} ({} chars)".format(name, len(input)))
+    for text_spans in (False, True):
+        parser = Parser(text_spans=text_spans)
+        best_parse = best_read = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            doc = parser.parse_from_string(input)
+            parsed = time.perf_counter()
+            read_all_text(doc)
+            read = time.perf_counter()
+            best_parse = parsed - start if best_parse is None else min(best_parse, parsed - start)
+            best_read = read - parsed if best_read is None else min(best_read, read - parsed)
+
+        tracemalloc.start()
+        doc = parser.parse_from_string(input)
+        (tree_size, peak_size) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("    {:<8} parse {:8.4f} s   read text {:8.4f} s   tree {:8.1f} MB (peak {:8.1f} MB)".format(
+            "spans" if text_spans else "strings", best_parse, best_read, tree_size / 2**20, peak_size / 2**20))
+
+if __name__ == "__main__":
+    bench("synthetic", synthetic_document(400))
+    bench("synthetic (x10)", synthetic_document(4000), repeat=1)
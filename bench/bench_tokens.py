@@ -0,0 +1,53 @@
+'''
+Benchmark: memory per token of the token stream of a synthetic
+document (about 1M tokens), as token objects and as a token table
+'''
+
+import os
+import sys
+import time
+import tracemalloc
+
+if __name__ == "__main__":
+    sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "src"))
+
+import tangolib.lexer as lexer
+from tangolib.parser import Parser
+
+from bench_lexer import synthetic_document
+
+def make_lexer(input):
+    return lexer.CompiledLexer(lexer.make_string_tokenizer(input), *Parser().recognizers)
+
+def token_list(lex):
+    tokens = []
+    while True:
+        tok = lex.next_token()
+        if tok is None:
+            lex.next_text_run()
+        else:
+            tokens.append(tok)
+            if tok.token_type == "end_of_input":
+                return tokens
+
+def token_table(lex):
+    return lex.token_table()
+
+def bench(name, tokenize, input):
+    lex = make_lexer(input)
+    tracemalloc.start()
+    start = time.perf_counter()
+    tokens = tokenize(lex)
+    elapsed = time.perf_counter() - start
+    (size, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("    {:<8} {:>9} tokens  {:8.2f} s  {:8.1f} MB  {:6.1f} bytes/token"
+          .format(name, len(tokens), elapsed, size / 2**20, size / len(tokens)))
+
+if __name__ == "__main__":
+    nb_sections = int(sys.argv[1]) if len(sys.argv) > 1 else 14000
+    input = synthetic_document(nb_sections)
+    print("synthetic ({} chars)".format(len(input)))
+    bench("objects", token_list, input)
+    if hasattr(lexer.Lexer, "token_table"):
+        bench("table", token_table, input)
@@ -5,7 +5,9 @@ import sys
 
 import tangolib.cmdparse
 import tangolib.globalvars
+import tangolib.includecache
 
+from tangolib.lexer import LexerProfile
 from tangolib.parser import Parser
 from tangolib.processor import DocumentProcessor
 from tangolib.processors import core, codeactive
@@ -121,20 +123,45 @@ if __name__ == "__main__":
 
     # 1) parsing
 
-    parser = Parser()
+    lexer_profile = None
+    if args.lexer_profile:
+        lexer_profile = LexerProfile()
+
+    parser = Parser(profile=lexer_profile)
 
     tangoPrintln("Parsing from file '{}' ...".format(args.input_filename))
 
-    doc = parser.parse_from_file(args.input_filename)
+    # in recovering mode, the parse errors are collected and the
+    # (best-effort) document goes through the next phases
+    errors = [] if args.recover else None
+    doc = parser.parse_from_file(args.input_filename, errors)
+    if errors:
+        for (start_pos, end_pos, message) in (error.args for error in errors):
+            tangoErrln("{}:{}: {}".format(args.input_filename, start_pos, message))
+        tangoErrln("{} parse error(s), going on with the recovered document".format(len(errors)))
 
     tangoPrintln("==> parsing done.")
 
+    if args.lexer_profile == "json":
+        print(lexer_profile.to_json())
+    elif args.lexer_profile == "table":
+        tangoPrintln("Lexer profile:")
+        print(lexer_profile.table(), end='')
+
     # 2) processing
 
     if enable_process_phase:
 
         tangoPrintln("Processing phase ...")
 
+        include_cache = tangolib.includecache.get_include_cache()
+        include_cache.cache_directory = args.include_cache_directory
+
+        if args.prefetch_includes:
+            tangoPrintln("Prefetching included files ...")
+            nb_prefetched = tangolib.includecache.prefetch_includes(doc, args.prefetch_workers)
+            tangoPrintln("==> {} included file(s) parsed.".format(nb_prefetched))
+
         processor = DocumentProcessor(doc)
         core.register_core_processors(processor)
 
@@ -153,6 +180,9 @@ if __name__ == "__main__":
 
         tangoPrintln("==> processing done.")
 
+        if include_cache.hits or include_cache.disk_hits or include_cache.misses or include_cache.prefetched:
+            tangoPrintln("Include cache: {} hit(s), {} disk hit(s), {} miss(es), {} prefetched".format(include_cache.hits, include_cache.disk_hits, include_cache.misses, include_cache.prefetched))
+
     # 3) generating
 
     generator = None
@@ -0,0 +1,428 @@
+"""A columnar form of the markup tree.
+
+The nodes of an `Arena` are numbered in document order (the
+parent before its children), and each column gives one field
+of all the nodes: markup type (`kind`), name (e.g. the name of
+a command, or the text of a text node, as an index in the
+string table), parent, first child and next sibling, and the
+start and end positions.  The columns are arrays (cf. the
+`array` module) that can be viewed as NumPy arrays without
+copying (cf. `Arena.as_numpy`).
+
+The queries of the arena work on the columns only, hence
+on large trees without building any markup object.
+
+>>> from tangolib.parser import Parser
+>>> doc = Parser().parse_from_string("= Title =\\n\\nSome \\\\emph{text} and \\\\emph{more}.\\n")
+>>> arena = doc.to_arena()
+>>> len(arena)
+16
+>>> [ arena.name_of(index) for index in arena.find("command", "emph") ]
+['emph', 'emph']
+>>> [ arena.markup_type_of(index) for index in arena.covering(23) ]
+['document', 'section', 'command', 'command_arg', 'text']
+>>> arena.to_document().content[0].section_title
+'Title'
+"""
+
+import array
+import itertools
+import operator
+
+from tangolib.lexer import ParsePosition
+from tangolib.markup import Markup, Document, Command, Environment, SpanMarkup, DocumentIndex, \
+    ShiftLogEntry, NO_SHIFT
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# the field given by the name column, by markup type
+NAME_FIELDS = { "command": "cmd_name", "environment": "env_name", "section": "section_title",
+                "text": "text", "preformated": "text", "spaces": "spaces", "newlines": "newlines",
+                "document": "filename", "subdoc": "filename", "macrocmddoc": "filename",
+                "macroenvdoc": "filename", "macroenvfooterdoc": "filename" }
+
+# the fields that are not kept as extra fields of the nodes
+# (they are given by the columns, or rebuilt)
+COLUMN_FIELDS = { "doc", "start_pos", "end_pos", "markup_type", "content", "arguments",
+                  "cmd", "env", "string_", "source", "span_start", "span_end", "shift_" }
+
+# the positions given by a property, by slot
+POSITION_PROPERTIES = { "start_pos_": "start_pos", "end_pos_": "end_pos",
+                        "header_end_pos_": "header_end_pos", "footer_start_pos_": "footer_start_pos" }
+
+# the field of the arguments referring to their command or environment
+ARGUMENT_OWNERS = { "command_arg": "cmd", "env_arg": "env" }
+
+# the (documented) fields of the documents, the other ones (lexer,
+# macro definitions, annotations of the processors) are not kept
+DOCUMENT_FIELDS = ( "filename", )
+
+# the position columns of the nodes without position
+NO_POSITION = (-1, -1, -1)
+
+# the children of the nodes in the arena: none, the content, or
+# the arguments of an environment (which are not part of its
+# content) then its content
+(NO_CHILDREN, CONTENT_CHILDREN, ENVIRONMENT_CHILDREN) = range(3)
+
+# how the nodes are built back (cf. `Arena.to_document`)
+(BUILD_SPAN, BUILD_LEAF, BUILD_MARKUP, BUILD_WITH_ARGUMENTS, BUILD_DOCUMENT) = range(5)
+
+# (column, typecode): the offsets are 64 bits, the indices, lines
+# and columns 32 bits, and -1 stands for none
+COLUMNS = ( ("kind", 'B'), ("name", 'i'), ("doc", 'i'), ("parent", 'i'),
+            ("first_child", 'i'), ("next_sibling", 'i'),
+            ("start", 'q'), ("start_line", 'i'), ("start_column", 'i'),
+            ("end", 'q'), ("end_line", 'i'), ("end_column", 'i') )
+
+class ArenaError(Exception):
+    pass
+
+def slot_names(cls):
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get("__slots__", ())
+        names.extend((slots,) if isinstance(slots, str) else slots)
+    return names
+
+class Arena:
+    def __init__(self):
+        for (column, typecode) in COLUMNS:
+            setattr(self, column, array.array(typecode))
+        # the kinds of nodes: (markup type, class)
+        self.kinds = []
+        self.kind_ids = dict()
+        # the string table
+        self.strings = []
+        self.string_ids = dict()
+        # node index -> { field: value } for the other fields
+        self.extras = dict()
+        self.subtree_ends_ = None
+        self.extents_ = None
+
+    def __len__(self):
+        return len(self.kind)
+
+    def kind_id(self, markup_type, cls):
+        key = (markup_type, cls)
+        kind_id = self.kind_ids.get(key)
+        if kind_id is None:
+            if len(self.kinds) == 256:
+                raise ArenaError("Too many kinds of nodes")
+            kind_id = len(self.kinds)
+            self.kinds.append(key)
+            self.kind_ids[key] = kind_id
+        return kind_id
+
+    def string_id(self, string):
+        if string is None:
+            return -1
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(string)
+            self.string_ids[string] = string_id
+        return string_id
+
+    ### building ###
+
+    def kind_info(self, markup_type, cls):
+        """(kind id, name field, extra fields, children mode) of the
+        elements of type `markup_type` and class `cls`; the extra
+        fields are None for the spans."""
+        name_field = NAME_FIELDS.get(markup_type)
+        if issubclass(cls, SpanMarkup):
+            fields = None
+        else:
+            fields = DOCUMENT_FIELDS if issubclass(cls, Document) \
+                else [ POSITION_PROPERTIES.get(slot, slot) for slot in slot_names(cls) ]
+            fields = tuple(field for field in fields if field not in COLUMN_FIELDS and field != name_field)
+        if issubclass(cls, Environment):
+            children = ENVIRONMENT_CHILDREN
+        elif issubclass(cls, Markup):
+            children = CONTENT_CHILDREN
+        else:
+            children = NO_CHILDREN
+        return (self.kind_id(markup_type, cls), name_field, fields, children)
+
+    @staticmethod
+    def from_document(doc):
+        """Build the arena of the tree of `doc` (any element)."""
+        arena = Arena()
+        kind_infos = dict() # (markup type, class) -> kind info
+        string_id = arena.string_id
+        (kinds, names, docs, parents, starts, ends) = ([], [], [], [], [], [])
+        (first_child, next_sibling, last_child) = ([], [], [])
+        indices = dict() # id of an element -> its index
+        # the arguments outside their command or environment
+        # (e.g. in a macro expansion): (index, owner)
+        moved_arguments = []
+        # (element, index of its parent)
+        elements = [ (doc, -1) ]
+        while elements:
+            (element, parent_index) = elements.pop()
+            index = len(kinds)
+            indices[id(element)] = index
+            markup_type = element.markup_type
+            info = kind_infos.get((markup_type, element.__class__))
+            if info is None:
+                info = kind_infos[(markup_type, element.__class__)] = arena.kind_info(markup_type, element.__class__)
+            (kind_id, name_field, fields, children) = info
+            kinds.append(kind_id)
+            element_doc = element.doc
+            docs.append(-1 if element_doc is None else indices.get(id(element_doc), -1))
+            parents.append(parent_index)
+            starts.append(element.start_pos or NO_POSITION)
+            ends.append(element.end_pos or NO_POSITION)
+            first_child.append(-1)
+            next_sibling.append(-1)
+            last_child.append(-1)
+            if parent_index != -1:
+                previous = last_child[parent_index]
+                if previous == -1:
+                    first_child[parent_index] = index
+                else:
+                    next_sibling[previous] = index
+                last_child[parent_index] = index
+
+            if fields is None: # a span: its string is not kept by the tree
+                string = element.string_
+                names.append(string_id(string if string is not None
+                                       else element.source[element.span_start:element.span_end]))
+                continue
+
+            names.append(-1 if name_field is None else string_id(getattr(element, name_field, None)))
+            extras = { field: getattr(element, field) for field in fields if hasattr(element, field) }
+            if markup_type in ARGUMENT_OWNERS:
+                owner = getattr(element, ARGUMENT_OWNERS[markup_type])
+                if parent_index == -1 or indices.get(id(owner)) != parent_index:
+                    moved_arguments.append((index, owner))
+            if children != NO_CHILDREN:
+                content = element.content
+                if isinstance(content, str): # preformated command
+                    extras["content"] = content
+                elif children == ENVIRONMENT_CHILDREN and element.arguments:
+                    elements.extend((child, index) for child in reversed(element.arguments + content))
+                else:
+                    elements.extend((child, index) for child in reversed(content))
+            if extras:
+                arena.extras[index] = extras
+
+        columns = { "kind": kinds, "name": names, "doc": docs, "parent": parents,
+                    "first_child": first_child, "next_sibling": next_sibling }
+        for (prefix, positions) in (("start", starts), ("end", ends)):
+            (columns[prefix + "_line"], columns[prefix + "_column"], columns[prefix]) = (
+                map(operator.itemgetter(field), positions) for field in range(3))
+        for (column, typecode) in COLUMNS:
+            setattr(arena, column, array.array(typecode, columns[column]))
+
+        for (index, owner) in moved_arguments:
+            arena.extras[index] = { "owner": indices.get(id(owner), -1) }
+        return arena
+
+    ### accessors ###
+
+    def markup_type_of(self, index):
+        return self.kinds[self.kind[index]][0]
+
+    def name_of(self, index):
+        name_id = self.name[index]
+        return None if name_id == -1 else self.strings[name_id]
+
+    def children(self, index):
+        child = self.first_child[index]
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    def as_numpy(self, column):
+        """The `column` (e.g. "kind") as a NumPy array, without copying."""
+        if numpy is None:
+            raise ArenaError("NumPy is not available")
+        values = getattr(self, column)
+        return numpy.frombuffer(values, dtype=numpy.dtype(values.typecode))
+
+    ### queries ###
+
+    def find(self, markup_type, name=None):
+        """The indices of the nodes of type `markup_type`
+        (e.g. "command") with the given `name`, if any,
+        in document order."""
+        kind_ids = [ kind_id for (kind_id, (kind_type, cls)) in enumerate(self.kinds) if kind_type == markup_type ]
+        if not kind_ids:
+            return []
+        if name is None:
+            return sorted(index for kind_id in kind_ids for index in all_indices(self.kind, kind_id))
+        name_id = self.string_ids.get(name)
+        if name_id is None:
+            return []
+        kind = self.kind
+        kind_ids = set(kind_ids)
+        return [ index for index in all_indices(self.name, name_id) if kind[index] in kind_ids ]
+
+    def covering(self, offset):
+        """The indices of the nodes covering `offset`, from the root:
+        a node covers the offsets from its start to the end of its
+        last descendant (e.g. a command covers its arguments)."""
+        (start, extents, next_sibling) = (self.start, self.extents(), self.next_sibling)
+        if not len(self) or not start[0] <= offset:
+            return []
+        path = [ 0 ]
+        child = self.first_child[0]
+        while child != -1:
+            if start[child] <= offset < extents[child]:
+                path.append(child)
+                child = self.first_child[child]
+            else:
+                child = next_sibling[child]
+        return path
+
+    def extents(self):
+        # the end offset of each subtree
+        if self.extents_ is None:
+            (parent, extents) = (self.parent, array.array('q', self.end))
+            for index in range(len(self) - 1, 0, -1):
+                parent_index = parent[index]
+                if extents[index] > extents[parent_index]:
+                    extents[parent_index] = extents[index]
+            self.extents_ = extents
+        return self.extents_
+
+    def subtree_ends(self):
+        # the index following the last node of each subtree
+        if self.subtree_ends_ is None:
+            nb_nodes = len(self)
+            (parent, next_sibling) = (self.parent, self.next_sibling)
+            ends = array.array('i', [ nb_nodes ]) * nb_nodes
+            for index in range(1, nb_nodes):
+                sibling = next_sibling[index]
+                ends[index] = ends[parent[index]] if sibling == -1 else sibling
+            self.subtree_ends_ = ends
+        return self.subtree_ends_
+
+    def subtree_sizes(self):
+        """The number of nodes of the subtree of each node."""
+        ends = self.subtree_ends()
+        return array.array('i', (end - index for (index, end) in enumerate(ends)))
+
+    def subtree_size(self, index):
+        return self.subtree_ends()[index] - index
+
+    ### back to markup objects ###
+
+    def build_info(self, markup_type, cls):
+        """(build mode, name field) of the elements of type
+        `markup_type` and class `cls`."""
+        if issubclass(cls, SpanMarkup):
+            mode = BUILD_SPAN
+        elif issubclass(cls, Document):
+            mode = BUILD_DOCUMENT
+        elif issubclass(cls, (Command, Environment)):
+            mode = BUILD_WITH_ARGUMENTS
+        elif issubclass(cls, Markup):
+            mode = BUILD_MARKUP
+        else:
+            mode = BUILD_LEAF
+        return (markup_type, cls, mode, NAME_FIELDS.get(markup_type))
+
+    def to_document(self, index=0):
+        """Build the markup tree of the node `index` (by default the
+        root).  The documents of the tree have no lexer and
+        no macro definitions, their indexes are rebuilt."""
+        from tangolib.parser import Parser
+
+        lex = Parser.shared().prepare_string_lexer("")
+        end = len(self) if index == 0 else self.subtree_ends()[index]
+        (strings, all_extras) = (self.strings, self.extras)
+        build_infos = [ self.build_info(markup_type, cls) for (markup_type, cls) in self.kinds ]
+        nodes = zip(range(index, end), self.kind[index:end], self.name[index:end],
+                    self.doc[index:end], self.parent[index:end],
+                    positions_of(self.start_line, self.start_column, self.start, index, end),
+                    positions_of(self.end_line, self.end_column, self.end, index, end))
+        elements = [] # node - index -> element
+        moved_arguments = []
+        documents = []
+        for (node, kind_id, name_id, doc_index, parent_index, start_pos, end_pos) in nodes:
+            (markup_type, cls, mode, name_field) = build_infos[kind_id]
+            element = object.__new__(cls)
+            element.doc = elements[doc_index - index] if doc_index >= index else None
+            element.shift_ = NO_SHIFT if element.doc is None else element.doc.shift_log
+            element.start_pos_ = start_pos
+            element.end_pos_ = end_pos
+
+            if mode == BUILD_SPAN:
+                element.string_ = strings[name_id] if name_id >= 0 else None
+                element.source = None
+                element.span_start = 0
+                element.span_end = 0
+                elements.append(element)
+                if parent_index >= index:
+                    elements[parent_index - index].content.append(element)
+                continue
+
+            element.markup_type = markup_type
+            if mode != BUILD_LEAF:
+                element.content = []
+            if mode == BUILD_WITH_ARGUMENTS:
+                element.arguments = []
+            elif mode == BUILD_DOCUMENT:
+                (element.lex, element.def_commands_, element.def_environments_) = (lex, dict(), dict())
+                element.shift_ = element.shift_log = ShiftLogEntry()
+                element.index = DocumentIndex()
+                documents.append(element)
+                if markup_type != "document":
+                    element.sublex = lex
+            if name_field is not None:
+                setattr(element, name_field, strings[name_id] if name_id >= 0 else None)
+            extras = all_extras.get(node)
+            owned = markup_type in ARGUMENT_OWNERS
+            if owned:
+                if extras is not None and "owner" in extras:
+                    moved_arguments.append((element, extras["owner"]))
+                    owned = False
+                elif parent_index >= index:
+                    setattr(element, ARGUMENT_OWNERS[markup_type], elements[parent_index - index])
+            elif extras is not None:
+                for (field, value) in extras.items():
+                    setattr(element, field, dict(value) if isinstance(value, dict) else value)
+
+            elements.append(element)
+            if parent_index >= index:
+                parent_element = elements[parent_index - index]
+                if owned:
+                    parent_element.add_argument(element)
+                else:
+                    parent_element.content.append(element)
+
+        for (element, owner) in moved_arguments:
+            setattr(element, ARGUMENT_OWNERS[element.markup_type],
+                    elements[owner - index] if index <= owner < end else None)
+        for document in documents:
+            document.index.add_tree(document)
+        return elements[0]
+
+def positions_of(lines, columns, offsets, start, end):
+    """The positions of the nodes `start` to `end` (excluded)
+    given by the columns `lines`, `columns` and `offsets`."""
+    offsets = offsets[start:end]
+    positions = list(map(tuple.__new__, itertools.repeat(ParsePosition),
+                         zip(lines[start:end], columns[start:end], offsets)))
+    for index in all_indices(offsets, -1):
+        positions[index] = None
+    return positions
+
+
+def all_indices(values, value):
+    """The indices of `value` in the array `values` (each one
+    is found by a scan of the array, in C)."""
+    indices = []
+    index = -1
+    try:
+        while True:
+            index = values.index(value, index + 1)
+            indices.append(index)
+    except ValueError:
+        return indices
@@ -15,6 +15,11 @@ class CmdLineArguments:
         self.code_active = False
         self.safe_mode = False
         self.banner = False
+        self.lexer_profile = None
+        self.include_cache_directory = None
+        self.prefetch_includes = False
+        self.prefetch_workers = None
+        self.recover = False
         self.help = False
         self.extra_options = dict()
 
@@ -26,6 +31,10 @@ Output type = {}
 Modes = {}
 Code Active = {}
 Safe Mode = {}
+Lexer profile = {}
+Include cache directory = {}
+Prefetch includes = {} (workers = {})
+Recover from parse errors = {}
 Input file name = {}
 Output directory = {}
 Extra options = {}
@@ -35,6 +44,11 @@ Extra options = {}
            self.modes,
            self.code_active,
            self.safe_mode,
+           self.lexer_profile,
+           self.include_cache_directory,
+           self.prefetch_includes,
+           self.prefetch_workers,
+           self.recover,
            self.input_filename,
            self.output_directory,
            self.extra_options)
@@ -108,6 +122,41 @@ class CmdLineParser:
             self.cmd_args.safe_mode = True
             return cmd_args[1:]
             
+        elif next_opt == "--lexer-profile":
+            cmd_args = cmd_args[1:]
+            if cmd_args and cmd_args[0] in { "table", "json" }:
+                self.cmd_args.lexer_profile = cmd_args[0]
+                return cmd_args[1:]
+
+            self.cmd_args.lexer_profile = "table"
+            return cmd_args
+
+        elif next_opt == "--include-cache":
+            cmd_args = cmd_args[1:]
+            if not cmd_args:
+                raise CmdLineError("Missing include cache directory")
+            if cmd_args[0].startswith("-"):
+                raise CmdLineError("Missing include cache directory before {}".format(cmd_args[0]))
+
+            self.cmd_args.include_cache_directory = cmd_args[0]
+
+            return cmd_args[1:]
+
+        elif next_opt == "--prefetch-includes":
+            self.cmd_args.prefetch_includes = True
+            cmd_args = cmd_args[1:]
+            if cmd_args and cmd_args[0].isdigit():
+                if int(cmd_args[0]) == 0:
+                    raise CmdLineError("The number of prefetch workers must be positive")
+                self.cmd_args.prefetch_workers = int(cmd_args[0])
+                return cmd_args[1:]
+
+            return cmd_args
+
+        elif next_opt == "--recover":
+            self.cmd_args.recover = True
+            return cmd_args[1:]
+
         elif not next_opt.startswith("-"):
             if self.cmd_args.input_filename is not None:
                 raise CmdLineError("Cannot handle '{}': input file already set".format(next_opt))
@@ -18,10 +18,38 @@ class ERegex:
             raise ValueError("Extended regular expression specification must be  a string")
         self.spec = spec
         self.regex = None
+
+    def first_chars(self):
+        """Return a specification matching (at least) all the characters
+        that can start a match of the expression, or `None`
+        if any character may start a match.
+
+        >>> ERegex("`([^`]*)`").first_chars()
+        '`'
+        >>> ERegex("(?:[ ]*x)+(-)").first_chars()
+        '[ ]|x'
+        >>> ERegex("(a)?x|.").first_chars() is None
+        True
+        """
+        return first_chars(self.spec)
         
     def compile(self, flags=0):
         self.regex = re.compile(self.spec, flags)
 
+    def compile_anchored(self, flags=0):
+        """Compile the expression for matching in place at an arbitrary
+        position of a larger buffer (e.g. with `pattern.match(buf, pos, endpos)`).
+
+        The expression is meant to match from the start of its input
+        (as with `match`), hence the leading line anchors `^` are
+        removed: they would otherwise fail if the position is
+        not at the beginning of a line.
+
+        >>> ERegex("^(=+)").compile_anchored().match("a = b", 2) is not None
+        True
+        """
+        return re.compile(strip_leading_anchors(self.spec), flags)
+
     def match(self, input):
         m = self.regex.match(input)
         if m is None:
@@ -98,6 +126,153 @@ class ERegex:
         def show_groups_by_name(self, show_open, show_close):
             return "\n".join(('    Group <{name}> = {open}{grp}{close}'.format(name=name, open=show_open, close=show_close, grp=self.match.group(name)) for name in self.match.groupdict()))
             
+_GROUP_OPENER = re.compile(r"\((?:\?:|\?P<\w+>)?")
+
+def strip_leading_anchors(spec):
+    """Remove the `^` anchors that precede any matching element of `spec`.
+
+    >>> strip_leading_anchors("^(=+)")
+    '(=+)'
+    >>> strip_leading_anchors("(?:^ *\\n)+")
+    '(?: *\\n)+'
+    >>> strip_leading_anchors("[^x]^")
+    '[^x]^'
+    """
+    pos = 0
+    while pos < len(spec):
+        if spec[pos] == '^':
+            spec = spec[:pos] + spec[pos+1:]
+        else:
+            opener = _GROUP_OPENER.match(spec, pos)
+            if opener is None:
+                break
+            pos = opener.end()
+    return spec
+
+class _FirstChars:
+    """Analysis of the characters that can start a match of a
+    regular expression specification.  The analysis is
+    conservative: in doubt any character can start a match.
+    """
+    QUANTIFIER = re.compile(r"(?:[*?+]|\{(\d*)(?:,\d*)?\})[?+]?")
+    GROUP_OPEN = re.compile(r"\((?:\?(?:P<\w+>|[:=!>]|<[=!]|[aiLmsux-]*:|P=|[aiLmsux]+\)|#|\())?")
+    ZERO_WIDTH_ESCAPES = "bBAZ"
+
+    class Unknown(Exception):
+        pass
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.pos = 0
+
+    def analyse(self):
+        """Return the pair (first chars specs, nullable)."""
+        firsts, nullable = self.alternation()
+        if self.pos != len(self.spec):
+            raise _FirstChars.Unknown()
+        return (firsts, nullable)
+
+    def alternation(self):
+        firsts, nullable = self.sequence()
+        while self.pos < len(self.spec) and self.spec[self.pos] == '|':
+            self.pos += 1
+            alt_firsts, alt_nullable = self.sequence()
+            firsts.extend(alt_firsts)
+            nullable = nullable or alt_nullable
+        return (firsts, nullable)
+
+    def sequence(self):
+        firsts = []
+        nullable = True
+        while self.pos < len(self.spec) and self.spec[self.pos] not in "|)":
+            atom_firsts, atom_nullable = self.atom()
+            quantifier = _FirstChars.QUANTIFIER.match(self.spec, self.pos)
+            if quantifier is not None:
+                self.pos = quantifier.end()
+                if quantifier.group(0)[0] in "*?" or (quantifier.group(0)[0] == '{' and not quantifier.group(1)) \
+                   or (quantifier.group(1) and int(quantifier.group(1)) == 0):
+                    atom_nullable = True
+            if nullable:
+                firsts.extend(atom_firsts)
+                nullable = atom_nullable
+        return (firsts, nullable)
+
+    def atom(self):
+        spec = self.spec
+        ch = spec[self.pos]
+        if ch == '(':
+            opener = _FirstChars.GROUP_OPEN.match(spec, self.pos)
+            kind = opener.group(0)
+            if kind.startswith("(?P=") or kind == "(?(" or kind.endswith(")") or kind == "(?#":
+                raise _FirstChars.Unknown() # backreference, conditional, global flags or comment
+            self.pos = opener.end()
+            firsts, nullable = self.alternation()
+            if self.pos == len(spec):
+                raise _FirstChars.Unknown()
+            self.pos += 1 # closing parenthesis
+            if kind[:3] in ("(?=", "(?!", "(?<"):
+                return ([], True) # lookaround assertion
+            return (firsts, nullable)
+        elif ch == '[':
+            end = self.pos + 1
+            if end < len(spec) and spec[end] == '^':
+                end += 1
+            if end < len(spec) and spec[end] == ']':
+                end += 1
+            while end < len(spec) and spec[end] != ']':
+                end += 2 if spec[end] == '\\' else 1
+            if end >= len(spec):
+                raise _FirstChars.Unknown()
+            firsts = [spec[self.pos:end+1]]
+            self.pos = end + 1
+            return (firsts, False)
+        elif ch == '\\':
+            if self.pos + 1 >= len(spec):
+                raise _FirstChars.Unknown()
+            esc = spec[self.pos+1]
+            if esc in _FirstChars.ZERO_WIDTH_ESCAPES:
+                self.pos += 2
+                return ([], True)
+            elif esc.isdigit():
+                raise _FirstChars.Unknown() # backreference
+            elif esc in "xuUN":
+                raise _FirstChars.Unknown() # (rare) unicode escapes
+            self.pos += 2
+            return ([spec[self.pos-2:self.pos]], False)
+        elif ch in "^$":
+            self.pos += 1
+            return ([], True)
+        elif ch == '.':
+            self.pos += 1
+            return ([None], False) # any character
+        elif ch in "*+?":
+            raise _FirstChars.Unknown()
+        else:
+            self.pos += 1
+            return ([re.escape(ch)], False)
+
+def first_chars(spec):
+    """Return a specification matching (at least) all the characters
+    that can start a match of `spec`, or `None` if any character
+    may start a match (including the empty match).
+
+    >>> first_chars(r"(_)_(?=[^_]+__)")
+    '_'
+    >>> first_chars(r"^(=+)\\s+")
+    '='
+    >>> first_chars(r"a{0,2}b")
+    'a|b'
+    >>> first_chars(r"a*") is None
+    True
+    """
+    try:
+        firsts, nullable = _FirstChars(spec).analyse()
+    except _FirstChars.Unknown:
+        return None
+    if nullable or not firsts or None in firsts:
+        return None
+    return "|".join(firsts)
+
 def backslash():
     return "\\\\"
 
@@ -0,0 +1,130 @@
+"""Exports of the markup trees: XML and JSON lines.
+
+The tree is written in one pass, without recursion, directly to
+a (text) file-like object: the output is flushed by chunks, hence
+the memory used does not depend on the size of the tree.
+
+Each element is described by its class: `xml_tag`,
+`export_fields()` and `export_text()` (cf. `markup.AbstractMarkup`).
+
+>>> import io
+>>> from tangolib.parser import Parser
+>>> doc = Parser().parse_from_string("= A & B =\\n\\n\\\\emph{x<y}\\n")
+>>> out = io.StringIO()
+>>> write_xml(doc, out, positions=False)
+>>> print(out.getvalue(), end="")
+<document filename="&lt;string&gt;">
+  <section title="A &amp; B" name="section" depth="1">
+    <newline count="2" />
+    <command name="emph" opts="{}" preformated="False">
+      <command_arg>
+        <text>x&lt;y</text>
+      </command_arg>
+    </command>
+    <newline count="1" />
+  </section>
+</document>
+>>> out = io.StringIO()
+>>> write_jsonl(doc.content[0], out)
+>>> print(out.getvalue().splitlines()[2])
+{"id": 2, "parent": 0, "type": "command", "name": "emph", "opts": {}, "preformated": false, "start_pos": [3, 1, 11], "end_pos": [3, 6, 16]}
+"""
+
+import io
+import json
+
+# the number of pieces of output kept before writing them
+FLUSH_SIZE = 4096
+
+def xml_escape(string):
+    if "&" in string or "<" in string or ">" in string:
+        return string.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return string
+
+def xml_attributes(element, positions):
+    attributes = []
+    for (name, value) in element.export_fields():
+        if not isinstance(value, int): # the numbers and booleans need no escaping
+            value = xml_escape(str(value)).replace('"', "&quot;")
+        attributes.append(' {}="{}"'.format(name, value))
+    if positions:
+        # as formatted by ParsePosition.__str__
+        for (name, pos) in (("start_pos", element.start_pos), ("end_pos", element.end_pos)):
+            if pos is not None:
+                attributes.append(' {}="{}:{}"'.format(name, pos.lpos, pos.cpos))
+    return "".join(attributes)
+
+def write_xml(element, file, positions=True, indent_level=0, indent_string="  "):
+    """Write the tree of `element` as XML to `file`, with the start
+    and end positions of the elements if `positions` is true."""
+    pieces = []
+    # (element, indent level), or (None, indent level, closing tag)
+    elements = [ (element, indent_level) ]
+    while elements:
+        entry = elements.pop()
+        indent = indent_string * entry[1]
+        element = entry[0]
+        if element is None:
+            pieces.append(indent + entry[2])
+        else:
+            start_tag = "<" + element.xml_tag + xml_attributes(element, positions)
+            text = element.export_text()
+            content = getattr(element, "content", None)
+            if text is not None and "\n" not in text:
+                pieces.append("{}{}>{}</{}>\n".format(indent, start_tag, xml_escape(text), element.xml_tag))
+            elif text is None and not isinstance(content, list):
+                pieces.append(indent + start_tag + " />\n")
+            else:
+                pieces.append(indent + start_tag + ">\n")
+                if text is not None: # one line per line of the text
+                    line_indent = indent + indent_string
+                    pieces.extend(line_indent + xml_escape(line) + "\n" for line in text.splitlines())
+                elements.append((None, entry[1], "</" + element.xml_tag + ">\n"))
+                if isinstance(content, list):
+                    elements.extend((child, entry[1] + 1) for child in reversed(content))
+
+        if len(pieces) >= FLUSH_SIZE:
+            file.write("".join(pieces))
+            pieces.clear()
+    file.write("".join(pieces))
+
+def write_jsonl(element, file, positions=True):
+    """Write the tree of `element` to `file` as JSON lines: one
+    object per element, in document order, with its `id` (its
+    rank in the output), the `id` of its `parent` (None for
+    `element`), its markup `type`, its fields, its `text` (if any)
+    and, if `positions` is true, its start and end positions as
+    [line, column, offset]."""
+    pieces = []
+    encode = json.JSONEncoder(default=str).encode
+    nb_elements = 0
+    # (element, id of its parent)
+    elements = [ (element, None) ]
+    while elements:
+        (element, parent_id) = elements.pop()
+        record = { "id": nb_elements, "parent": parent_id, "type": element.markup_type }
+        record.update(element.export_fields())
+        text = element.export_text()
+        if text is not None:
+            record["text"] = text
+        if positions:
+            record["start_pos"] = element.start_pos
+            record["end_pos"] = element.end_pos
+        pieces.append(encode(record))
+        pieces.append("\n")
+
+        content = getattr(element, "content", None)
+        if isinstance(content, list):
+            elements.extend((child, nb_elements) for child in reversed(content))
+        nb_elements += 1
+
+        if len(pieces) >= FLUSH_SIZE:
+            file.write("".join(pieces))
+            pieces.clear()
+    file.write("".join(pieces))
+
+def xml_string(element, positions=True, indent_level=0, indent_string="  "):
+    """The tree of `element` as an XML string (cf. `write_xml`)."""
+    out = io.StringIO()
+    write_xml(element, out, positions, indent_level, indent_string)
+    return out.getvalue()
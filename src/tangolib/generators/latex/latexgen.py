@@ -3,6 +3,7 @@
 
 from tangolib.generator import DocumentGenerator, CommandGenerator, EnvironmentGenerator, SectionGenerator
 from tangolib.generator import TextGenerator, PreformatedGenerator, SpacesGenerator, NewlinesGenerator
+from tangolib.parser import depth_of_section
 
 class LatexOutput:
     def __init__(self):
@@ -41,26 +42,12 @@ class LatexOutput:
         return "" if not self.output else "".join([str_ for (_,__,str_) in self.output])
 
 def guess_document_class(document):
-    """A relatively silly heuristics to guess the document class.
+    """A relatively silly heuristics to guess the document class:
+    a book if there are parts or chapters (cf. the index of the document).
     """
-    node = document
-    nodes = []
-    search_more = True
-    while search_more:
-        if node.is_markup() and node.markup_type == "section":
-            if section_of_depth(section.depth) == "section":
-                return "article"
-            elif section_of_depth(section.depth) == "chapter":
-                return "book"
-            elif section_of_depth(section.depth) == "part":
-                return "book"
-            else:
-                return None
-        nodes = nodes.extend(node.content)
-        if nodes:
-            node = nodes.pop()
-        else:
-            search_more = False
+    section_depths = document.index.section_depths()
+    if section_depths and section_depths[0] <= depth_of_section("chapter"):
+        return "book"
 
     # by default use article
     return "article"
@@ -0,0 +1,312 @@
+"""A cache of the parsed included documents.
+
+The documents are cached by resolved path and content hash
+(and the path is only checked again if its modification time
+or size changed), in memory for the whole process and also,
+optionally, in a directory. The cache can be filled in advance
+by parsing the included files in parallel (see `prefetch_includes`).
+
+The cache keeps the trees in serialized form (cf. `tangolib.serialize`)
+with the macros they define, hence each hit returns a new copy of the
+tree that can be changed freely by the processors.
+
+The files of the cache directory are trusted as much as the included
+files themselves: the templates of the cached macros may hold python
+code, run when the macros are expanded.
+"""
+
+import hashlib
+import os
+
+import tangolib.globalvars as globvars
+from tangolib import serialize
+from tangolib.macros import DefCommand, DefEnvironment
+from tangolib.markup import SubDocument
+from tangolib.template import Template
+
+# the version of the serialized form (part of the keys on disk)
+FORMAT_VERSION = 5
+
+class IncludeCacheEntry:
+    def __init__(self, input, payload):
+        self.input = input
+        self.payload = payload
+
+class IncludeCache:
+    def __init__(self, cache_directory=None):
+        self.cache_directory = cache_directory
+        # (resolved path, content hash) -> entry
+        self.entries = dict()
+        # resolved path -> (modification time, size, content hash)
+        self.file_stats = dict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+    def clear(self):
+        self.entries.clear()
+        self.file_stats.clear()
+
+    def stats(self):
+        return { 'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                 'prefetched': self.prefetched, 'entries': len(self.entries) }
+
+    def __str__(self):
+        return "IncludeCache(hits={}, disk_hits={}, misses={}, prefetched={}, entries={})".format(
+            self.hits, self.disk_hits, self.misses, self.prefetched, len(self.entries))
+
+    def parse_include(self, parent_doc, filename, start_pos, read_input):
+        """Return the parsed subdocument of `filename`, included at
+        `start_pos` in `parent_doc`: a new copy if it is cached, and
+        otherwise parsed from the input given by `read_input()`.
+
+        The macros defined in the included document are registered
+        in the parent document in both cases.
+        """
+        path = os.path.realpath(filename)
+        file_stat = stat_of(path)
+
+        # unchanged file: no need to read it
+        entry = self.lookup(path, file_stat)
+        if entry is not None:
+            self.hits += 1
+            return self.load(entry, parent_doc, filename, start_pos)
+
+        input = read_input()
+        key = self.key_of(path, file_stat, input)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return self.load(entry, parent_doc, filename, start_pos)
+
+        payload = self.read_payload(key)
+        if payload is not None:
+            self.disk_hits += 1
+            entry = IncludeCacheEntry(input, payload)
+            self.entries[key] = entry
+            return self.load(entry, parent_doc, filename, start_pos)
+
+        self.misses += 1
+        (sub_doc, def_commands, def_environments) = parse_subdocument(parent_doc, filename, start_pos, input)
+        self.store(path, file_stat, input, dump_subdocument(sub_doc, def_commands, def_environments))
+        return sub_doc
+
+    def lookup(self, path, file_stat):
+        """Return the entry of `path` if the file is unchanged
+        since it was cached (same modification time and size)."""
+        known = self.file_stats.get(path)
+        if file_stat is not None and known is not None and known[:2] == file_stat:
+            return self.entries.get((path, known[2]))
+        return None
+
+    def key_of(self, path, file_stat, input):
+        content_hash = hashlib.sha256(input.encode("utf-8", "surrogatepass")).hexdigest()
+        if file_stat is not None:
+            self.file_stats[path] = file_stat + (content_hash,)
+        return (path, content_hash)
+
+    def store(self, path, file_stat, input, payload):
+        key = self.key_of(path, file_stat, input)
+        self.entries[key] = IncludeCacheEntry(input, payload)
+        self.write_payload(key, payload)
+
+    def load(self, entry, parent_doc, filename, start_pos):
+        try:
+            (sub_doc, def_commands, def_environments) = load_subdocument(entry.payload, parent_doc, entry.input)
+        except serialize.SerializationError:
+            # e.g. a corrupted file in the cache directory
+            (sub_doc, def_commands, def_environments) = parse_subdocument(parent_doc, filename, start_pos, entry.input)
+            entry.payload = dump_subdocument(sub_doc, def_commands, def_environments)
+            return sub_doc
+        sub_doc.filename = filename
+        sub_doc.start_pos = start_pos
+        for (def_cmd_name, def_cmd) in def_commands:
+            parent_doc.register_def_command(def_cmd_name, def_cmd)
+        for (def_env_name, def_env) in def_environments:
+            parent_doc.register_def_environment(def_env_name, def_env)
+        return sub_doc
+
+    ### on-disk cache ###
+
+    def payload_filename(self, key):
+        (path, content_hash) = key
+        name = hashlib.sha256("{}\0{}\0{}".format(FORMAT_VERSION, path, content_hash).encode("utf-8", "surrogatepass")).hexdigest()
+        return os.path.join(self.cache_directory, name + ".tree")
+
+    def read_payload(self, key):
+        if self.cache_directory is None:
+            return None
+        try:
+            with open(self.payload_filename(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write_payload(self, key, payload):
+        if self.cache_directory is None:
+            return
+        filename = self.payload_filename(key)
+        tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+        try:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            with open(tmp_filename, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_filename, filename)
+        except OSError:
+            pass # the on-disk cache is only an optimization
+
+def stat_of(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def parse_subdocument(parent_doc, filename, start_pos, input):
+    """Parse `input` as a subdocument of `parent_doc`, and
+    return it with the macros (commands and environments)
+    it defines, as lists of pairs (name, definition)."""
+    from tangolib.parser import Parser
+
+    def_commands = { name: parent_doc.fetch_def_command(name) for name in parent_doc.known_def_commands() }
+    def_environments = { name: parent_doc.fetch_def_environment(name) for name in parent_doc.known_def_environments() }
+
+    parser = Parser.shared()
+    sub_doc = parser.parse_sub_string(input, lambda sub_lex: SubDocument(parent_doc, filename, start_pos, sub_lex))
+
+    new_def_commands = [ (name, parent_doc.fetch_def_command(name)) for name in parent_doc.known_def_commands()
+                         if def_commands.get(name) is not parent_doc.fetch_def_command(name) ]
+    new_def_environments = [ (name, parent_doc.fetch_def_environment(name)) for name in parent_doc.known_def_environments()
+                             if def_environments.get(name) is not parent_doc.fetch_def_environment(name) ]
+    return (sub_doc, new_def_commands, new_def_environments)
+
+def template_fields(tpl):
+    return (tpl.template, tpl.escape_var, tpl.escape_inline, tpl.escape_block,
+            tpl.escape_block_open, tpl.escape_block_close, tpl.escape_emit_function,
+            tpl.filename, tpl.base_pos)
+
+def template_of(fields):
+    (template, escape_var, escape_inline, escape_block, escape_block_open,
+     escape_block_close, escape_emit_function, filename, base_pos) = fields
+    return Template(template, globvars.TANGO_EVAL_GLOBAL_ENV,
+                    escape_var=escape_var, escape_inline=escape_inline, escape_block=escape_block,
+                    escape_block_open=escape_block_open, escape_block_close=escape_block_close,
+                    escape_emit_function=escape_emit_function, filename=filename, base_pos=base_pos)
+
+def dump_subdocument(sub_doc, def_commands, def_environments):
+    """The serialized form of a parsed subdocument: its tree, then the
+    macros it defines, with the sources of their (uncompiled) templates."""
+    out = bytearray()
+    tree = serialize.dumps(sub_doc)
+    serialize.write_varint(out, len(tree))
+    out += tree
+    serialize.write_value(out, [ (name, def_cmd.cmd_arity, def_cmd.cmd_start_pos, def_cmd.cmd_end_pos,
+                                  template_fields(def_cmd.cmd_template))
+                                 for (name, def_cmd) in def_commands ])
+    serialize.write_value(out, [ (name, def_env.env_arity, def_env.env_start_pos, def_env.env_end_pos,
+                                  template_fields(def_env.env_header_tpl), template_fields(def_env.env_footer_tpl))
+                                 for (name, def_env) in def_environments ])
+    return bytes(out)
+
+def load_subdocument(payload, parent_doc, input):
+    from tangolib.parser import Parser
+
+    reader = serialize.Reader(payload)
+    try:
+        tree = reader.read_bytes(reader.read_varint())
+        commands = reader.read_value()
+        environments = reader.read_value()
+    except (IndexError, ValueError) as e:
+        raise serialize.SerializationError("Corrupted data: {}".format(e))
+
+    sub_doc = serialize.loads(tree)
+    if not isinstance(sub_doc, SubDocument):
+        raise serialize.SerializationError("Not a subdocument")
+    sub_doc.doc = parent_doc
+    sub_doc.lex = sub_doc.sublex = Parser.shared().prepare_string_lexer(input)
+
+    def_commands = [ (name, DefCommand(sub_doc, name, arity, start_pos, end_pos, template_of(tpl)))
+                     for (name, arity, start_pos, end_pos, tpl) in commands ]
+    def_environments = [ (name, DefEnvironment(sub_doc, name, arity, start_pos, end_pos,
+                                               template_of(header_tpl), template_of(footer_tpl)))
+                         for (name, arity, start_pos, end_pos, header_tpl, footer_tpl) in environments ]
+    return (sub_doc, def_commands, def_environments)
+
+### parallel prefetch of the included documents ###
+
+def literal_include_filenames(doc):
+    """Return the file names of the \\include commands of `doc`
+    whose argument is a literal path (in document order)."""
+    filenames = []
+    for element in doc.index.commands("include"):
+        if len(element.arguments) == 1:
+            arg_content = element.arguments[0].content
+            if len(arg_content) == 1 and arg_content[0].markup_type in { "text", "preformated" }:
+                filenames.append(arg_content[0].text)
+    return filenames
+
+def init_prefetch_worker():
+    # a placeholder: the templates are rebuilt with the actual environment when loading
+    globvars.TANGO_EVAL_GLOBAL_ENV = dict()
+
+def prefetch_subdocument(filename):
+    """Parse the included file `filename` (in a worker process).
+    Return its (stat, input, serialized subdocument, included file names),
+    or None if it cannot be parsed: the include processor then
+    reports the error."""
+    from tangolib.markup import Document
+    from tangolib.parser import Parser
+
+    path = os.path.realpath(filename)
+    file_stat = stat_of(path)
+    try:
+        with open(filename, "r") as f:
+            input = f.read()
+        parent_doc = Document("<prefetch>", Parser.shared().prepare_string_lexer(""))
+        (sub_doc, def_commands, def_environments) = parse_subdocument(parent_doc, filename, parent_doc.start_pos, input)
+        payload = dump_subdocument(sub_doc, def_commands, def_environments)
+    except Exception:
+        return None
+    return (file_stat, input, payload, literal_include_filenames(sub_doc))
+
+def prefetch_includes(doc, max_workers=None, cache=None):
+    """Parse in parallel, in a pool of processes, the files included
+    (with a literal path) by `doc` and by these files, and store
+    the results in the include cache. Return the number of
+    parsed files."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    if cache is None:
+        cache = get_include_cache()
+
+    nb_parsed = 0
+    seen = set()
+    filenames = literal_include_filenames(doc)
+    with ProcessPoolExecutor(max_workers, initializer=init_prefetch_worker) as executor:
+        while filenames:
+            to_parse = []
+            for filename in filenames:
+                path = os.path.realpath(filename)
+                if path not in seen:
+                    seen.add(path)
+                    if cache.lookup(path, stat_of(path)) is None:
+                        to_parse.append(filename)
+
+            filenames = []
+            for (filename, result) in zip(to_parse, executor.map(prefetch_subdocument, to_parse)):
+                if result is not None:
+                    (file_stat, input, payload, sub_filenames) = result
+                    cache.store(os.path.realpath(filename), file_stat, input, payload)
+                    cache.prefetched += 1
+                    nb_parsed += 1
+                    filenames.extend(sub_filenames)
+
+    return nb_parsed
+
+# the process-wide cache
+INCLUDE_CACHE = IncludeCache()
+
+def get_include_cache():
+    return INCLUDE_CACHE
@@ -2,19 +2,40 @@
 The Tango lexer
 '''
 
+import array
+import bisect
+import codecs
+import collections
+import io
+import json
+import mmap
+import os
+import re
+import time
+
+import tangolib.eregex as ere
 from tangolib.cmdparse import GLOBAL_COMMAND_LINE_ARGUMENTS
 
-class ParsePosition:
+EOL_REGEX = re.compile('\n')
+
+REGEX_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+class ParsePosition(collections.namedtuple("ParsePosition", "lpos cpos offset", defaults=(1, 1, 0))):
     '''
     Representation of parse positions.
 
     A parse position is a line position, a character position
     and an absolute offset into a character buffer.
+
+    Parse positions are immutable (named tuples without
+    instance dictionary), hence hashable and shareable.
+
+    >>> ParsePosition(2, 3, 14).next_char()
+    ParsePosition(lpos=2, cpos=4, offset=15)
+    >>> ParsePosition(2, 3, 14) == ParsePosition(2, 3, 14)
+    True
     '''
-    def __init__(self, lpos=1, cpos=1, offset=0):
-        self.lpos = lpos
-        self.cpos = cpos
-        self.offset = offset
+    __slots__ = ()
 
     def next_char(self, delta=1):
         return ParsePosition(self.lpos, self.cpos + delta, self.offset + delta)
@@ -25,10 +46,6 @@ class ParsePosition:
     def next_line(self):
         return ParsePosition(self.lpos + 1, 1, self.offset + 1)
 
-    def __repr__(self):
-        return "ParsePosition(lpos={0}, cpos={1}, offset={2})"\
-            .format(self.lpos, self.cpos, self.offset)
-
     def __str__(self):
         return "{0}:{1}".format(self.lpos, self.cpos)
 
@@ -37,6 +54,8 @@ class Token:
     '''
     Representation of lexer tokens.
     '''
+    __slots__ = ('token_type', 'value', 'start_pos', 'end_pos')
+
     def __init__(self, token_type, token_value, start_pos, end_pos):
         self.token_type = token_type
         self.value = token_value
@@ -44,13 +63,122 @@ class Token:
         self.end_pos = end_pos
 
     def __str__(self):
-        return "{}::{}".format(self.value, self.type)
+        return "{}::{}".format(self.value, self.token_type)
 
     def __repr__(self):
         return "Token({0}, {1}, start_pos={2}, end_pos={3})"\
             .format(self.token_type, self.value,
                     self.start_pos, self.end_pos)
 
+class SubMatch:
+    '''The match of a fused recognizer within the match of a master
+    regexp (cf. `CompiledLexer`): the value of its tokens.  It reads
+    as the match of the recognizer alone, whose `nb_groups` groups
+    are numbered from the group `base` of the master match.
+
+    >>> import re
+    >>> match = re.compile("(?P<r0>a(b))|(?P<r1>(c)(d))").match("cd")
+    >>> value = SubMatch(match, match.lastindex, 2)
+    >>> (value.group(0), value.group(2), value.start(2), value.groups())
+    ('cd', 'd', 1, ('c', 'd'))
+    '''
+    __slots__ = ('match', 'base', 'nb_groups')
+
+    def __init__(self, match, base, nb_groups):
+        self.match = match
+        self.base = base
+        self.nb_groups = nb_groups
+
+    def group(self, *groups):
+        if len(groups) > 1:
+            return tuple(self.group(group) for group in groups)
+        group = groups[0] if groups else 0
+        if isinstance(group, str):
+            return self.match.group(group)
+        return self.match.group(self.base + group)
+
+    __getitem__ = group
+
+    def groups(self, default=None):
+        return tuple(default if value is None else value
+                     for value in self.match.groups()[self.base:self.base + self.nb_groups])
+
+    def start(self, group=0):
+        return self.match.start(self.base + group)
+
+    def end(self, group=0):
+        return self.match.end(self.base + group)
+
+    def span(self, group=0):
+        return self.match.span(self.base + group)
+
+    @property
+    def string(self):
+        return self.match.string
+
+    def __repr__(self):
+        return "<SubMatch span={}, match={!r}>".format(self.span(), self.group(0))
+
+class TokenTable:
+    '''
+    A compact representation of a token stream, for the tools
+    only needing the token types and extents (e.g. syntax
+    highlighting or statistics).
+
+    The tokens are stored column-wise in unsigned int arrays: the
+    type ids (indexes in `type_names`) and the start and end offsets.
+
+    >>> table = TokenTable()
+    >>> table.append("word", 0, 5)
+    >>> table.append("space", 5, 6)
+    >>> table.append("word", 6, 11)
+    >>> len(table)
+    3
+    >>> table[2]
+    ('word', 6, 11)
+    >>> table.count("word")
+    2
+    '''
+    def __init__(self):
+        self.type_names = []
+        self.type_ids = dict()
+        self.types = array.array('I')
+        self.starts = array.array('I')
+        self.ends = array.array('I')
+
+    def type_id(self, token_type):
+        try:
+            return self.type_ids[token_type]
+        except KeyError:
+            type_id = len(self.type_names)
+            self.type_names.append(token_type)
+            self.type_ids[token_type] = type_id
+            return type_id
+
+    def append(self, token_type, start_offset, end_offset):
+        self.types.append(self.type_id(token_type))
+        self.starts.append(start_offset)
+        self.ends.append(end_offset)
+
+    def count(self, token_type):
+        if token_type not in self.type_ids:
+            return 0
+        return self.types.count(self.type_ids[token_type])
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        return (self.type_names[self.types[index]], self.starts[index], self.ends[index])
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self[index]
+
+    def __repr__(self):
+        return "TokenTable(nb_tokens={}, token_types={})".format(len(self), self.type_names)
+
+
 class Recognizer:
     def __init__(self, token_type):
         self.token_type = token_type
@@ -58,6 +186,33 @@ class Recognizer:
     def recognize(self, tokenizer):
         raise NotImplementedError("Abstract method")
 
+    def master_spec(self):
+        """The regular expression specification of the recognizer,
+        for fusing it into a master regexp (cf. `CompiledLexer`),
+        or `None` if the recognizer cannot be fused."""
+        return None
+
+    def master_value(self, match, group):
+        """The value of the token matched by the group `group` of
+        the master regexp, or `None` if it is not a token."""
+        return match.group(group)
+
+    def spec(self):
+        """A description of the recognized tokens (for profiling)."""
+        return ""
+
+    def only_at_eof(self):
+        return False
+
+    def may_start_with(self, char):
+        """Tell if a token can start with `char` (conservatively)."""
+        return True
+
+    def first_chars_spec(self):
+        """A regexp specification of the characters that can start a
+        token, `None` if any, or the empty string if none."""
+        return None
+
 class EndOfInput(Recognizer):
     def __init__(self, token_type="end_of_input"):
         super().__init__(token_type)
@@ -68,6 +223,18 @@ class EndOfInput(Recognizer):
         else:
             return None
 
+    def spec(self):
+        return "<end of input>"
+
+    def only_at_eof(self):
+        return True
+
+    def may_start_with(self, char):
+        return False
+
+    def first_chars_spec(self):
+        return ""
+
         def __repr__(self):
             return "EndOfInput(token_type={})".format(self.token_type)
 
@@ -90,6 +257,18 @@ class Char(Recognizer):
         else:
             return None
 
+    def spec(self):
+        return self.char
+
+    def master_spec(self):
+        return re.escape(self.char)
+
+    def may_start_with(self, char):
+        return char == self.char
+
+    def first_chars_spec(self):
+        return self.master_spec()
+
         def __repr__(self):
             return "Char(token_type={},char={})".format(self.token_type, repr(self.char))
 
@@ -113,6 +292,18 @@ class CharIn(Recognizer):
         else:
             return None
 
+    def spec(self):
+        return "[{}]".format("".join(sorted(self.charset)))
+
+    def master_spec(self):
+        return "[{}]".format("".join(re.escape(ch) for ch in sorted(self.charset)))
+
+    def may_start_with(self, char):
+        return char in self.charset
+
+    def first_chars_spec(self):
+        return self.master_spec()
+
     def __str__(self):
         return "[{}]::{}".format("".join(self.charset),self.token_type)
 
@@ -135,6 +326,18 @@ class CharNotIn(Recognizer):
         else:
             return None
 
+    def spec(self):
+        return "[^{}]".format("".join(sorted(self.charset)))
+
+    def master_spec(self):
+        return "[^{}]".format("".join(re.escape(ch) for ch in sorted(self.charset)))
+
+    def may_start_with(self, char):
+        return char not in self.charset
+
+    def first_chars_spec(self):
+        return self.master_spec()
+
     def __str__(self):
         return "[^{}]::{}".format("".join(self.charset),self.token_type)
         
@@ -155,6 +358,18 @@ class Literal(Recognizer):
         else:
             return None
 
+    def spec(self):
+        return self.literal
+
+    def master_spec(self):
+        return re.escape(self.literal)
+
+    def may_start_with(self, char):
+        return self.literal[:1] in ("", char)
+
+    def first_chars_spec(self):
+        return re.escape(self.literal[0]) if self.literal else None
+
     def __repr__(self):
         return "Literal(token_type={},literal={})".format(self.token_type, repr(self.literal))
 
@@ -162,35 +377,148 @@ class Literal(Recognizer):
         return "'{}'::{}".format(self.literal, self.token_type)
 
 class Regexp(Recognizer):
-    def __init__(self, token_type, regex, re_flags=0):
+    def __init__(self, token_type, regex, re_flags=0, first_chars=None):
         super().__init__(token_type)
         self.regex = regex
         self.regex.compile(re_flags)
+        self.re_flags = re_flags
+        self.pattern = self.regex.compile_anchored(re_flags)
         self.excludes = set()
+        # the characters that can start a token: explicitly
+        # given as a string, or else from the regexp analysis
+        if first_chars is not None:
+            self.first_chars = frozenset(first_chars)
+            self.first_chars_spec_ = "[{}]".format("".join(re.escape(ch) for ch in sorted(self.first_chars)))
+        else:
+            self.first_chars_spec_ = self.regex.first_chars()
+            if self.first_chars_spec_ is not None and re_flags & re.IGNORECASE:
+                self.first_chars_spec_ = "(?i:{})".format(self.first_chars_spec_)
+            self.first_chars = None if self.first_chars_spec_ is None \
+                               else re.compile(self.first_chars_spec_)
 
     def recognize(self, tokenizer):
         # BREAKPOINT >>> # import pdb; pdb.set_trace()  # <<< BREAKPOINT #
         start_pos = tokenizer.pos
-        line = tokenizer.peek_line
-        if line == None:
-            return None
-        match = self.regex.match(line)
+        match = tokenizer.match(self.pattern)
         if match is not None:
             for exclude in self.excludes:
                 if match.group(0) == exclude:
                     return None
                 
-            tokenizer.forward(len(match.group(0)))
+            tokenizer.advance(match.end() - match.start())
             return Token(self.token_type, match, start_pos, tokenizer.pos)
         else:
             return None
 
+    def master_value(self, match, group):
+        if self.excludes and match.group(group) in self.excludes:
+            return None
+        return SubMatch(match, group, self.pattern.groups)
+
+    def spec(self):
+        return self.regex.spec
+
+    def may_start_with(self, char):
+        if self.first_chars is None:
+            return True
+        elif isinstance(self.first_chars, frozenset):
+            return char in self.first_chars
+        else:
+            return self.first_chars.match(char) is not None
+
+    def first_chars_spec(self):
+        return self.first_chars_spec_
+
+    def master_spec(self):
+        if REGEX_BACKREFERENCE.search(self.regex.spec):
+            return None # group numbers are shifted in the master regexp
+        flags = ""
+        for flag, flag_char in ((re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.VERBOSE, 'x')):
+            if self.re_flags & flag:
+                flags += flag_char
+        if self.re_flags & ~(re.IGNORECASE | re.MULTILINE | re.DOTALL | re.VERBOSE):
+            return None # global-only flag
+        return "(?{}:{})".format(flags, ere.strip_leading_anchors(self.regex.spec))
+
     def __repr__(self):
         return "Regexp(token_type={},regex={})".format(self.token_type, self.regex)
 
     def __str__(self):
         return '"{}"::{}'.format(self.re_str, self.token_type)            
         
+class DelimiterRun(Recognizer):
+    '''Recognize an opening delimiter made of `length` characters
+    `char` (e.g. `*` or `__`).  The delimiter must be followed by another
+    character and closed on the same line: the next `char` of the line
+    must start a run of (at least) `length` characters.  The token
+    value is `char`.
+
+    This is equivalent to a regexp with a lookahead such as
+    `(\\*)\\*(?=[^*]+\\*\\*)`, but the positions of the
+    `char` characters are indexed once for each line (and then
+    found by bisection) instead of scanning the rest of the line
+    at each delimiter.
+
+    >>> tokens = make_string_tokenizer("a **b c** d\\n**e")
+    >>> strong = DelimiterRun("strong", '*', 2)
+    >>> tokens.advance(2)
+    >>> strong.recognize(tokens)
+    Token(strong, *, start_pos=1:3, end_pos=1:5)
+    >>> tokens.advance(8)
+    >>> strong.recognize(tokens) is None
+    True
+    '''
+    def __init__(self, token_type, char, length=1):
+        super().__init__(token_type)
+        self.char = char
+        self.length = length
+        self.delimiter = char * length
+
+    def delimiters(self, tokenizer, buffer, start, end):
+        """The positions of the delimiter characters in `buffer[start:end]`,
+        indexed at the first call for a given line.  The index is kept
+        by the tokenizer (cf. `Tokenizer.line_delimiters`), hence
+        shared by the recognizers of the same character."""
+        index = tokenizer.line_delimiters.get(self.char)
+        if index is None or not (index[0] is buffer and end == index[2] and index[1] <= start):
+            positions = []
+            pos = buffer.find(self.char, start, end)
+            while pos != -1:
+                positions.append(pos)
+                pos = buffer.find(self.char, pos + 1, end)
+            index = (buffer, start, end, positions)
+            tokenizer.line_delimiters[self.char] = index
+        return index[3]
+
+    def recognize(self, tokenizer):
+        (buffer, start, end) = tokenizer.line_span()
+        after = start + self.length
+        if after >= end or not buffer.startswith(self.delimiter, start) or buffer[after] == self.char:
+            return None
+        delimiters = self.delimiters(tokenizer, buffer, start, end)
+        index = bisect.bisect_right(delimiters, after)
+        if index == len(delimiters):
+            return None # not closed
+        closing = delimiters[index]
+        if closing + self.length > end or not buffer.startswith(self.delimiter, closing):
+            return None # closed by a shorter run
+        start_pos = tokenizer.pos
+        tokenizer.advance(self.length)
+        return Token(self.token_type, self.char, start_pos, tokenizer.pos)
+
+    def spec(self):
+        return self.delimiter
+
+    def may_start_with(self, char):
+        return char == self.char
+
+    def first_chars_spec(self):
+        return re.escape(self.char)
+
+    def __repr__(self):
+        return "DelimiterRun(token_type={},char={},length={})".format(self.token_type, repr(self.char), self.length)
+
+
 class Tokenizer:
     '''
     The main tokenizer class that transforms a flow
@@ -200,6 +528,9 @@ class Tokenizer:
     '''
     def __init__(self, tokenizer_backend):
         self.tokenizer_backend = tokenizer_backend
+        # (for the delimiter runs) char -> (buffer, start, end, positions),
+        # the positions of char in the last indexed line `buffer[start:end]`
+        self.line_delimiters = dict()
 
     @property
     def pos(self):
@@ -226,11 +557,38 @@ class Tokenizer:
         return self.tokenizer_backend.next_char()
 
     def forward(self, nb_chars):
-        self.tokenizer_backend.forward(nb_chars) 
+        return self.tokenizer_backend.forward(nb_chars)
+
+    def advance(self, nb_chars):
+        self.tokenizer_backend.advance(nb_chars)
+
+    def match(self, pattern):
+        return self.tokenizer_backend.match(pattern)
+
+    def next_run(self, pattern):
+        return self.tokenizer_backend.next_run(pattern)
+
+    def skip_run(self, pattern):
+        self.tokenizer_backend.skip_run(pattern)
+
+    def source_string(self):
+        return self.tokenizer_backend.source_string()
+
+    def line_span(self):
+        return self.tokenizer_backend.line_span()
 
     def peek_chars(self, nb_chars):
         return self.tokenizer_backend.peek_chars(nb_chars)
 
+    def find(self, sub, offset):
+        return self.tokenizer_backend.find(sub, offset)
+
+    def find_balanced(self, open_char, close_char, offset):
+        return self.tokenizer_backend.find_balanced(open_char, close_char, offset)
+
+    def skip_to_end(self, nb_chars=0):
+        self.tokenizer_backend.skip_to_end(nb_chars)
+
     def show_lines(self, nb_lines, cursor="_"):
         return self.tokenizer_backend.show_lines(nb_lines, cursor)
 
@@ -249,10 +607,19 @@ class TokenizerBackend:
     def peek_char(self):
         raise NotImplementedError("Abstract method")
 
+    def source_string(self):
+        """The whole input as a string, if it is available
+        (the offsets are then indices in this string)."""
+        return None
+
 
 class StringTokenizer(TokenizerBackend):
     """A tokenizer backend for string inputs.
 
+    Only the current offset is maintained while moving through
+    the input, line and column positions are resolved on demand
+    from a precomputed table of newline offsets.
+
     >>> tokens = StringTokenizer("hello crazy\\nworld")
     >>> tokens.peek_char()
     'h'
@@ -312,7 +679,7 @@ class StringTokenizer(TokenizerBackend):
     >>> tokens.next_char()
     Traceback (most recent call last):
       ...
-    AssertionError: cannot move foward at end of input
+    AssertionError: cannot move forward at end of input
 
 
     >>> tokens.move_to(2)
@@ -324,82 +691,198 @@ class StringTokenizer(TokenizerBackend):
     """
     def __init__(self, input_string):
         self.offset = 0
-        self.lpos = 1
-        self.cpos = 1
-        self.eol_map = dict() # Map: offset of newline -> last character pos
         self.input_string = input_string
         self.input_length = len(input_string)
-    
+        # offsets of all the newline characters, for line/column resolution
+        self.eol_offsets = [m.start() for m in EOL_REGEX.finditer(input_string)]
+        # the last resolved line (start offset, end offset, line number)
+        self.line_start = 0
+        self.line_end = self.eol_offsets[0] if self.eol_offsets else self.input_length
+        self.line_lpos = 1
+        self.last_pos = ParsePosition(1, 1, 0)
+
     def pos(self):
-        return ParsePosition(self.lpos, self.cpos, self.offset)
+        if self.offset != self.last_pos.offset:
+            self.last_pos = self.position_at(self.offset)
+        return self.last_pos
+
+    def position_at(self, offset):
+        """Compute the parse position of an arbitrary offset.
+
+        >>> tokens = StringTokenizer("hello crazy\\nworld")
+        >>> tokens.position_at(11)
+        ParsePosition(lpos=1, cpos=12, offset=11)
+        >>> tokens.position_at(14)
+        ParsePosition(lpos=2, cpos=3, offset=14)
+        """
+        if not (self.line_start <= offset <= self.line_end):
+            nb_eols = bisect.bisect_left(self.eol_offsets, offset)
+            self.line_start = self.eol_offsets[nb_eols - 1] + 1 if nb_eols > 0 else 0
+            self.line_end = self.eol_offsets[nb_eols] if nb_eols < len(self.eol_offsets) else self.input_length
+            self.line_lpos = nb_eols + 1
+        return ParsePosition(self.line_lpos, offset - self.line_start + 1, offset)
 
     def at_eof(self):
         return self.offset == self.input_length
 
     def peek_char(self):
-        if self.at_eof():
+        if self.offset == self.input_length:
             return None
         return self.input_string[self.offset]
 
     def peek_chars(self, nb_chars):
-        ret = ""
-        for i in range(nb_chars):
-            if self.offset+i>= self.input_length:
-                return None
-            ret += self.input_string[self.offset+i]
-        return ret
+        if self.offset + nb_chars > self.input_length:
+            return None
+        return self.input_string[self.offset:self.offset + nb_chars]
 
     def peek_line(self):
         if self.offset == self.input_length:
             return None
-        
-        line = ""
-        offset = self.offset
-        while offset < self.input_length:
-            ch = self.input_string[offset]
-            if ch == '\n':
-                return line + ch
-            else:
-                line += ch
-                offset += 1
-        return line
+        eol = self.input_string.find('\n', self.offset)
+        if eol == -1:
+            return self.input_string[self.offset:]
+        return self.input_string[self.offset:eol + 1]
+
+    def match(self, pattern):
+        """Match a compiled pattern at the current offset, without copying.
+
+        The match is bounded by the end of the current line (the
+        newline included), the match object refers to the whole input.
+
+        >>> import re
+        >>> tokens = StringTokenizer("hello crazy\\nworld")
+        >>> tokens.advance(6)
+        >>> tokens.match(re.compile("[a-z]+")).group(0)
+        'crazy'
+        >>> tokens.match(re.compile("crazy.world")) is None
+        True
+        """
+        if self.offset == self.input_length:
+            return None
+        return pattern.match(self.input_string, self.offset, self.end_of_line(self.offset))
+
+    def line_span(self):
+        """Return the rest of the current line, without copying: a triple
+        (buffer, start, end) such that the line is `buffer[start:end]`
+        (the newline included).
+
+        >>> tokens = StringTokenizer("hello crazy\\nworld")
+        >>> tokens.advance(6)
+        >>> tokens.line_span()
+        ('hello crazy\\nworld', 6, 12)
+        """
+        if self.offset == self.input_length:
+            return (self.input_string, self.offset, self.offset)
+        return (self.input_string, self.offset, self.end_of_line(self.offset))
+
+    def next_run(self, pattern):
+        """Consume the next character, then all the following ones
+        matched by `pattern`, and return the consumed string.
+
+        >>> import re
+        >>> tokens = StringTokenizer("hello crazy\\nworld")
+        >>> tokens.next_run(re.compile("[a-z]*"))
+        'hello'
+        >>> tokens.next_run(re.compile("[a-z]*"))
+        ' crazy'
+        """
+        assert self.offset < self.input_length, "cannot move forward at end of input"
+        start = self.offset
+        self.offset = pattern.match(self.input_string, start + 1).end()
+        return self.input_string[start:self.offset]
+
+    def skip_run(self, pattern):
+        """Like `next_run`, but the consumed characters are not copied.
+
+        >>> import re
+        >>> tokens = StringTokenizer("hello crazy\\nworld")
+        >>> tokens.skip_run(re.compile("[a-z]*"))
+        >>> tokens.offset
+        5
+        >>> tokens.source_string()[0:tokens.offset]
+        'hello'
+        """
+        assert self.offset < self.input_length, "cannot move forward at end of input"
+        self.offset = pattern.match(self.input_string, self.offset + 1).end()
+
+    def source_string(self):
+        return self.input_string
+
+    def find(self, sub, offset):
+        """Return the offset of the first occurrence of `sub` from
+        `offset` (without moving), or -1.
+
+        >>> tokens = StringTokenizer("hello crazy\\nworld")
+        >>> tokens.find("o", 5)
+        13
+        """
+        return self.input_string.find(sub, offset)
+
+    def find_balanced(self, open_char, close_char, offset):
+        """Return the offset of the `close_char` that balances an
+        `open_char` just before `offset` (without moving), or -1.
+        The input is scanned from one closing character to the next.
+
+        >>> tokens = StringTokenizer("{a {b} {{c}} d} e")
+        >>> tokens.find_balanced("{", "}", 1)
+        14
+        >>> tokens.find_balanced("{", "}", 15)
+        -1
+        """
+        depth = 1
+        while True:
+            close = self.input_string.find(close_char, offset)
+            if close == -1:
+                return -1
+            depth += self.input_string.count(open_char, offset, close) - 1
+            if depth == 0:
+                return close
+            offset = close + 1
+
+    def skip_to_end(self, nb_chars=0):
+        """Move forward to `nb_chars` characters before the end of
+        the input (unless the current offset is already after).
+
+        >>> tokens = StringTokenizer("hello crazy\\nworld")
+        >>> tokens.skip_to_end(2)
+        >>> tokens.offset
+        15
+        """
+        self.offset = max(self.offset, self.input_length - nb_chars)
+
+    def end_of_line(self, offset):
+        """Return the offset just after the end of the line of `offset`."""
+        if not (self.line_start <= offset <= self.line_end):
+            self.position_at(offset)
+        if self.line_end == self.input_length:
+            return self.input_length
+        return self.line_end + 1
 
     def next_char(self):
         assert self.offset < self.input_length, "cannot move forward at end of input"
-        ch = self.peek_char()
-        if ch == '\n':
-            self.eol_map[self.offset] = self.cpos
-            self.lpos += 1
-            self.cpos = 0
-        # in any case
-        self.cpos += 1
         self.offset += 1
-        return ch
+        return self.input_string[self.offset - 1]
 
     def forward(self, nb_chars):
-        ret = ""
-        for i in range(nb_chars):
-            ret += self.next_char()
-        return ret
+        start = self.offset
+        self.offset = min(start + nb_chars, self.input_length)
+        assert self.offset - start == nb_chars, "cannot move forward at end of input"
+        return self.input_string[start:self.offset]
+
+    def advance(self, nb_chars):
+        assert self.offset + nb_chars <= self.input_length, "cannot move forward at end of input"
+        self.offset += nb_chars
 
     def prev_char(self):
         assert self.offset >= 1, "cannot move backward at start of input"
-        if (self.offset - 1) in self.eol_map:
-            # cancel a new line
-            self.lpos -= 1
-            self.cpos = self.eol_map[self.offset-1]
-            del self.eol_map[self.offset-1]
-        else:
-            self.cpos -= 1
-        # finally decrement the offset
         self.offset -= 1
         return self.input_string[self.offset]
-    
+
     def backward(self, nb_chars):
-        ret = ""
-        for i in range(nb_chars):
-            ret = self.prev_char() + ret
-        return ret
+        end = self.offset
+        self.offset = max(end - nb_chars, 0)
+        assert end - self.offset == nb_chars, "cannot move backward at start of input"
+        return self.input_string[self.offset:end]
 
     def move_to(self, noffset):
         if noffset >= self.offset:
@@ -414,12 +897,7 @@ class StringTokenizer(TokenizerBackend):
         >>> tokens.find_start_of_line(14)
         12
         """
-        while soffset > 0:
-            if self.input_string[soffset-1] == '\n':
-                return soffset
-            else:
-                soffset -= 1
-        return soffset
+        return self.input_string.rfind('\n', 0, soffset) + 1
     
     def show_lines(self, nb_lines, cursor):
         nb_found = 0
@@ -440,48 +918,694 @@ def make_string_tokenizer(input_string):
 
 
 class FileTokenizer(TokenizerBackend):
-    pass
+    """A streaming tokenizer backend for (large) UTF-8 files.
+
+    The file is memory-mapped and decoded incrementally, by chunks
+    of `chunk_size` bytes, into a window of characters around the
+    current offset.  The chunks behind the current offset are dropped
+    as the window moves forward, so the memory used is bounded by
+    the window (a few chunks, or the longest line) and not by the size
+    of the file.  A checkpoint (char offset, byte offset, decoder state,
+    line position) is recorded at the start of each chunk, to restart
+    the decoding when moving back before the window.
+
+    As when reading a file in text mode, line endings are translated
+    to `'\\n'`.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile("wb", suffix=".tango.tex", delete=False) as f:
+    ...     _ = f.write("héllo crazy\\r\\nwörld".encode("utf-8"))
+    >>> tokens = FileTokenizer(f.name, chunk_size=4)
+    >>> tokens.forward(5)
+    'héllo'
+    >>> tokens.pos()
+    ParsePosition(lpos=1, cpos=6, offset=5)
+    >>> tokens.peek_line()
+    ' crazy\\n'
+    >>> tokens.forward(9)
+    ' crazy\\nwö'
+    >>> tokens.pos()
+    ParsePosition(lpos=2, cpos=3, offset=14)
+    >>> tokens.move_to(2)
+    'llo crazy\\nwö'
+    >>> tokens.next_char()
+    'l'
+    >>> tokens.move_to(16)
+    'lo crazy\\nwörl'
+    >>> tokens.next_char()
+    'd'
+    >>> tokens.at_eof()
+    True
+    >>> tokens.close()
+    >>> os.remove(f.name)
+    """
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, filename, chunk_size=CHUNK_SIZE):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        with open(filename, "rb") as f:
+            self.input_size = os.fstat(f.fileno()).st_size
+            if self.input_size > 0:
+                self.input_bytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else: # empty files cannot be mapped
+                self.input_bytes = b""
+        self.decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(), translate=True)
+        # checkpoints at chunk starts: (offset, byte offset, decoder state, lpos, line start)
+        self.checkpoints = [(0, 0, self.decoder.getstate(), 1, 0)]
+        self.checkpoint_offsets = [0]
+        self.offset = 0
+        self.restart(0)
+
+    def close(self):
+        if self.input_size > 0:
+            self.input_bytes.close()
+
+    def restart(self, offset):
+        """Decode again, from the last checkpoint before `offset`."""
+        index = bisect.bisect_right(self.checkpoint_offsets, max(offset - 1, 0)) - 1
+        (start, byte_start, decoder_state, lpos, line_start) = self.checkpoints[index]
+        self.decoder.setstate(decoder_state)
+        self.byte_end = byte_start
+        self.window = ""
+        self.window_start = start
+        self.window_end = start
+        self.window_lpos = lpos
+        self.window_line_start = line_start
+        self.window_chunks = [] # start offsets of the chunks in the window
+        self.window_eols = [] # offsets of the newline characters in the window
+        self.line_start = line_start
+        self.line_end = -1
+        self.line_lpos = lpos
+        self.last_pos = None
+
+    def decoded_all(self):
+        return self.byte_end == self.input_size
+
+    def extend(self, scan_offset=None):
+        """Drop the chunks behind the current offset (the previous
+        character is kept), or behind `scan_offset` while scanning
+        ahead (cf. `scanned`), then decode the next chunk of the file."""
+        if scan_offset is None:
+            scan_offset = self.offset
+        keep = bisect.bisect_right(self.window_chunks, max(scan_offset - 1, 0)) - 1
+        if keep > 0:
+            start = self.window_chunks[keep]
+            nb_eols = bisect.bisect_left(self.window_eols, start)
+            if nb_eols > 0:
+                self.window_lpos += nb_eols
+                self.window_line_start = self.window_eols[nb_eols - 1] + 1
+                del self.window_eols[:nb_eols]
+            self.window = self.window[start - self.window_start:]
+            self.window_start = start
+            del self.window_chunks[:keep]
+
+        offset = self.window_end
+        if offset > self.checkpoint_offsets[-1]:
+            line_start = self.window_eols[-1] + 1 if self.window_eols else self.window_line_start
+            self.checkpoints.append((offset, self.byte_end, self.decoder.getstate(),
+                                     self.window_lpos + len(self.window_eols), line_start))
+            self.checkpoint_offsets.append(offset)
+        byte_end = min(self.byte_end + self.chunk_size, self.input_size)
+        chunk = self.decoder.decode(self.input_bytes[self.byte_end:byte_end], byte_end == self.input_size)
+        self.byte_end = byte_end
+        self.window_chunks.append(offset)
+        self.window += chunk
+        self.window_end += len(chunk)
+        self.window_eols.extend(offset + m.start() for m in EOL_REGEX.finditer(chunk))
+
+    def fill(self, offset):
+        """Decode until the window reaches `offset` (or the end of the file)."""
+        while self.window_end < offset and not self.decoded_all():
+            self.extend()
+        return offset <= self.window_end
+
+    def pos(self):
+        if self.last_pos is None or self.offset != self.last_pos.offset:
+            self.last_pos = self.position_at(self.offset)
+        return self.last_pos
+
+    def position_at(self, offset):
+        """Compute the parse position of an offset of the window."""
+        if not (self.line_start <= offset <= self.line_end):
+            self.locate_line(offset)
+        return ParsePosition(self.line_lpos, offset - self.line_start + 1, offset)
+
+    def locate_line(self, offset):
+        while True:
+            nb_eols = bisect.bisect_left(self.window_eols, offset)
+            if nb_eols < len(self.window_eols) or self.decoded_all():
+                break
+            self.extend()
+        self.line_start = self.window_eols[nb_eols - 1] + 1 if nb_eols > 0 else self.window_line_start
+        self.line_end = self.window_eols[nb_eols] if nb_eols < len(self.window_eols) else self.window_end
+        self.line_lpos = self.window_lpos + nb_eols
+
+    def find(self, sub, offset):
+        """Return the offset of the first occurrence of `sub` from
+        `offset` (at or after the current offset), or -1.  The chunks
+        are dropped behind the scan (cf. `scanned`)."""
+        start = offset
+        while True:
+            index = self.window.find(sub, start - self.window_start)
+            if index >= 0:
+                return self.scanned(self.window_start + index)
+            if self.decoded_all():
+                return self.scanned(-1)
+            # an occurrence may overlap the end of the window
+            start = max(offset, self.window_end - len(sub) + 1)
+            self.extend(start)
+
+    def find_balanced(self, open_char, close_char, offset):
+        """Return the offset of the `close_char` that balances an
+        `open_char` just before `offset` (at or after the current
+        offset), or -1 (cf. `StringTokenizer.find_balanced`).  The
+        chunks are dropped behind the scan (cf. `scanned`)."""
+        depth = 1
+        while True:
+            close = self.window.find(close_char, offset - self.window_start)
+            end = self.window_end if close == -1 else self.window_start + close
+            depth += self.window.count(open_char, offset - self.window_start, end - self.window_start)
+            if close >= 0:
+                depth -= 1
+                if depth == 0:
+                    return self.scanned(end)
+                offset = end + 1
+            elif self.decoded_all():
+                return self.scanned(-1)
+            else:
+                offset = end
+                self.extend(offset)
+
+    def scanned(self, result):
+        # a long scan drops the chunks from the current offset: the
+        # window is then decoded again from there, as needed (so that
+        # an unterminated body does not decode the rest of the file
+        # into the window)
+        if self.window_start > self.offset:
+            self.restart(self.offset)
+        return result
+
+    def skip_to_end(self, nb_chars=0):
+        """Move forward to `nb_chars` characters before the end of the
+        file (unless the current offset is already after), chunk by
+        chunk: the chunks behind are dropped as for any move forward."""
+        while not self.decoded_all():
+            self.offset = max(self.offset, self.window_end - nb_chars)
+            self.extend()
+        self.offset = max(self.offset, self.window_end - nb_chars)
+
+    def end_of_line(self, offset):
+        """Return the offset just after the end of the line of `offset`."""
+        if not (self.line_start <= offset <= self.line_end):
+            self.locate_line(offset)
+        if self.line_end == self.window_end:
+            return self.window_end
+        return self.line_end + 1
+
+    def at_eof(self):
+        return not self.fill(self.offset + 1)
+
+    def peek_char(self):
+        if self.offset < self.window_end or self.fill(self.offset + 1):
+            return self.window[self.offset - self.window_start]
+        return None
+
+    def peek_chars(self, nb_chars):
+        if not self.fill(self.offset + nb_chars):
+            return None
+        start = self.offset - self.window_start
+        return self.window[start:start + nb_chars]
+
+    def peek_line(self):
+        if self.at_eof():
+            return None
+        end = self.end_of_line(self.offset) # may move the window
+        return self.window[self.offset - self.window_start:end - self.window_start]
+
+    def match(self, pattern):
+        """Match a compiled pattern at the current offset, bounded by
+        the end of the current line.  The match object refers to the
+        window, its positions are thus only meaningful relatively to
+        its start."""
+        if self.at_eof():
+            return None
+        end = self.end_of_line(self.offset)
+        return pattern.match(self.window, self.offset - self.window_start, end - self.window_start)
+
+    def line_span(self):
+        """Return the rest of the current line in the window (cf. `StringTokenizer.line_span`)."""
+        if self.at_eof():
+            start = self.offset - self.window_start
+            return (self.window, start, start)
+        end = self.end_of_line(self.offset) # may move the window
+        return (self.window, self.offset - self.window_start, end - self.window_start)
+
+    def next_run(self, pattern):
+        """Consume the next character, then all the following ones
+        matched by `pattern` in the window, and return the consumed string."""
+        assert not self.at_eof(), "cannot move forward at end of input"
+        start = self.offset - self.window_start
+        end = pattern.match(self.window, start + 1).end()
+        self.offset += end - start
+        return self.window[start:end]
+
+    def skip_run(self, pattern):
+        self.next_run(pattern)
+
+    def next_char(self):
+        assert not self.at_eof(), "cannot move forward at end of input"
+        self.offset += 1
+        return self.window[self.offset - 1 - self.window_start]
+
+    def forward(self, nb_chars):
+        assert self.fill(self.offset + nb_chars), "cannot move forward at end of input"
+        start = self.offset - self.window_start
+        self.offset += nb_chars
+        return self.window[start:start + nb_chars]
+
+    def advance(self, nb_chars):
+        assert self.fill(self.offset + nb_chars), "cannot move forward at end of input"
+        self.offset += nb_chars
+
+    def prev_char(self):
+        return self.backward(1)
+
+    def backward(self, nb_chars):
+        assert self.offset >= nb_chars, "cannot move backward at start of input"
+        end = self.offset
+        self.offset -= nb_chars
+        if self.offset < self.window_start:
+            self.restart(self.offset)
+            self.fill(end)
+        return self.window[self.offset - self.window_start:end - self.window_start]
+
+    def move_to(self, noffset):
+        if noffset >= self.offset:
+            return self.forward(noffset - self.offset)
+        else:
+            return self.backward(self.offset - noffset)
+
+    def find_start_of_line(self, soffset):
+        """Find the start of the line of `soffset`, or the start
+        of the window if the line begins before."""
+        return self.window.rfind('\n', 0, soffset - self.window_start) + 1 + self.window_start
+
+    def show_lines(self, nb_lines, cursor):
+        nb_found = 0
+        soffset = self.find_start_of_line(self.offset)
+        ret = ""
+        while (nb_found <= nb_lines) and self.fill(soffset + 1):
+            ch = self.window[soffset - self.window_start]
+            if ch == '\n':
+                nb_found += 1
+            if soffset == self.offset:
+                ret += cursor
+            ret += ch
+            soffset += 1
+        return ret
+
+
+class RecognizerProfile:
+    '''The work of a recognizer: attempts, hits, misses and time (in seconds).'''
+    __slots__ = ('token_type', 'spec', 'attempts', 'hits', 'misses', 'time')
 
+    def __init__(self, token_type, spec):
+        self.token_type = token_type
+        self.spec = spec
+        self.attempts = 0
+        self.hits = 0
+        self.misses = 0
+        self.time = 0.0
+
+    def as_dict(self):
+        return { 'token_type': self.token_type, 'spec': self.spec,
+                 'attempts': self.attempts, 'hits': self.hits,
+                 'misses': self.misses, 'time': self.time }
+
+class LexerProfile:
+    '''
+    Profiling counters of lexers (cf. `Lexer.enable_profiling`).
+
+    The recognizers are keyed by their token type and specification
+    (e.g. the regexp), the characters outside tokens (consumed as
+    plain text) are also counted.
+
+    >>> lex = Lexer(make_string_tokenizer("a-b"), Char("a", 'a'), Char("b", 'b'))
+    >>> profile = lex.enable_profiling()
+    >>> lex.token_table()
+    TokenTable(nb_tokens=2, token_types=['a', 'b'])
+    >>> sorted((rec.token_type, rec.attempts, rec.hits, rec.misses) for rec in profile.recognizer_profiles())
+    [('a', 2, 1, 1), ('b', 2, 1, 1)]
+    >>> profile.text_chars
+    1
+    '''
+    CONTROL_CHARS = str.maketrans({ '\n': '\\n', '\r': '\\r', '\t': '\\t', '\f': '\\f' })
+
+    def __init__(self):
+        self.profiles = dict() # (token_type, spec) -> recognizer profile
+        self.text_chars = 0
+
+    def profile_of(self, recognizer):
+        key = (recognizer.token_type, recognizer.spec())
+        try:
+            return self.profiles[key]
+        except KeyError:
+            profile = RecognizerProfile(*key)
+            self.profiles[key] = profile
+            return profile
+
+    def recognizer_profiles(self):
+        """The recognizer profiles, by decreasing time."""
+        return sorted(self.profiles.values(), key=lambda profile: profile.time, reverse=True)
+
+    def as_dict(self):
+        return { 'recognizers': [profile.as_dict() for profile in self.recognizer_profiles()],
+                 'text_chars': self.text_chars }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def table(self):
+        ret = "{:<18} {:>9} {:>9} {:>9} {:>10}  {}\n".format("token type", "attempts", "hits", "misses", "time (ms)", "spec")
+        for profile in self.recognizer_profiles():
+            ret += "{:<18} {:>9} {:>9} {:>9} {:>10.2f}  {}\n".format(profile.token_type, profile.attempts,
+                                                                     profile.hits, profile.misses,
+                                                                     profile.time * 1000,
+                                                                     profile.spec.translate(LexerProfile.CONTROL_CHARS))
+        ret += "characters outside tokens: {}\n".format(self.text_chars)
+        return ret
+
+class RecognizerSet:
+    '''An ordered set of recognizers, with the tables that
+    the lexers derive from them: the first-character dispatch,
+    the text run pattern and the master regexps.
+
+    The tables are filled lazily and only depend on the
+    recognizers, hence a set can be shared by any number of
+    lexers (e.g. one for each included file or macro expansion)
+    and each table is only built once.
+
+    >>> recs = RecognizerSet([Char("a", 'a'), Regexp("num", ere.ERegex(r"[0-9]+"))])
+    >>> [ rec.token_type for rec in recs.candidates('1') ]
+    ['num']
+    >>> lex1 = CompiledLexer(make_string_tokenizer("a1"), recognizer_set=recs)
+    >>> lex2 = CompiledLexer(make_string_tokenizer("12a"), recognizer_set=recs)
+    >>> lex2.next_token().value.group(0)
+    '12'
+    >>> lex1.steps_of('1') is lex2.steps_of('1')
+    True
+    '''
+    def __init__(self, recognizers):
+        self.recognizers = tuple(recognizers)
+        # first-character dispatch: char -> recognizers that may start with it
+        self.dispatch = dict()
+        self.text_run_pattern = compile_text_run_pattern(self.recognizers)
+        # (for compiled lexers) char -> master steps of the candidates
+        self.dispatch_steps = dict()
+        self.master_steps = dict() # candidate recognizers -> master steps
+
+    def __len__(self):
+        return len(self.recognizers)
+
+    def __iter__(self):
+        return iter(self.recognizers)
+
+    def candidates(self, char):
+        """The recognizers that may recognize a token starting with `char`,
+        in priority order (all of them at end of input)."""
+        if char is None:
+            return self.recognizers
+        try:
+            return self.dispatch[char]
+        except KeyError:
+            recognizers = tuple(rec for rec in self.recognizers if rec.may_start_with(char))
+            self.dispatch[char] = recognizers
+            return recognizers
+
+    def steps_of(self, char):
+        """The master steps for a token starting with `char`
+        (cf. `compile_master_steps`)."""
+        try:
+            return self.dispatch_steps[char]
+        except KeyError:
+            candidates = self.candidates(char)
+            steps = self.master_steps.get(candidates)
+            if steps is None:
+                steps = compile_master_steps(candidates)
+                self.master_steps[candidates] = steps
+            self.dispatch_steps[char] = steps
+            return steps
+
+    def __repr__(self):
+        return "RecognizerSet([{}])".format(", ".join(rec.token_type for rec in self.recognizers))
 
 class Lexer:
     '''The lexer generates the flow of tokens from
     the tokenizer.
 
+    The tokens recognized in advance (by `peek_token` or given
+    back by `putback`) are kept in a lookahead buffer, hence
+    each token is only recognized once.  The tokenizer is then
+    ahead of the (logical) position of the lexer: it is moved
+    back to the first buffered token when the characters
+    are consumed directly.
     '''
-    def __init__(self, tokenizer, *recognizers):
+    def __init__(self, tokenizer, *recognizers, recognizer_set=None):
         self.tokenizer = tokenizer
-        self.recognizers = recognizers
+        if recognizer_set is None:
+            recognizer_set = RecognizerSet(recognizers)
+        self.recognizer_set = recognizer_set
+        self.recognizers = recognizer_set.recognizers
+        # first-character dispatch: char -> recognizers that may start with it
+        self.dispatch = recognizer_set.dispatch
+        self.text_run_pattern = recognizer_set.text_run_pattern
+        self.lookahead = collections.deque()
+
+    def candidates(self, char):
+        """The recognizers that may recognize a token starting with `char`,
+        in priority order (all of them at end of input)."""
+        return self.recognizer_set.candidates(char)
+
+    def sync(self):
+        """Drop the lookahead tokens and move the tokenizer back
+        to the position of the first one."""
+        if self.lookahead:
+            self.tokenizer.set_pos(self.lookahead[0].start_pos)
+            self.lookahead.clear()
 
     @property
     def pos(self):
+        if self.lookahead:
+            return self.lookahead[0].start_pos
         return self.tokenizer.pos
 
     def show_line(self, cursor="_"):
         return self.show_lines(1, cursor)
 
     def show_lines(self, nb_lines=2, cursor="_"):
+        self.sync()
         return self.tokenizer.show_lines(nb_lines, cursor)
 
     def next_char(self):
+        if self.lookahead:
+            self.sync()
         return self.tokenizer.next_char()
 
     def next_chars(self, nb_chars):
+        if self.lookahead:
+            self.sync()
         return self.tokenizer.forward(nb_chars)
 
+    def next_until(self, literal):
+        """Consume the characters up to the next occurrence of `literal`
+        (excluded) and return them, in one step.  If there is none,
+        all the characters are consumed but the last `len(literal)-1`
+        ones, and None is returned.
+
+        >>> lex = Lexer(make_string_tokenizer("x = {1: 2} }}} rest"))
+        >>> lex.next_until("}}}")
+        'x = {1: 2} '
+        >>> lex.next_until("}}}")
+        ''
+        >>> lex.next_chars(3)
+        '}}}'
+        >>> lex.next_until("}}}") is None
+        True
+        >>> lex.pos
+        ParsePosition(lpos=1, cpos=18, offset=17)
+        """
+        if self.lookahead:
+            self.sync()
+        start = self.tokenizer.pos.offset
+        end = self.tokenizer.find(literal, start)
+        if end == -1:
+            self.tokenizer.skip_to_end(len(literal) - 1)
+            return None
+        return self.tokenizer.forward(end - start)
+
+    def next_balanced(self, open_char, close_char):
+        """Consume the characters up to the `close_char` that balances
+        an (already consumed) `open_char`, and return them (the closing
+        character is consumed but not returned).  The input is scanned
+        in bulk, from one closing character to the next.  If there is
+        none, the whole input is consumed and None is returned (as for
+        `next_until`).
+
+        >>> lex = Lexer(make_string_tokenizer("a {b} {{c}} d} e"))
+        >>> lex.next_balanced('{', '}')
+        'a {b} {{c}} d'
+        >>> lex.next_char()
+        ' '
+        >>> lex.next_balanced('{', '}') is None
+        True
+        >>> lex.at_eof()
+        True
+        """
+        if self.lookahead:
+            self.sync()
+        start = self.tokenizer.pos.offset
+        close = self.tokenizer.find_balanced(open_char, close_char, start)
+        if close == -1:
+            self.tokenizer.skip_to_end()
+            return None
+        text = self.tokenizer.forward(close - start)
+        self.tokenizer.next_char()
+        return text
+
+    def next_text_run(self):
+        """Consume the next character and the following ones that
+        cannot start any token, and return them as a string."""
+        if self.lookahead:
+            self.sync()
+        if self.text_run_pattern is None:
+            return self.tokenizer.next_char()
+        return self.tokenizer.next_run(self.text_run_pattern)
+
+    def skip_text_run(self):
+        """Consume the same characters as `next_text_run`, without
+        copying them: they can be found in the source string
+        (cf. `source_string`) before the new offset."""
+        if self.lookahead:
+            self.sync()
+        if self.text_run_pattern is None:
+            self.tokenizer.advance(1)
+        else:
+            self.tokenizer.skip_run(self.text_run_pattern)
+
+    def source_string(self):
+        """The whole input as a string, or `None` if it is not
+        available (e.g. for a streamed file)."""
+        return self.tokenizer.source_string()
+
     def peek_char(self):
+        if self.lookahead:
+            self.sync()
         return self.tokenizer.peek_char
 
     def peek_chars(self, nb_chars):
+        if self.lookahead:
+            self.sync()
         return self.tokenizer.peek_chars(nb_chars)
 
     def next_token(self):
-        for rec in self.recognizers:
+        if self.lookahead:
+            return self.lookahead.popleft()
+        return self.recognize_token()
+
+    def peek_token(self, k=1):
+        """Return the `k`-th next token without consuming it,
+        or `None` if there is no token at this position
+        (i.e. some character is not part of a token before).
+
+        >>> lex = Lexer(make_string_tokenizer("ab"), Char("a", 'a'), Char("b", 'b'))
+        >>> lex.peek_token(2).token_type
+        'b'
+        >>> lex.next_token().token_type
+        'a'
+        >>> lex.pos
+        ParsePosition(lpos=1, cpos=2, offset=1)
+        """
+        while len(self.lookahead) < k:
+            token = self.recognize_token()
+            if token is None:
+                return None
+            self.lookahead.append(token)
+        return self.lookahead[k - 1]
+
+    def recognize_token(self):
+        """Recognize the token at the position of the tokenizer."""
+        char = self.tokenizer.peek_char
+        recognizers = self.dispatch.get(char)
+        if recognizers is None:
+            recognizers = self.candidates(char)
+        for rec in recognizers:
             token = rec.recognize(self.tokenizer)
             if token is not None:
                 return token
 
         return None
                 
+    def enable_profiling(self, profile=None):
+        """Record the work of the recognizers in `profile` (a new
+        `LexerProfile` if not given), which is returned.
+
+        While profiling, the recognizers are tried one at a time
+        (also by a compiled lexer), hence the lexer is slower.
+        """
+        if profile is None:
+            profile = LexerProfile()
+        self.profile = profile
+        self.recognizer_profiles = { rec: profile.profile_of(rec) for rec in self.recognizers }
+        self.recognize_token = self.profiled_recognize_token
+        self.next_text_run = self.profiled_next_text_run
+        self.skip_text_run = self.profiled_skip_text_run
+        return profile
+
+    def profiled_recognize_token(self):
+        for rec in self.candidates(self.tokenizer.peek_char):
+            rec_profile = self.recognizer_profiles[rec]
+            start = time.perf_counter()
+            token = rec.recognize(self.tokenizer)
+            rec_profile.time += time.perf_counter() - start
+            rec_profile.attempts += 1
+            if token is not None:
+                rec_profile.hits += 1
+                return token
+            rec_profile.misses += 1
+
+        return None
+
+    def profiled_next_text_run(self):
+        run = Lexer.next_text_run(self)
+        self.profile.text_chars += len(run)
+        return run
+
+    def profiled_skip_text_run(self):
+        start = self.pos.offset
+        Lexer.skip_text_run(self)
+        self.profile.text_chars += self.tokenizer.pos.offset - start
+
+    def token_table(self):
+        """Consume the remaining input and return its tokens
+        as a token table (the characters outside tokens are skipped).
+
+        >>> lex = Lexer(make_string_tokenizer("a-b"), Char("a", 'a'), Char("b", 'b'), EndOfInput("eoi"))
+        >>> list(lex.token_table())
+        [('a', 0, 1), ('b', 2, 3), ('eoi', 3, 3)]
+        """
+        table = TokenTable()
+        while True:
+            tok = self.next_token()
+            if tok is not None:
+                table.append(tok.token_type, tok.start_pos.offset, tok.end_pos.offset)
+                if tok.start_pos.offset == tok.end_pos.offset and self.at_eof():
+                    return table  # end of input token
+            elif self.at_eof():
+                return table
+            else:
+                self.next_text_run()
+
     def __next__(self):
         tok =  self.next_token()
         if tok is None:
@@ -494,20 +1618,137 @@ class Lexer:
         Warning: this does not check the token was the correct
         one, only we go back to the position corresponding
         to the start of the token.
+
+        Putting back the last token is free: it is pushed
+        in the lookahead buffer.
         """
-        self.tokenizer.set_pos(token.start_pos)
+        if self.lookahead:
+            end_offset = self.lookahead[0].start_pos.offset
+        else:
+            end_offset = self.tokenizer.pos.offset
+        if token.end_pos.offset == end_offset:
+            self.lookahead.appendleft(token)
+        else:
+            self.move_to(token.start_pos)
 
     def move_to(self, pos):
+        self.lookahead.clear()
         self.tokenizer.set_pos(pos)
 
     def at_eof(self):
+        if self.lookahead:
+            self.sync()
         return self.tokenizer.at_eof()
 
     def __iter__(self):
         return self
             
-def make_file_tokenizer(filename):
-    pass
+class CompiledLexer(Lexer):
+    '''A lexer that fuses the ordered recognizers into a master
+    regular expression: an alternation with one named group
+    for each recognizer, in priority order.
+
+    Each position then costs a single regexp call, and the token
+    is built from the match: its alternative (the outermost group,
+    `match.lastindex`) gives the recognizer, whose value for the
+    match is the token value (cf. `Recognizer.master_value`).
+    The recognizers that cannot be fused are tried in sequence,
+    at their place in the order.
+    '''
+    def __init__(self, tokenizer, *recognizers, recognizer_set=None):
+        super().__init__(tokenizer, *recognizers, recognizer_set=recognizer_set)
+        # first-character dispatch: char -> master steps of the candidates
+        self.dispatch_steps = self.recognizer_set.dispatch_steps
+
+    def steps_of(self, char):
+        return self.recognizer_set.steps_of(char)
+
+    def recognize_token(self):
+        tokenizer = self.tokenizer
+        char = tokenizer.peek_char
+        steps = self.dispatch_steps.get(char)
+        if steps is None:
+            if char is None:
+                return super().recognize_token()
+            steps = self.steps_of(char)
+
+        for step in steps:
+            if type(step) is not tuple:
+                token = step.recognize(tokenizer)
+                if token is not None:
+                    return token
+            else:
+                (master_pattern, recognizers, alternatives) = step
+                match = tokenizer.match(master_pattern)
+                if match is not None:
+                    group = match.lastindex
+                    (index, rec) = alternatives[group]
+                    value = rec.master_value(match, group)
+                    if value is not None:
+                        start_pos = tokenizer.pos
+                        tokenizer.advance(match.end() - match.start())
+                        return Token(rec.token_type, value, start_pos, tokenizer.pos)
+                    # an excluded match: try the next recognizers
+                    for rec in recognizers[index + 1:]:
+                        token = rec.recognize(tokenizer)
+                        if token is not None:
+                            return token
+
+        return None
+
+def compile_text_run_pattern(recognizers):
+    """Compile the pattern of the (possibly empty) runs of characters
+    that cannot start any token, or `None` if every character might."""
+    specs = []
+    for rec in recognizers:
+        spec = rec.first_chars_spec()
+        if spec is None:
+            return None
+        elif spec != "":
+            specs.append(spec)
+    if not specs:
+        return re.compile(r"[\s\S]*")
+    return re.compile(r"(?:(?!{})[\s\S])*".format("|".join(dict.fromkeys(specs))))
+
+def compile_master_steps(recognizers):
+    """Group the consecutive fusable recognizers into master regexps.
+
+    The result is a list of steps, either a triple (master pattern,
+    fused recognizers, alternatives) or a single recognizer that
+    cannot be fused.  The alternatives map the group number of each
+    alternative to the index of its recognizer and the recognizer.
+    The recognizers only matching at end of input are left out.
+    """
+    steps = []
+    fused = []
+
+    def fuse():
+        if fused:
+            spec = "|".join("(?P<r{}>{})".format(index, rec.master_spec()) for (index, rec) in enumerate(fused))
+            try:
+                pattern = re.compile(spec)
+                alternatives = { pattern.groupindex["r{}".format(index)]: (index, rec)
+                                 for (index, rec) in enumerate(fused) }
+                steps.append((pattern, tuple(fused), alternatives))
+            except re.error:
+                # e.g. named groups defined in several recognizers
+                steps.extend(fused)
+            fused.clear()
+
+    for rec in recognizers:
+        if rec.only_at_eof():
+            continue
+        elif rec.master_spec() is not None:
+            fused.append(rec)
+        else:
+            fuse()
+            steps.append(rec)
+    fuse()
+
+    return steps
+
+def make_file_tokenizer(filename, chunk_size=FileTokenizer.CHUNK_SIZE):
+    return Tokenizer(FileTokenizer(filename, chunk_size))
 
 if __name__ == "__main__":
     import doctest
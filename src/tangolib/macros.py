@@ -41,12 +41,11 @@ class DefCommand:
         
         # recursive parsing of template result
         from tangolib.parser import Parser
-        parser = Parser()
+        parser = Parser.shared()
 
-        lex = parser.prepare_string_lexer(result_to_parse)
-        doc = MacroCommandDocument(document, "<<<MacroCommand:{}>>>".format(self.cmd_name), self.cmd_start_pos, self.cmd_end_pos, lex)
+        make_doc = lambda lex: MacroCommandDocument(document, "<<<MacroCommand:{}>>>".format(self.cmd_name), self.cmd_start_pos, self.cmd_end_pos, lex)
         
-        result_parsed = parser.parse(doc, macro_cmd_arguments=command.arguments)
+        result_parsed = parser.parse_sub_string(result_to_parse, make_doc, macro_cmd_arguments=command.arguments)
 
         return result_parsed
 
@@ -83,12 +82,11 @@ class DefEnvironment:
         
         # third: recursive parsing of template result
         from tangolib.parser import Parser
-        parser = Parser()
+        parser = Parser.shared()
 
-        lex = parser.prepare_string_lexer(result_to_parse)
-        doc = MacroEnvDocument(document, "<<<MacroEnv:{}>>>".format(self.env_name), self.env_start_pos, self.env_end_pos, lex)
+        make_doc = lambda lex: MacroEnvDocument(document, "<<<MacroEnv:{}>>>".format(self.env_name), self.env_start_pos, self.env_end_pos, lex)
         
-        result_parsed = parser.parse(doc, macro_cmd_arguments=env.arguments)
+        result_parsed = parser.parse_sub_string(result_to_parse, make_doc, macro_cmd_arguments=env.arguments)
 
         return result_parsed
 
@@ -99,11 +97,10 @@ class DefEnvironment:
         del env.template_env
         
         from tangolib.parser import Parser
-        parser = Parser()
+        parser = Parser.shared()
 
-        lex = parser.prepare_string_lexer(result_to_parse)
-        doc = MacroEnvFooterDocument(document, "<<<MacroEnvFooter:{}>>>".format(self.env_name), self.env_start_pos, self.env_end_pos, lex)
+        make_doc = lambda lex: MacroEnvFooterDocument(document, "<<<MacroEnvFooter:{}>>>".format(self.env_name), self.env_start_pos, self.env_end_pos, lex)
         
-        result_parsed = parser.parse(doc, macro_cmd_arguments=env.arguments)
+        result_parsed = parser.parse_sub_string(result_to_parse, make_doc, macro_cmd_arguments=env.arguments)
 
         return result_parsed
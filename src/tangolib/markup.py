@@ -4,27 +4,113 @@ import tangolib.optparse as optparse
 class MarkupError(Exception):
     pass
 
+# The nodes of the tree have no attribute dictionary: their fields
+# are declared in `__slots__` (the optional ones are only set when
+# needed, e.g. `markdown_style` for the markdown-style elements).
+# The documents still have a dictionary, for the processors.
+
+class ShiftLogEntry:
+    """An entry of the log of the position shifts of a document (after
+    an edit, cf. `parser.PositionShift`), linked to the next one.
+
+    The elements refer to the last entry applied to their positions:
+    the next ones are only applied when a position is read or written,
+    hence an edit does not cost a pass on the whole tree."""
+    __slots__ = ('next_shift',)
+
+    def __init__(self):
+        self.next_shift = None
+
+    def shift(self, pos):
+        return pos
+
+# the log of the elements without document (it is never shifted)
+NO_SHIFT = ShiftLogEntry()
+
+def position_property(slot):
+    """The property of an (optional) position stored in the
+    slot `slot`, as `AbstractMarkup.start_pos`."""
+    def get(self):
+        if self.shift_.next_shift is not None:
+            self.apply_shifts()
+        return getattr(self, slot)
+
+    def set(self, pos):
+        if self.shift_.next_shift is not None:
+            self.apply_shifts()
+        setattr(self, slot, pos)
+
+    return property(get, set)
+
 class AbstractMarkup:
+    # the positions are properties over the slots `start_pos_`, etc.,
+    # and `shift_` is the last shift applied to them (cf. `ShiftLogEntry`)
+    __slots__ = ('doc', 'shift_', 'start_pos_', 'end_pos_')
+
+    POSITION_SLOTS = ('start_pos_', 'end_pos_')
+
     def __init__(self, doc, start_pos, end_pos):
         self.doc = doc
-        self.start_pos = start_pos
-        self.end_pos = end_pos
-        
-    def toxml(self, indent_level=0, indent_string=""):
-        raise NotImplementedError("Abstract method")
+        self.shift_ = NO_SHIFT if doc is None else doc.shift_log
+        self.start_pos_ = start_pos
+        self.end_pos_ = end_pos
+
+    def apply_shifts(self):
+        """Apply the pending shifts of the log to the positions."""
+        shift = self.shift_.next_shift
+        while shift is not None:
+            for slot in self.POSITION_SLOTS:
+                pos = getattr(self, slot, None)
+                if pos is not None:
+                    setattr(self, slot, shift.shift(pos))
+            self.shift_ = shift
+            shift = shift.next_shift
+
+    @property
+    def start_pos(self):
+        if self.shift_.next_shift is not None:
+            self.apply_shifts()
+        return self.start_pos_
+
+    @start_pos.setter
+    def start_pos(self, pos):
+        if self.shift_.next_shift is not None:
+            self.apply_shifts()
+        self.start_pos_ = pos
+
+    @property
+    def end_pos(self):
+        if self.shift_.next_shift is not None:
+            self.apply_shifts()
+        return self.end_pos_
+
+    @end_pos.setter
+    def end_pos(self, pos):
+        if self.shift_.next_shift is not None:
+            self.apply_shifts()
+        self.end_pos_ = pos
+
+    # the name of the element in the XML export (cf. `tangolib.export`)
+    xml_tag = None
+
+    def export_fields(self):
+        """The fields of the element in the exports, as (name, value) pairs."""
+        return []
+
+    def export_text(self):
+        """The text of the element in the exports, if any."""
+        return None
 
-    def pos_toxml(self, pos_name, pos):
-        if pos is None:
-            return ""
-        return '{}="{}"'.format(pos_name, str(pos))
+    def toxml(self, indent_level=0, indent_string="  "):
+        from tangolib.export import xml_string
+        return xml_string(self, indent_level=indent_level, indent_string=indent_string)
 
     def is_markup(self):
         return False
 
-    def positions_toxml(self):
-        return '{} {}'.format(self.pos_toxml("start_pos", self.start_pos), self.pos_toxml("end_pos", self.end_pos))
-
 class Markup(AbstractMarkup):
+    __slots__ = ('markup_type', 'content')
+
     def __init__(self, doc, markup_type, start_pos, end_pos):
         super().__init__(doc, start_pos, end_pos)
         self.markup_type = markup_type
@@ -43,12 +129,18 @@ class Markup(AbstractMarkup):
         return True
 
 class Document(Markup):
+    xml_tag = "document"
+
     def __init__(self, filename, lex):
         super().__init__(None, "document", lex.pos, None)
+        # the last entry of the log of the position shifts of the tree
+        self.shift_log = ShiftLogEntry()
+        self.shift_ = self.shift_log
         self.filename = filename
         self.lex = lex
         self.def_commands_ = dict() # dictionary for defined commands
         self.def_environments_ = dict() # dictionary for defined environments
+        self.index = DocumentIndex() # the commands, environments, sections and labels of the tree
 
     def register_def_command(self, def_cmd_name, def_cmd):
         self.def_commands_[def_cmd_name] = def_cmd
@@ -68,16 +160,17 @@ class Document(Markup):
     def fetch_def_environment(self, def_env_name):
         return self.def_environments_[def_env_name]
 
+    def to_arena(self):
+        """The columnar form of the tree (cf. `arena.Arena`)."""
+        from tangolib.arena import Arena
+        return Arena.from_document(self)
+
+    def export_fields(self):
+        return [("filename", self.filename)]
+
     def __repr__(self):
         return "Document(content={})".format(repr(self.content))
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<document filename="{}" {}>\n'.format(self.filename, self.positions_toxml())
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + '</document>\n'
-        return ret
-
 class ChildDocument(Document):
     def __init__(self, parent_doc,  filename, sublex):
         super().__init__(filename, sublex)
@@ -104,6 +197,8 @@ class ChildDocument(Document):
         return self.doc.fetch_def_environment(def_env_name)
     
 class SubDocument(ChildDocument):
+    xml_tag = "subdoc"
+
     def __init__(self, parent_doc, filename, start_pos, sublex):
         super().__init__(parent_doc, filename, sublex)
         self.markup_type = "subdoc"
@@ -113,14 +208,9 @@ class SubDocument(ChildDocument):
     def __repr__(self):
         return "SubDocument(content={})".format(repr(self.content))
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<subdoc filename="{}" {}>\n'.format(self.filename, self.positions_toxml())
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + '</subdoc>\n'
-        return ret
-
 class MacroCommandDocument(ChildDocument):
+    xml_tag = "subdoc"
+
     def __init__(self, parent_doc, filename, start_pos, end_pos, sublex):
         super().__init__(parent_doc, filename, sublex)
         self.markup_type = "macrocmddoc"
@@ -131,14 +221,14 @@ class MacroCommandDocument(ChildDocument):
     def __repr__(self):
         return "MacroCmdDocument(content={})".format(repr(self.content))
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<subdoc filename="{}" {}>\n'.format(self.filename, self.positions_toxml())
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + '</subdoc>\n'
-        return ret
-
 class Command(Markup):
+    __slots__ = ('cmd_name', 'cmd_opts', 'header_end_pos_', 'preformated', 'arguments',
+                 'parsing_argument', 'markdown_style')
+    xml_tag = "command"
+
+    POSITION_SLOTS = ('start_pos_', 'end_pos_', 'header_end_pos_')
+    header_end_pos = position_property('header_end_pos_')
+
     def __init__(self, doc, cmd_name, cmd_opts, header_start_pos, header_end_pos, preformated=False):
         super().__init__(doc, "command", header_start_pos, header_end_pos)
 
@@ -168,20 +258,17 @@ class Command(Markup):
     def __repr__(self):
         return "Command(cmd_name={}, cmd_opts={}, preformated={}, content={})".format(self.cmd_name, self.cmd_opts, self.preformated, repr(self.content))
 
-    def opts_toxml(self):
-        return '"{}"'.format(self.cmd_opts)
+    def export_fields(self):
+        return [("name", self.cmd_name), ("opts", self.cmd_opts), ("preformated", self.preformated)]
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<command name="{}" opts={} preformated="{}" {} >\n'.format(self.cmd_name, self.opts_toxml(), str(self.preformated), self.positions_toxml())
-        if self.preformated:
-            ret += "".join(((indent_string * (indent_level + 1)) + line + "\n" for line in self.content.splitlines()))
-        else:
-            ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + "</command>\n"
-        return ret
+    def export_text(self):
+        # the content of a preformated command
+        return self.content if isinstance(self.content, str) else None
 
 class CommandArg(Markup):
+    __slots__ = ('cmd',)
+    xml_tag = "command_arg"
+
     def __init__(self, doc, cmd, start_pos):
         super().__init__(doc, "command_arg", start_pos, start_pos)
         self.cmd = cmd
@@ -189,15 +276,17 @@ class CommandArg(Markup):
     def __repr__(self):
         return "CommandArg(cmd_name={}, content={})".format(self.cmd.cmd_name, repr(self.content))
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<command_arg {} >\n'.format(self.positions_toxml())
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + "</command_arg>\n"
-        return ret
-
 
 class Environment(Markup):
+    # `preformated` is set when a macro-environment is expanded (cf. processor)
+    __slots__ = ('env_name', 'env_opts', 'header_end_pos_', 'footer_start_pos_', 'arguments',
+                 'parsing_argument', 'markdown_style', 'markdown_indent', 'template_env', 'preformated')
+    xml_tag = "environment"
+
+    POSITION_SLOTS = ('start_pos_', 'end_pos_', 'header_end_pos_', 'footer_start_pos_')
+    header_end_pos = position_property('header_end_pos_')
+    footer_start_pos = position_property('footer_start_pos_')
+
     def __init__(self, doc, env_name, env_opts, header_start_pos, header_end_pos):
         super().__init__(doc, "environment", header_start_pos, None)
         self.env_name = env_name
@@ -223,17 +312,13 @@ class Environment(Markup):
     def __repr__(self):
         return "Environment(env_name={},env_opts={},content={})".format(self.env_name, self.env_opts, repr(self.content))
 
-    def opts_toxml(self):
-        return '"{}"'.format(self.env_opts)
-
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<environment name="{}" opts={} {} >\n'.format(self.env_name, self.opts_toxml(), self.positions_toxml())
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + "</environment>\n"
-        return ret
+    def export_fields(self):
+        return [("name", self.env_name), ("opts", self.env_opts)]
 
 class EnvArg(Markup):
+    __slots__ = ('env',)
+    xml_tag = "env_arg"
+
     def __init__(self, doc, env, start_pos):
         super().__init__(doc, "env_arg", start_pos, start_pos)
         self.env = env
@@ -241,14 +326,9 @@ class EnvArg(Markup):
     def __repr__(self):
         return "EnvArg(env_name={}, content={})".format(self.env.env_name, repr(self.content))
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<env_arg {} >\n'.format(self.positions_toxml())
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + "</env_arg>\n"
-        return ret
-
 class MacroEnvDocument(ChildDocument):
+    xml_tag = "subdoc"
+
     def __init__(self, parent_doc, filename, start_pos, end_pos, sublex):
         super().__init__(parent_doc, filename, sublex)
         self.markup_type = "macroenvdoc"
@@ -259,14 +339,9 @@ class MacroEnvDocument(ChildDocument):
     def __repr__(self):
         return "MacroEnvDocument(content={})".format(repr(self.content))
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<subdoc filename="{}" {}>\n'.format(self.filename, self.positions_toxml())
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + '</subdoc>\n'
-        return ret
-
 class MacroEnvFooterDocument(ChildDocument):
+    xml_tag = "subdoc"
+
     def __init__(self, parent_doc, filename, start_pos, end_pos, sublex):
         super().__init__(parent_doc, filename, sublex)
         self.markup_type = "macroenvfooterdoc"
@@ -277,14 +352,13 @@ class MacroEnvFooterDocument(ChildDocument):
     def __repr__(self):
         return "MacroEnvFooterDocument(content={})".format(repr(self.content))
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<subdoc filename="{}" {}>\n'.format(self.filename, self.positions_toxml())
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + '</subdoc>\n'
-        return ret
-
 class Section(Markup):
+    __slots__ = ('section_title', 'section_name', 'section_depth', 'header_end_pos_')
+    xml_tag = "section"
+
+    POSITION_SLOTS = ('start_pos_', 'end_pos_', 'header_end_pos_')
+    header_end_pos = position_property('header_end_pos_')
+
     def __init__(self, doc, section_title, section_name, section_depth, header_start_pos, header_end_pos):
         super().__init__(doc, "section", header_start_pos, None)
         self.section_title = section_title
@@ -295,30 +369,57 @@ class Section(Markup):
     def __repr__(self):
         return "Section(section_title={},section_name={},section_depth={},content={})".format(self.section_title, self.section_name, self.section_depth, repr(self.content))
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<section title="{}" name="{}" depth="{}" {} >\n'.format(self.section_title, self.section_name, str(self.section_depth), self.positions_toxml())
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + "</environment>\n"
-        return ret
+    def export_fields(self):
+        return [("title", self.section_title), ("name", self.section_name), ("depth", self.section_depth)]
+
 
+class SpanMarkup(AbstractMarkup):
+    """A leaf element holding a string, given either as a string or
+    as the span `source[span_start:span_end]` of a source string
+    (e.g. the input of the parser): the span is only copied when
+    the string is first needed."""
+    __slots__ = ('string_', 'source', 'span_start', 'span_end')
 
-class Text(AbstractMarkup):
-    def __init__(self, doc, text, start_pos, end_pos):
+    def __init__(self, doc, string, start_pos, end_pos, source=None, span_start=0, span_end=0):
         super().__init__(doc, start_pos, end_pos)
-        self.text = text
-        self.markup_type = "text"
+        self.string_ = string
+        self.source = source
+        self.span_start = span_start
+        self.span_end = span_end
+
+    def get_string(self):
+        if self.string_ is None:
+            self.string_ = self.source[self.span_start:self.span_end]
+            self.source = None
+        return self.string_
+
+    def set_string(self, string):
+        self.string_ = string
+        self.source = None
+
+    def string_length(self):
+        if self.string_ is None:
+            return self.span_end - self.span_start
+        return len(self.string_)
+
+class Text(SpanMarkup):
+    __slots__ = ()
+    markup_type = "text"
+    xml_tag = "text"
+
+    text = property(SpanMarkup.get_string, SpanMarkup.set_string)
 
     def __repr__(self):
         return 'Text("{}")'.format(self.text)
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<text {}>{}</text>\n'.format(self.positions_toxml(), self.text)
-        return ret
+    def export_text(self):
+        return self.text
 
 
 class Preformated(AbstractMarkup):
+    __slots__ = ('text', 'lang', 'markup_type')
+    xml_tag = "preformated"
+
     def __init__(self, doc, text, lang, start_pos, end_pos):
         super().__init__(doc, start_pos, end_pos)
         self.text = text
@@ -328,46 +429,44 @@ class Preformated(AbstractMarkup):
 
     def __repr__(self):
         return 'Preformated("{}")'.format(self.text)
-    
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<preformated lang="{}" {} >\n'.format(self.cmd_name, self.positions_toxml())
-        ret += "".join(((indent_string * (indent_level + 1)) + line + "\n" for line in self.text.splitlines()))
-        ret += self.content_toxml(indent_level + 1, indent_string)
-        ret += (indent_string * indent_level) + "</preformated>\n"
-        return ret
-
-class Newlines(AbstractMarkup):
-    def __init__(self, doc, newlines, start_pos, end_pos):
-        super().__init__(doc, start_pos, end_pos)
-        self.newlines = newlines
 
-        self.markup_type = "newlines"
+    def export_fields(self):
+        return [("lang", self.lang)]
+
+    def export_text(self):
+        return self.text
+
+class Newlines(SpanMarkup):
+    __slots__ = ()
+    markup_type = "newlines"
+    xml_tag = "newline"
+
+    newlines = property(SpanMarkup.get_string, SpanMarkup.set_string)
 
     def __repr__(self):
-        return "Newlines({})".format(len(self.newlines))
+        return "Newlines({})".format(self.string_length())
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<newline count="{}" {} />\n'.format(len(self.newlines), self.positions_toxml())
-        return ret
+    def export_fields(self):
+        return [("count", self.string_length())]
 
 
-class Spaces(AbstractMarkup):
-    def __init__(self, doc, spaces, start_pos, end_pos):
-        super().__init__(doc, start_pos, end_pos)
-        self.spaces = spaces
-        self.markup_type = "spaces"
+class Spaces(SpanMarkup):
+    __slots__ = ()
+    markup_type = "spaces"
+    xml_tag = "space"
+
+    spaces = property(SpanMarkup.get_string, SpanMarkup.set_string)
 
     def __repr__(self):
-        return "Spaces({})".format(len(self.spaces))
+        return "Spaces({})".format(self.string_length())
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<space count="{}" {} />\n'.format(len(self.spaces), self.positions_toxml())
-        return ret
+    def export_fields(self):
+        return [("count", self.string_length())]
 
 class SkipMarkup(AbstractMarkup):
+    __slots__ = ('markup_type',)
+    xml_tag = "skip"
+
     def __init__(self, doc, start_pos, end_pos):
         super().__init__(doc, start_pos, end_pos)
         self.markup_type = "skip"
@@ -375,24 +474,135 @@ class SkipMarkup(AbstractMarkup):
     def __repr__(self):
         return "SkipMarkup()"
 
-    def toxml(self, indent_level=0, indent_string="  "):
-        ret = indent_string * indent_level
-        ret += '<skip {} />\n'.format(self.positions_toxml())
-        return ret
+# the markup types of the indexed elements (cf. `DocumentIndex`)
+INDEXED_TYPES = { "command", "environment", "section" }
+
+# the command whose argument labels the enclosing element
+LABEL_COMMAND = "label"
+
+class DocumentIndex:
+    """The index of the tree of a document: its commands and
+    environments by name, its sections by depth and its label
+    commands by label.
+
+    It is filled while parsing (cf. `parser.Parser.TreeBuilder`)
+    and updated by the document processor when it replaces
+    elements (cf. `processor.DocumentProcessor.replace_content`).
+    The elements are listed in the order of their addition to the
+    index, i.e. in document order for a parsed document.
+    """
+    def __init__(self):
+        # key -> { element: None }, i.e. an ordered set of elements
+        self.commands_ = dict()
+        self.environments_ = dict()
+        self.sections_ = dict()
+        self.labels_ = dict()
+
+    def entries(self, element):
+        """The (table, key) entries of `element`."""
+        # by class: the markup type of an expanded macro-environment is changed (cf. processor)
+        if isinstance(element, Command):
+            if element.cmd_name == LABEL_COMMAND:
+                label = label_of(element)
+                if label is not None:
+                    return [ (self.commands_, element.cmd_name), (self.labels_, label) ]
+            return [ (self.commands_, element.cmd_name) ]
+        elif isinstance(element, Environment):
+            return [ (self.environments_, element.env_name) ]
+        elif isinstance(element, Section):
+            return [ (self.sections_, element.section_depth) ]
+        return []
+
+    def add(self, element):
+        """Add `element` (but not its content)."""
+        for (table, key) in self.entries(element):
+            elements = table.get(key)
+            if elements is None:
+                table[key] = { element: None }
+            else:
+                elements[element] = None
+
+    def remove(self, element):
+        """Remove `element` (but not its content)."""
+        for (table, key) in self.entries(element):
+            elements = table.get(key)
+            if elements is not None:
+                elements.pop(element, None)
+                if not elements:
+                    del table[key]
+
+    def add_tree(self, element):
+        """Add `element` and the elements of its tree."""
+        if not isinstance(element, Markup): # a leaf (text, etc.)
+            return
+        for node in iter_tree(element):
+            if node.markup_type in INDEXED_TYPES:
+                self.add(node)
+
+    def remove_tree(self, element):
+        """Remove `element` and the elements of its tree."""
+        if not isinstance(element, Markup):
+            return
+        for node in iter_tree(element):
+            if node.markup_type in INDEXED_TYPES:
+                self.remove(node)
+
+    def commands(self, cmd_name):
+        return list(self.commands_.get(cmd_name, ()))
+
+    def environments(self, env_name):
+        return list(self.environments_.get(env_name, ()))
+
+    def sections(self, section_depth):
+        return list(self.sections_.get(section_depth, ()))
+
+    def labels(self, label):
+        """The label commands of `label` (normally at most one)."""
+        return list(self.labels_.get(label, ()))
+
+    def section_depths(self):
+        """The depths of the sections, in increasing order."""
+        return sorted(self.sections_)
+
+    def __repr__(self):
+        return "DocumentIndex(commands={}, environments={}, sections={}, labels={})".format(
+            list(self.commands_), list(self.environments_), self.section_depths(), list(self.labels_))
+
+def label_of(cmd):
+    """The label given by the label command `cmd`: the text of
+    its argument, or None if it is not (only) text."""
+    if len(cmd.arguments) != 1:
+        return None
+    content = cmd.arguments[0].content
+    if not content or any(element.markup_type != "text" for element in content):
+        return None
+    return "".join(element.text for element in content)
+
+def iter_tree(element):
+    """The elements of the tree of `element`, in document order
+    (the arguments of an environment before its content)."""
+    elements = [ element ]
+    while elements:
+        element = elements.pop()
+        yield element
+        content = getattr(element, "content", None)
+        if isinstance(content, list):
+            elements.extend(reversed(content))
+        if isinstance(element, Environment) and element.arguments:
+            elements.extend(reversed(element.arguments))
 
 
 def search_content_by_types(content, search_types):
-    for element in content:
+    """The first element of `content`, or of the content of its
+    elements (in document order), of a type in `search_types`."""
+    elements = list(reversed(content))
+    while elements:
+        element = elements.pop()
         if element.markup_type in search_types:
             return element
-        else:
-            try:
-                if element.content:
-                    found = search_content_by_types(element.content, search_types)
-                    if found:
-                        return found
-            except:
-                pass
+        sub_content = getattr(element, "content", None)
+        if isinstance(sub_content, list): # not a preformated command
+            elements.extend(reversed(sub_content))
 
     return None
 
@@ -11,11 +11,15 @@ In particular it handles :
 
 """
 
+import collections
+import os
+
 import tangolib.eregex as ere
 
 import tangolib.lexer as lexer
-from tangolib.markup import Document, Section, Command, CommandArg, \
-    Environment, Text, Newlines, Spaces, Preformated, SubDocument, EnvArg
+from tangolib.markup import Markup, Document, Section, Command, CommandArg, \
+    Environment, Text, Newlines, Spaces, Preformated, SubDocument, EnvArg, \
+    ShiftLogEntry, INDEXED_TYPES, LABEL_COMMAND
 
 import tangolib.template as template
 
@@ -28,6 +32,10 @@ import tangolib.globalvars as globvars
 class ParseError(Exception):
     pass
 
+# files of this size (in bytes) or more are not read in memory
+# but streamed by a file tokenizer
+FILE_TOKENIZER_THRESHOLD = 1 << 24
+
 
 def depth_of_section(section_type):
     if section_type == 'part':
@@ -99,58 +107,209 @@ REGEX_DEF_ENV_HEADER = ere.ERegex(r"\\defEnvironment{(" + REGEX_IDENT_STR + r")}
 REGEX_DEF_ENV_HEADER_SHORT = ere.ERegex(r"\\defEnv{(" + REGEX_IDENT_STR + r")}(?:\[([0-9]+)\])?")
 REGEX_MACRO_CMD_ARG = ere.ERegex(r"\\macroCommandArgument\[([0-9]+)\]")
 
+# the (not markdown-style) markup that markdown lists cannot be closed across
+MDLIST_BLOCKING_MARKUP = { "command", "environment", "section", "document" }
+
+# parse events
+
+ParseEvent = collections.namedtuple("ParseEvent", "event_type markup start_pos end_pos")
+ParseEvent.__doc__ = '''An event of `Parser.iter_events`, the `event_type` is either:
+ - "start" or "end" of an element (`markup`) with content,
+ - "text", "newlines", "spaces" or "preformated" for a leaf `markup`;
+with the positions of the markup when the event occurs.'''
+
+# incremental reparse
+
+def is_reparse_region(element, start, end, input):
+    """Check if the edit between the offsets `start` and `end`
+    of `input` is local to `element`: a section or a (latex-style)
+    environment, whose first line and following character are
+    unchanged."""
+    if element.markup_type == "section":
+        pass
+    elif element.markup_type == "environment":
+        if hasattr(element, "markdown_style") or not hasattr(element, "footer_start_pos"):
+            return False
+    else:
+        return False
+    if element.end_pos is None:
+        return False
+    first_eol = input.find("\n", element.start_pos.offset)
+    if first_eol == -1 or start <= first_eol:
+        return False
+    if element.markup_type == "section" and element.end_pos.offset == len(input):
+        return end <= len(input)  # closed by the end of input
+    return end < element.end_pos.offset
+
+def enclosing_path(doc, start, end, input):
+    """The path from `doc` to the smallest element enclosing the
+    edit between `start` and `end` that can be parsed again alone,
+    as a list of pairs (parent, index of the child in the parent)."""
+    path = []
+    element = doc
+    while True:
+        content = element.content
+        # the last child starting before the edit
+        (low, high) = (0, len(content))
+        while low < high:
+            middle = (low + high) // 2
+            if content[middle].start_pos.offset < start:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0 or not is_reparse_region(content[low - 1], start, end, input):
+            return path
+        path.append((element, low - 1))
+        element = content[low - 1]
+
+class PositionShift(ShiftLogEntry):
+    '''The shift of the positions after an edit ending at
+    the offset `end`, whose position was `old_end_pos` before
+    the edit and is `new_end_pos` after.'''
+    __slots__ = ('end', 'old_end_pos', 'new_end_pos', 'delta', 'line_delta')
+
+    def __init__(self, end, old_end_pos, new_end_pos):
+        super().__init__()
+        self.end = end
+        self.old_end_pos = old_end_pos
+        self.new_end_pos = new_end_pos
+        self.delta = new_end_pos.offset - old_end_pos.offset
+        self.line_delta = new_end_pos.lpos - old_end_pos.lpos
+
+    def shift(self, pos):
+        if pos.offset < self.end:
+            return pos
+        if pos.lpos == self.old_end_pos.lpos:
+            return lexer.ParsePosition(self.new_end_pos.lpos,
+                                       self.new_end_pos.cpos + pos.cpos - self.old_end_pos.cpos,
+                                       pos.offset + self.delta)
+        return lexer.ParsePosition(pos.lpos + self.line_delta, pos.cpos, pos.offset + self.delta)
+
 # main parser class
 
 class Parser:
-    def __init__(self):
-        self.recognizers = []
-        self.prepare_recognizers()
-
-    def prepare_recognizers(self):
-        self.recognizers.append(lexer.Regexp("protected", REGEX_PROTECTED))
-        self.recognizers.append(lexer.EndOfInput("end_of_input"))
-        self.recognizers.append(lexer.Regexp("line_comment", REGEX_LINE_COMMENT))
-
-        self.recognizers.append(lexer.Regexp("def_env_header", REGEX_DEF_ENV_HEADER))
-        self.recognizers.append(lexer.Regexp("def_env_header", REGEX_DEF_ENV_HEADER_SHORT))
-        self.recognizers.append(lexer.Regexp("def_cmd_header", REGEX_DEF_CMD_HEADER))
-        self.recognizers.append(lexer.Regexp("def_cmd_header", REGEX_DEF_CMD_HEADER_SHORT))
-
-        self.recognizers.append(lexer.Regexp("macro_cmd_arg", REGEX_MACRO_CMD_ARG))
-
-        self.recognizers.append(lexer.Regexp("env_header", REGEX_ENV_HEADER))
-        self.recognizers.append(lexer.Regexp("env_footer", REGEX_ENV_FOOTER))
-
-        self.recognizers.append(lexer.Regexp("section", REGEX_SECTION))
-        self.recognizers.append(lexer.Regexp("mdsection", REGEX_MDSECTION, re_flags=ere.MULTILINE))
-        self.recognizers.append(lexer.Regexp("inline_preformated", REGEX_INLINE_PREFORMATED))
-        self.recognizers.append(lexer.Regexp("strong", REGEX_STRONG_STAR))
-        self.recognizers.append(lexer.Regexp("strong", REGEX_STRONG_UNDER))
-        self.recognizers.append(lexer.Regexp("emph", REGEX_EMPH_STAR))
-        self.recognizers.append(lexer.Regexp("emph", REGEX_EMPH_UNDER))
+    # the recognizers (and their lexing tables) shared by all the parsers
+    shared_recognizer_set = None
+    # the parser of the macro expansions and included documents
+    shared_parser = None
+
+    def __init__(self, compiled_lexer=False, profile=None, text_spans=False, recognizer_set=None):
+        # the recognizers of the process, unless others are given
+        # (e.g. variants of the recognizers, to compare them)
+        if recognizer_set is None:
+            recognizer_set = Parser.recognizers_of_process()
+        self.recognizer_set = recognizer_set
+        self.recognizers = self.recognizer_set.recognizers
+        # use the master-regexp lexer (same tokens, faster to tokenize
+        # but not to parse, cf. bench/bench_lexer.py)
+        self.compiled_lexer = compiled_lexer
+        # keep the text, spaces and newlines as spans of the input string
+        # (if available), only copied when needed (cf. markup.SpanMarkup):
+        # a smaller tree, but a slower parse (cf. bench/bench_spans.py)
+        self.text_spans = text_spans
+        # lexer profiling counters (cf. lexer.LexerProfile), if enabled
+        self.profile = profile
+        self.prepare_handlers()
+
+    @staticmethod
+    def recognizers_of_process():
+        """The recognizer set of the parsers, built once per process."""
+        if Parser.shared_recognizer_set is None:
+            Parser.shared_recognizer_set = lexer.RecognizerSet(Parser.prepare_recognizers())
+        return Parser.shared_recognizer_set
+
+    @staticmethod
+    def shared():
+        """A parser shared by the sub-parses (macro expansions, included
+        documents), since a parser can be reused and is re-entrant:
+        the state of each parse is local to the `parse` call."""
+        if Parser.shared_parser is None:
+            Parser.shared_parser = Parser()
+        return Parser.shared_parser
+
+    @staticmethod
+    def prepare_recognizers():
+        recognizers = []
+        recognizers.append(lexer.Regexp("protected", REGEX_PROTECTED))
+        recognizers.append(lexer.EndOfInput("end_of_input"))
+        recognizers.append(lexer.Regexp("line_comment", REGEX_LINE_COMMENT))
+
+        recognizers.append(lexer.Regexp("def_env_header", REGEX_DEF_ENV_HEADER))
+        recognizers.append(lexer.Regexp("def_env_header", REGEX_DEF_ENV_HEADER_SHORT))
+        recognizers.append(lexer.Regexp("def_cmd_header", REGEX_DEF_CMD_HEADER))
+        recognizers.append(lexer.Regexp("def_cmd_header", REGEX_DEF_CMD_HEADER_SHORT))
+
+        recognizers.append(lexer.Regexp("macro_cmd_arg", REGEX_MACRO_CMD_ARG))
+
+        recognizers.append(lexer.Regexp("env_header", REGEX_ENV_HEADER))
+        recognizers.append(lexer.Regexp("env_footer", REGEX_ENV_FOOTER))
+
+        recognizers.append(lexer.Regexp("section", REGEX_SECTION))
+        recognizers.append(lexer.Regexp("mdsection", REGEX_MDSECTION, re_flags=ere.MULTILINE))
+        recognizers.append(lexer.Regexp("inline_preformated", REGEX_INLINE_PREFORMATED))
+        # emphasis delimiters (as REGEX_STRONG_* and REGEX_EMPH_*, without lookahead)
+        recognizers.append(lexer.DelimiterRun("strong", '*', 2))
+        recognizers.append(lexer.DelimiterRun("strong", '_', 2))
+        recognizers.append(lexer.DelimiterRun("emph", '*'))
+        recognizers.append(lexer.DelimiterRun("emph", '_'))
     
         # markdown lists
-        self.recognizers.append(lexer.Regexp("mdlist_open", REGEX_MDLIST_OPEN, re_flags=ere.MULTILINE))
-        self.recognizers.append(lexer.Regexp("mdlist_item", REGEX_MDLIST_ITEM, re_flags=ere.MULTILINE))
+        recognizers.append(lexer.Regexp("mdlist_open", REGEX_MDLIST_OPEN, re_flags=ere.MULTILINE))
+        recognizers.append(lexer.Regexp("mdlist_item", REGEX_MDLIST_ITEM, re_flags=ere.MULTILINE))
 
-        self.recognizers.append(lexer.Regexp("cmd_pre_header", REGEX_CMD_PRE_HEADER))
-        self.recognizers.append(lexer.Regexp("cmd_header", REGEX_CMD_HEADER))
-        self.recognizers.append(lexer.Char("open_curly", '{'))
-        self.recognizers.append(lexer.Char("close_curly", '}'))
-        self.recognizers.append(lexer.CharIn("newline", "\n", "\r"))
-        self.recognizers.append(lexer.Regexp("spaces", REGEX_SPACES))
+        recognizers.append(lexer.Regexp("cmd_pre_header", REGEX_CMD_PRE_HEADER))
+        recognizers.append(lexer.Regexp("cmd_header", REGEX_CMD_HEADER))
+        recognizers.append(lexer.Char("open_curly", '{'))
+        recognizers.append(lexer.Char("close_curly", '}'))
+        recognizers.append(lexer.CharIn("newline", "\n", "\r"))
+        recognizers.append(lexer.Regexp("spaces", REGEX_SPACES))
+        return recognizers
 
     class UnparsedContent:
-        def __init__(self):
+        '''The pending text.  While its characters are contiguous in
+        the `source` string of the lexer (if any), it is only kept as
+        the span ending at `span_end`, and otherwise as a string.'''
+        def __init__(self, source=None):
+            self.source = source
             self.content = ""
+            self.span_end = None
             self.start_pos = None
             self.end_pos = None
 
         def append_char(self, lexer):
             if self.start_pos is None:
                 self.start_pos = lexer.pos
-            self.content += lexer.next_char()
-            self.end_pos = lexer.pos
+                self.span_end = None if self.source is None else self.start_pos.offset
+            elif self.span_end is not None and self.span_end != lexer.pos.offset:
+                self.to_string()
+            if self.span_end is None:
+                self.content += lexer.next_char()
+                self.end_pos = lexer.pos
+            else:
+                lexer.next_char()
+                self.end_pos = lexer.pos
+                self.span_end = self.end_pos.offset
+
+        def append_run(self, lexer):
+            # the next character and all the following ones that
+            # cannot start a token, in one step
+            if self.start_pos is None:
+                self.start_pos = lexer.pos
+                self.span_end = None if self.source is None else self.start_pos.offset
+            elif self.span_end is not None and self.span_end != lexer.pos.offset:
+                self.to_string()
+            if self.span_end is None:
+                self.content += lexer.next_text_run()
+                self.end_pos = lexer.pos
+            else:
+                lexer.skip_text_run()
+                self.end_pos = lexer.pos
+                self.span_end = self.end_pos.offset
+
+        def to_string(self):
+            # the next characters are not contiguous to the span
+            self.content = self.source[self.start_pos.offset:self.span_end]
+            self.span_end = None
 
         def append_str(self, str_, start_pos, end_pos):
             if self.start_pos is None:
@@ -159,9 +318,15 @@ class Parser:
                 self.content += str_
                 self.end_pos = end_pos
 
-        def flush(self, parent):
-            if self.content != "":
-                parent.append(Text(parent.doc, self.content, self.start_pos, self.end_pos))
+        def flush(self, state):
+            span_end = self.span_end
+            if span_end is not None:
+                if span_end != self.start_pos.offset:
+                    state.emit("text", Text(state.current_element.doc, None, self.start_pos, self.end_pos,
+                                            self.source, self.start_pos.offset, span_end))
+                self.span_end = None
+            elif self.content != "":
+                state.emit("text", Text(state.current_element.doc, self.content, self.start_pos, self.end_pos))
                 self.content = ""
             self.start_pos = None
             self.end_pos = None
@@ -169,542 +334,959 @@ class Parser:
         def __repr__(self):
             return "UnparsedContent({},start_pos={},end_pos={})".format(repr(self.content), self.start_pos, self.end_pos)
         
-    def parse(self, doc, macro_cmd_arguments=None):
+    class ParseState:
+        '''The state of a parse: the document and its lexer, the
+        element being parsed and its (open) ancestors, and the
+        pending text.
+
+        The token handlers for the markup type of the current element
+        are kept at hand (`handlers`), the current element must thus
+        only be changed with `push` and `pop`.
+
+        The parsed elements are not added to their parent but reported
+        to the `sink`, called with the event type and the element
+        (cf. `ParseEvent`): by default a `TreeBuilder` of the document.
+        '''
+        def __init__(self, parser, doc, macro_cmd_arguments=None, sink=None, lex=None):
+            self.parser = parser
+            self.doc = doc
+            self.lex = doc.lex if lex is None else lex
+            self.macro_cmd_arguments = macro_cmd_arguments
+            self.element_stack = []
+            self.current_element = doc
+            self.handlers = parser.handlers_of(doc.markup_type)
+            # the open markdown lists: (list, its depth in the element stack,
+            # outermost list of its nest of markdown lists)
+            self.mdlists = []
+            self.unparsed_content = Parser.UnparsedContent(self.lex.source_string() if parser.text_spans else None)
+            if sink is None:
+                sink = Parser.TreeBuilder().event
+            self.emit = sink
+            self.emit("start", doc)
+
+        def push(self, element):
+            '''Make `element` the current element.'''
+            self.element_stack.append(self.current_element)
+            self.current_element = element
+            self.handlers = self.parser.handlers_of(element.markup_type)
+
+        def pop(self):
+            '''Go back to the parent of the current element.'''
+            if self.mdlists and self.mdlists[-1][0] is self.current_element:
+                self.mdlists.pop()
+            self.current_element = self.element_stack.pop()
+            self.handlers = self.parser.handlers_of(self.current_element.markup_type)
+
+        def open(self, element):
+            '''Start `element` in the current element, and make it current.'''
+            self.emit("start", element)
+            self.push(element)
+
+        def close(self):
+            '''End the current element.'''
+            element = self.current_element
+            self.pop()
+            self.emit("end", element)
+
+        def open_mdlist(self, mdlist):
+            '''Open the markdown list `mdlist` (cf. `open`).'''
+            self.open(mdlist)
+            depth = len(self.element_stack)
+            top_mdlist = mdlist
+            if self.mdlists:
+                (outer_mdlist, outer_depth, outer_top_mdlist) = self.mdlists[-1]
+                if not self.blocks_mdlists(outer_depth + 1):
+                    top_mdlist = outer_top_mdlist
+            self.mdlists.append((mdlist, depth, top_mdlist))
+
+        def blocks_mdlists(self, depth):
+            '''Is there, from `depth` in the element stack to the current
+            element (excluded), a command, environment or section
+            that is not markdown-style? (i.e. that markdown lists
+            below cannot be closed from here)'''
+            element_stack = self.element_stack
+            for index in range(depth, len(element_stack)):
+                element = element_stack[index]
+                if element.markup_type in MDLIST_BLOCKING_MARKUP and not hasattr(element, "markdown_style"):
+                    return True
+            return False
+
+        def top_mdlist(self):
+            '''The outermost markdown list that can be closed (by
+            a blank line) from the current element, or None.'''
+            if not self.mdlists:
+                return None
+            (mdlist, depth, top_mdlist) = self.mdlists[-1]
+            current_element = self.current_element
+            if current_element is not mdlist:
+                if current_element.markup_type in MDLIST_BLOCKING_MARKUP and not hasattr(current_element, "markdown_style"):
+                    return None
+                if self.blocks_mdlists(depth + 1):
+                    return None
+            return top_mdlist
+
+        def add(self, element):
+            '''Add `element` (without content to parse) to the current element.'''
+            self.emit("start", element)
+            self.emit("end", element)
+
+    class TreeBuilder:
+        '''The consumer of the parse events that builds the
+        markup tree: each element is added to its parent, and the
+        arguments of the commands and environments are registered.
+        The commands, environments, sections and labels are added to
+        the index of the document (cf. `markup.DocumentIndex`).
+
+        The top-level elements are added to the `root`, if given,
+        instead of the document, and are not indexed.'''
+        def __init__(self, root=None):
+            self.element_stack = []
+            self.root = root
+            self.index = None
+
+        def event(self, event_type, element):
+            if event_type == "start":
+                if not self.element_stack:
+                    if self.root is not None:
+                        element = self.root
+                    else:
+                        self.index = getattr(element, "index", None)
+                else:
+                    parent = self.element_stack[-1]
+                    if (element.markup_type == "command_arg" and element.cmd is parent) \
+                       or (element.markup_type == "env_arg" and element.env is parent):
+                        parent.add_argument(element)
+                    else:
+                        parent.append(element)
+                    if element.markup_type in INDEXED_TYPES and self.index is not None:
+                        self.index.add(element)
+                self.element_stack.append(element)
+            elif event_type == "end":
+                self.element_stack.pop()
+                # the label is known once the argument is parsed
+                if element.markup_type == "command" and element.cmd_name == LABEL_COMMAND \
+                   and self.index is not None:
+                    self.index.add(element)
+            else:
+                self.element_stack[-1].append(element)
+
+    # the handlers (method names) of the tokens, depending on
+    # the markup type of the current element (or any, if None),
+    # the first applicable one is used
+    TOKEN_HANDLERS = [ (None, "command", "parse_text_in_command"), # None: no token (text)
+                       (None, None, "parse_text"),
+                       ("end_of_input", None, "parse_end_of_input"),
+                       ("line_comment", None, "parse_line_comment"),
+                       ("env_header", None, "parse_env_header"),
+                       ("open_curly", "environment", "parse_env_arg_open"),
+                       ("close_curly", "env_arg", "parse_env_arg_close"),
+                       ("env_footer", None, "parse_env_footer"),
+                       ("cmd_header", None, "parse_cmd_header"),
+                       ("open_curly", "command", "parse_cmd_arg_open"),
+                       ("close_curly", "command_arg", "parse_cmd_arg_close"),
+                       ("cmd_pre_header", None, "parse_cmd_pre_header"),
+                       ("open_curly", None, "parse_open_curly"),
+                       ("section", None, "parse_section"),
+                       ("mdsection", None, "parse_section"),
+                       ("mdlist_open", None, "parse_mdlist_item"),
+                       ("mdlist_item", None, "parse_mdlist_item"),
+                       ("inline_preformated", None, "parse_inline_preformated"),
+                       ("emph", None, "parse_emph"),
+                       ("strong", None, "parse_strong"),
+                       ("def_cmd_header", None, "parse_def_cmd_header"),
+                       ("macro_cmd_arg", None, "parse_macro_cmd_arg"),
+                       ("def_env_header", None, "parse_def_env_header"),
+                       ("protected", None, "parse_protected"),
+                       ("newline", None, "parse_newline"),
+                       ("spaces", None, "parse_spaces") ]
+
+    # the markup types of the elements that can be current while parsing
+    CURRENT_MARKUP_TYPES = [ "document", "subdoc", "macrocmddoc", "macroenvdoc", "macroenvfooterdoc",
+                             "section", "command", "command_arg", "environment", "env_arg" ]
+
+    def prepare_handlers(self):
+        # the handlers keyed by (token type, markup type), a handler for any
+        # markup type applies if there is no specific one (defined before)
+        self.token_handlers = dict()
+        self.default_token_handlers = dict()
+        for (token_type, markup_type, handler_name) in Parser.TOKEN_HANDLERS:
+            handler = getattr(self, handler_name)
+            if markup_type is None:
+                self.default_token_handlers.setdefault(token_type, handler)
+            else:
+                self.token_handlers.setdefault((token_type, markup_type), handler)
+        # and by markup type: markup type -> (token type -> handler)
+        self.markup_handlers = dict()
+        for markup_type in Parser.CURRENT_MARKUP_TYPES:
+            self.handlers_of(markup_type)
+
+    def handlers_of(self, markup_type):
+        try:
+            return self.markup_handlers[markup_type]
+        except KeyError:
+            handlers = dict(self.default_token_handlers)
+            for ((token_type, handler_markup_type), handler) in self.token_handlers.items():
+                if handler_markup_type == markup_type:
+                    handlers[token_type] = handler
+            self.markup_handlers[markup_type] = handlers
+            return handlers
+
+    def parse(self, doc, macro_cmd_arguments=None, errors=None):
+        """Parse the input of `doc` in `doc`, and return it.
+
+        If a list of `errors` is given, the parse does not stop at
+        the first `ParseError`: it is appended to the list and the
+        parse goes on from the next section or environment boundary
+        (cf. `recover`), the document is then only a best-effort one.
+        """
 
         # BREAKPOINT >>> # import pdb; pdb.set_trace()  # <<< BREAKPOINT #
 
-        element_stack = []
-
-        current_element = doc
-        continue_parse = True
-        unparsed_content = Parser.UnparsedContent()
+        state = Parser.ParseState(self, doc, macro_cmd_arguments)
+        next_token = doc.lex.next_token
+        parse_unrecognized = self.parse_unrecognized
+
+        if errors is None:
+            # the handlers return True at the end of input
+            while True:
+                tok = next_token()
+                if tok is None:
+                    if state.handlers[None](state, tok):
+                        break
+                elif state.handlers.get(tok.token_type, parse_unrecognized)(state, tok):
+                    break
+        else:
+            end_of_input = False
+            while not end_of_input:
+                tok = next_token()
+                try:
+                    if tok is None:
+                        end_of_input = state.handlers[None](state, tok)
+                    else:
+                        end_of_input = state.handlers.get(tok.token_type, parse_unrecognized)(state, tok)
+                except ParseError as error:
+                    errors.append(error)
+                    (end_of_input, tok) = self.recover(state, tok, errors)
 
-        lex = doc.lex
+        self.finish(state, tok)
 
-        while continue_parse:
+        # preparsing finished
+        return doc
 
-            tok = lex.next_token()
+    def iter_events(self, source, filename="<string>", macro_cmd_arguments=None):
+        """Parse `source` (an input string, or a document with its
+        lexer) and generate the `ParseEvent`s of its elements, in
+        order, without building the markup tree.
+
+        >>> [ (event.event_type, event.markup.markup_type) for event in Parser().iter_events("Hi \\emph{you}") ]
+        ... # doctest: +NORMALIZE_WHITESPACE
+        [('start', 'document'), ('text', 'text'), ('spaces', 'spaces'),
+         ('start', 'command'), ('start', 'command_arg'), ('text', 'text'),
+         ('end', 'command_arg'), ('end', 'command'), ('end', 'document')]
+        """
+        if isinstance(source, Document):
+            doc = source
+        else:
+            doc = Document(filename, self.prepare_string_lexer(source))
+
+        events = []
+        sink = lambda event_type, markup: events.append(ParseEvent(event_type, markup, markup.start_pos, markup.end_pos))
+        state = Parser.ParseState(self, doc, macro_cmd_arguments, sink)
+        next_token = doc.lex.next_token
+        parse_unrecognized = self.parse_unrecognized
+
+        while True:
+            tok = next_token()
             if tok is None:
-                next_char = lex.peek_char()
-                # When closing an emphasis
-                if next_char in { '*', '_' } and current_element.markup_type == "command" \
-                   and current_element.cmd_name in { "emph" , "strong" }:
-                    
-                    if current_element.cmd_name == "emph":
-                        if current_element.cmd_opts['emph_type'] == next_char:
-                            lex.next_char() # consume
-                            unparsed_content.flush(current_element)
-                            current_element = element_stack.pop()
-                        else:
-                            unparsed_content.append_char(lex)
-                    elif current_element.cmd_name == "strong":
-                        if current_element.cmd_opts['strong_type'] == next_char:
-                            lex.next_chars(2) # consume two
-                            unparsed_content.flush(current_element)
-                            current_element = element_stack.pop()
-                        else:
-                            unparsed_content.append_char(lex)
-                    else:
-                        unparsed_content.append_char(lex)
-
-                else: # in the other case just append the character
-                    unparsed_content.append_char(lex)
- 
-            ###############################################
-            ### End of input                            ###
-            ###############################################
-            elif tok.token_type == "end_of_input":
-                unparsed_content.flush(current_element)
-
-                while current_element.markup_type not in { "document", "subdoc", "macrocmddoc", "macroenvdoc", "macroenvfooterdoc" }:
-                    if current_element.markup_type == "command":
-                        raise ParseError(current_element.start_pos, tok.start_pos, "Unfinished command before end of document")
-                    elif current_element.markup_type == "environment":
-                        raise ParseError(current_element.start_pos, tok.start_pos, "Unfinished environment before end of document")
-                    else:
-                        # ok to close
-                        current_element.end_pos = tok.start_pos
-                        current_element = element_stack.pop()
-
-                continue_parse = False
-
-            ### Line comment ###
-            elif tok.token_type == "line_comment":
-                pass # just skip this
-
-            ###############################################
-            ### Environments                            ###
-            ###############################################
-            elif tok.token_type == "env_header":
-                unparsed_content.flush(current_element)
-                env = Environment(doc, tok.value.group(1), tok.value.group(2), tok.start_pos, tok.end_pos)
-                current_element.append(env)
-                element_stack.append(current_element)
-                current_element = env
-
-                # check if the environment has at least an argument
-                ntok = lex.next_token() 
-                if ntok is None:
-                    pass  # special case: no more tokens (last command)
-                elif ntok.token_type == "open_curly":
-                    env.parsing_argument = True
-                    lex.putback(ntok)  # need the bracket for argument parsing
-                else:
-                    env.parsing_argument = False
-                    lex.putback(ntok)  # command without argument
-
-            # start of argument  (or dummy bracket somewhere)
-            elif current_element.markup_type == "environment" and tok.token_type == "open_curly" and hasattr(current_element,"parsing_argument") and current_element.parsing_argument:
-                # first argument
-                env_arg = EnvArg(doc,current_element, tok.start_pos)
-                current_element.add_argument(env_arg)
-                element_stack.append(current_element)
-                current_element = env_arg
-                    
-            # end of argument (or dummy bracket somewhere)
-            elif current_element.markup_type == "env_arg" and tok.token_type == "close_curly":
-                unparsed_content.flush(current_element)
-                current_element.end_pos = tok.end_pos
-                # Pop parent element (environment)
-                current_element = element_stack.pop()
-
-                # check if the environment has at least a further argument
-                ntok = lex.next_token() 
-                if ntok is None: # no more token ? ==> ERROR !
-                    raise ParseError(tok.start_pos, tok.end_pos, "Missing closing environment at end of input")
-                elif ntok.token_type == "open_curly":
-                    current_element.parsing_argument = True
-                    lex.putback(ntok)
-                else:
-                    current_element.parsing_argument = False
-                    # keep the environment as current element for further argument or the body
-                    lex.putback(ntok)  # need the bracket for argument parsing
-
-            elif tok.token_type == "env_footer":
-                if current_element.markup_type != "environment":
-                    raise ParseError(tok.start_pos, tok.end_pos, "Cannot close environment")
-                if current_element.env_name != tok.value.group(1):
-                    raise ParseError(tok.start_pos, tok.end_pos, "Mismatch environment '{}' (expecting '{}')".format(tok.group(1), current_element.env_name))
-                unparsed_content.flush(current_element)
-
-                current_element.footer_start_pos = tok.start_pos
-                current_element.end_pos = tok.end_pos
-
-                # Pop parent element
-                current_element = element_stack.pop()
-
-            ###############################################
-            ### Commands                                ###
-            ###############################################
-            elif tok.token_type == "cmd_header":
-                unparsed_content.flush(current_element)
-                cmd = Command(doc, tok.value.group(1), tok.value.group(2), tok.start_pos, tok.end_pos)
-                current_element.append(cmd)
-                
-                # check if the command has at least an arguemnt
-                ntok = lex.next_token() 
-                if ntok is None:
-                    pass  # special case: no more tokens (last command)
-                elif ntok.token_type == "open_curly":
-                    element_stack.append(current_element)
-                    current_element = cmd
-                    lex.putback(ntok)  # need the bracket for argument parsing
-                else:
-                    lex.putback(ntok)  # command without argument
-
-            # start of argument  (or dummy bracket somewhere)
-            elif current_element.markup_type == "command" and tok.token_type == "open_curly":
-                # first argument
-                cmd_arg = CommandArg(doc,current_element, tok.start_pos)
-                current_element.add_argument(cmd_arg)
-                element_stack.append(current_element)
-                current_element = cmd_arg
-                    
-            # end of argument (or dummy bracket somewhere)
-            elif current_element.markup_type == "command_arg" and tok.token_type == "close_curly":
-                unparsed_content.flush(current_element)
-                current_element.end_pos = tok.end_pos
-                # Pop parent element (command)
-                current_element = element_stack.pop()
-
-                # check if the command has at least an arguemnt
-                ntok = lex.next_token() 
-                if ntok is None:
-                    current_element = element_stack.pop()  # special case: no more tokens (last command, pop it)
-                elif ntok.token_type == "open_curly":
-                    # keep the command as current element
-                    lex.putback(ntok)  # need the bracket for argument parsing
-                else:
-                    # pop the command
-                    current_element = element_stack.pop()
-                    lex.putback(ntok)  # command without more argument
-                    
-            elif tok.token_type == "cmd_pre_header":
-                unparsed_content.flush(current_element)
-                cmd = Command(doc, tok.value.group(1), tok.value.group(2), tok.start_pos, tok.end_pos, preformated=True)
-                current_element.append(cmd)
-                preformated = ""
-                eat_preformated = True
-                while eat_preformated:
-                    footer = lex.peek_chars(3)
-                    if footer is None:
-                        raise ParseError(tok.start_pos, lex.pos, "Preformated command unfinished (missing '}}}')")
-                    elif footer == "}}}":
-                        cmd.content = preformated
-                        eat_preformated = False
-                        lex.next_chars(3)
-                    else:
-                        preformated += lex.next_char()
-            elif tok.token_type == "open_curly":
-                unparsed_content.append_str("{", tok.start_pos, tok.end_pos)
-
-            ###############################################
-            ### Sections (latex-style or markdown-style ###
-            ###############################################
-            elif tok.token_type == "section" or tok.token_type == "mdsection":
-                if tok.token_type == "section":
-                    # latex section markup
-                    section_title = tok.value.group(2)
-                    section_depth = depth_of_section(tok.value.group(1))
-                elif tok.token_type == "mdsection":
-                    # markdown section markup
-                    section_title = tok.value.group(2)
-                    section_depth = len(tok.value.group(1))
-                    if tok.value.group(3) != "" and tok.value.group(3) != tok.value.group(1):
-                        raise ParseError(tok.start_pos.next_char(tok.value.start(3)), tok.start_pos.next_char(tok.value.end(3)), 'Wrong section marker: should be "" or "{}"'.format(tok.value.group(1)))
-                    if tok.value.group(4) != "" and not tok.value.group(4).isspace():
-                        raise ParseError(tok.start_pos.next_char(tok.value.start(4)), tok.start_pos.next_char(tok.value.end(3)), "Unexpected text '{}' after section markup".format(tok.value.group(4)))
-
-                if current_element.markup_type == "command":
-                    raise ParseError(current_element.start_pos, tok.start_pos, "Unfinished command before section")
-                elif current_element.markup_type == "environment":
-                    raise ParseError(current_element.start_pos, tok.start_pos, "Unfinished environment before section")
-                # ok to parse new section
-                unparsed_content.flush(current_element)
-                # close all sections of greater or equal depth
-                while current_element.markup_type == "section" \
-                      and current_element.section_depth >= section_depth: # TODO: fix probably needed for mixing inclusion and sectionnning
-                    current_element.end_pos = tok.start_pos
-                    current_element = element_stack.pop()
-                section = Section(doc, section_title, section_of_depth(section_depth), section_depth, tok.start_pos, tok.end_pos)
-                current_element.append(section)
-                element_stack.append(current_element)
-                current_element = section
-
-            ############################################
-            ### Markdown-style itemize and enumerate ###
-            ############################################$
-            elif tok.token_type == "mdlist_open" or tok.token_type == "mdlist_item":
-                mditem_indent = len(tok.value.group(1))
-                mditem_style = "itemize" if (tok.value.group(2)[0] == '-' or tok.value.group(2)[0] == '+') else "enumerate"
-
-                unparsed_content.flush(current_element)
-
-                continue_closing = True
-
-                while continue_closing:
-
-                    dig_once_more = False
-
-                    # TODO: fix probably needed for closing with subdocument
-                    while current_element.markup_type not in { "command", "environment", "section", "document", "subdoc" }:
-                        current_element = element_stack.pop()
-
-                    if (current_element.markup_type == "environment") and (current_element.env_name in { "itemize", "enumerate" }) \
-                    and (current_element.env_name == mditem_style):
-                        try:
-                            if current_element.markdown_style:
-                                pass # ok
-                        except AttributeError:
-                            raise ParseError(current_element.start_pos, tok.start_pos, "Mixing latex-style and markdown-style lists is forbidden")
-   
-                        if current_element.markdown_indent == mditem_indent:
-                            # add a further item at the same level
-                            #### element_stack.append(current_element)
-                            mditem = Command(doc, "item", None, tok.start_pos, tok.end_pos)
-                            mditem.markdown_style = True
-                            current_element.append(mditem)
-                            #### current_element = mditem
-                            continue_closing = False
-                        elif current_element.markdown_indent > mditem_indent:
-                            # close one
-                            current_element = element_stack.pop()
-                            continue_closing = True
-                        else: # dig one level more
-                            dig_once_more = True
-                            continue_closing = False
-
-                    else:
-                        dig_once_more = True
-                        continue_closing = False
-
-                    if dig_once_more:
-                        mdlist = Environment(doc, mditem_style, None, tok.start_pos, tok.end_pos)
-                        mdlist.markdown_style = True
-                        mdlist.markdown_indent = mditem_indent
-                        current_element.append(mdlist)
-                        element_stack.append(current_element)
-                        current_element = mdlist
-
-                        mditem = Command(doc, "item", None, tok.start_pos, tok.end_pos)
-                        mditem.markdown_style = True
-                        current_element.append(mditem)                        
-                        #### element_stack.append(current_element)                        
-                        #### current_element = mditem
-
-                # loop if continue_closing == True
-
-                # and we're done
-
-            ###########################################
-            ### Inline preformated                  ###
-            ###########################################
-            elif tok.token_type == "inline_preformated":
-                unparsed_content.flush(current_element)
-                preformated = Preformated(doc, tok.value.group(1), "inline", tok.start_pos, tok.end_pos)
-                current_element.append(preformated)
-
-            ### Emphasis (normal) ###
-            elif tok.token_type == "emph":
-                unparsed_content.flush(current_element)
-                cmd = Command(doc, "emph", {'emph_type': tok.value.group(1) }, tok.start_pos, tok.end_pos)
-                current_element.append(cmd)
-                element_stack.append(current_element)
-                current_element = cmd
-
-            ### Strong emphasis ###
-            elif tok.token_type == "strong":
-                unparsed_content.flush(current_element)
-                cmd = Command(doc, "strong", {'strong_type': tok.value.group(1) }, tok.start_pos, tok.end_pos)
-                current_element.append(cmd)
-                element_stack.append(current_element)
-                current_element = cmd
-
-            ######################################################
-            ### Macros: commands and environments definitions  ###
-            ######################################################
-            ### command definition
-            elif tok.token_type == "def_cmd_header":
-                unparsed_content.flush(current_element)
-
-                def_cmd_name = tok.value.group(1)
-                def_cmd_arity = 0
-                if tok.value.group(2) is not None:
-                    def_cmd_arity = int(tok.value.group(2))
-                                
-                tok2 = lex.next_token()
-                if tok2.token_type != "open_curly":
-                    raise ParseError(tok.end_pos, tok.end_pos.next_char(), "Missing '{' for \\defCommand body")
-
-                # prepare the template string
-                def_cmd_lex_start_pos = lex.pos
-                def_cmd_lex_str = ""
-                nb_curly = 1
-                while nb_curly > 0:
-                    ch = lex.next_char()
-                    if ch is None:
-                        raise ParseError(def_cmd_lex_start_pos, lex.pos, "Unexpected end of input while parsing \\defCommand body")
-                    elif ch == '}':
-                        nb_curly -= 1
-                        if nb_curly > 0:
-                            def_cmd_lex_str += ch
-                    else:
-                        if ch == '{':
-                            nb_curly += 1
-                        def_cmd_lex_str += ch
-
-
-                def_cmd_tpl = template.Template(def_cmd_lex_str,
-                                                globvars.TANGO_EVAL_GLOBAL_ENV,
-                                                escape_var='#',
-                                                escape_inline='@',
-                                                escape_block='@',
-                                                escape_block_open='{',
-                                                escape_block_close='}',
-                                                escape_emit_function='emit',
-                                                filename='<defCommand:{}>'.format(def_cmd_name),
-                                                base_pos=def_cmd_lex_start_pos)
-
-
-                # register the command
-                doc.register_def_command(def_cmd_name, DefCommand(doc, def_cmd_name, def_cmd_arity, tok.start_pos, tok.end_pos, def_cmd_tpl))
-
-            ### macro-command argument
-            elif tok.token_type == "macro_cmd_arg": ### XXX: dead code ?
-                unparsed_content.flush(current_element)
-                arg_num = int(tok.value.group(1))
-                command_arg_markup = macro_cmd_arguments[arg_num]
-                current_element.append(command_arg_markup)
-                element_stack.append(current_element)
-                current_element = command_arg_markup
-                
-
-            ### environment definition
-            elif tok.token_type == "def_env_header":
-
-                unparsed_content.flush(current_element)
-
-                def_env_name = tok.value.group(1)
-                def_env_arity = 0
-                if tok.value.group(2) is not None:
-                    def_env_arity = int(tok.value.group(2))
-
-                tok2 = lex.next_token()
-                if tok2.token_type != "open_curly":
-                    raise ParseError(tok.end_pos, tok.end_pos.next_char(), "Missing '{' for \\defEnvironment header body")
-
-
-                # prepare the template string for the header part
-                def_env_header_lex_start_pos = lex.pos
-                def_env_header_lex_str = ""
-
-                nb_curly = 1
-                while nb_curly > 0:
-                    ch = None
-                    try:
-                        ch = lex.next_char()
-                        if ch is None:
-                            raise ParseError(def_env_header_lex_start_pos, lex.pos, "Unexpected end of input while parsing \\defEnvironment header body")
-                    except:
-                        raise ParseError(def_env_header_lex_start_pos, lex.pos, "Unexpected end of input while parsing \\defEnvironment header body")
-                    if ch == '}':
-                        nb_curly -= 1
-                        if nb_curly > 0:
-                            def_env_header_lex_str += ch
-                    else:
-                        if ch == '{':
-                            nb_curly += 1
-                        def_env_header_lex_str += ch
-
-                def_env_header_tpl = template.Template(def_env_header_lex_str,
-                                                       globvars.TANGO_EVAL_GLOBAL_ENV,
-                                                       escape_var='#',
-                                                       escape_inline='@',
-                                                       escape_block='@',
-                                                       escape_block_open='{',
-                                                       escape_block_close='}',
-                                                       escape_emit_function='emit',
-                                                       filename='<defEnvironment:{}>'.format(def_env_name),
-                                                       base_pos=def_env_header_lex_start_pos)
-
-                # prepare the template string for the footer part
-
-                tok2 = lex.next_token()
-                if tok2.token_type != "open_curly":
-                    raise ParseError(tok.end_pos, tok.end_pos.next_char(), "Missing '{' for \\defEnvironment footer body")
-
-                def_env_footer_lex_start_pos = lex.pos
-                def_env_footer_lex_str = ""
-
-                nb_curly = 1
-                while nb_curly > 0:
-                    ch = None
-                    try:
-                        ch = lex.next_char()
-                        if ch is None:
-                            raise ParseError(def_env_footer_lex_start_pos, lex.pos, "Unexpected end of input while parsing \\defEnvironment footer body")
-                    except:
-                        raise ParseError(def_env_footer_lex_start_pos, lex.pos, "Unexpected end of input while parsing \\defEnvironment footer body")
-                    
-                    if ch == '}':
-                        nb_curly -= 1
-                        if nb_curly > 0:
-                            def_env_footer_lex_str += ch
-                    else:
-                        if ch == '{':
-                            nb_curly += 1
-                        def_env_footer_lex_str += ch
-                    
-                def_env_footer_tpl = template.Template(def_env_footer_lex_str,
-                                                       globvars.TANGO_EVAL_GLOBAL_ENV,
-                                                       escape_var='#',
-                                                       escape_inline='@',
-                                                       escape_block='@',
-                                                       escape_block_open='{',
-                                                       escape_block_close='}',
-                                                       escape_emit_function='emit',
-                                                       filename='<defEnvironment:{}>'.format(def_env_name),
-                                                       base_pos=def_env_footer_lex_start_pos)
-                # register the environement
-                doc.register_def_environment(def_env_name,  DefEnvironment(doc, def_env_name, def_env_arity, def_env_header_lex_start_pos, lex.pos, def_env_header_tpl, def_env_footer_tpl))
-
-
-            ###########################################
-            ### Special characters (newlines, etc.) ###
-            ###########################################
-            elif tok.token_type == "protected":
-                unparsed_content.append_str(tok.value[1:], tok.start_pos, tok.end_pos)
-            elif tok.token_type == "newline":
-                unparsed_content.flush(current_element)
-                newlines = tok.value
-                while lex.peek_char() == "\n" or lex.peek_char() == "\r":
-                    newlines += lex.next_char()
-
-                ##  Special treatment for markdown lists
-                if len(newlines) >= 2 or lex.at_eof():
-                    # check if we need to finish some markdown list
-                    element_stack_copy = element_stack[:]
-                    element_stack_copy.append(current_element)
-                    top_mdlist = None
-                    while element_stack_copy:
-                        current_element_copy = element_stack_copy.pop()
-                        if current_element_copy.markup_type in { "command", "environment", "section", "document" } \
-                           and not hasattr(current_element_copy, "markdown_style"):
-                            element_stack_copy = []
-                        elif current_element_copy.markup_type == "environment":
-                            top_mdlist = current_element_copy
-                        
-                        
-                    if top_mdlist: # found a markdown list to close
-                        while current_element is not top_mdlist:
-                            current_element = element_stack.pop()
-
-                        # close the top markdown list
-                        current_element = element_stack.pop()
-                        
-
-                current_element.append(Newlines(doc, newlines, tok.start_pos, tok.end_pos))
-
-            elif tok.token_type == "spaces":
-                unparsed_content.flush(current_element)
-                current_element.append(Spaces(doc, tok.value.group(0), tok.start_pos, tok.end_pos))
+                end_of_input = state.handlers[None](state, tok)
             else:
-                # unrecognized token type
-                raise ParseError(tok.start_pos, tok.end_pos, "Unrecognized token type: {}".format(tok.token_type))
-
+                end_of_input = state.handlers.get(tok.token_type, parse_unrecognized)(state, tok)
+            if events:
+                yield from events
+                events.clear()
+            if end_of_input:
+                break
+
+        self.finish(state, tok)
+        yield from events
+
+    def parse_recovering(self, source, filename="<string>", macro_cmd_arguments=None):
+        r"""Parse `source` (an input string, or a document with its
+        lexer) in recovering mode, and return the (best-effort)
+        document and the list of all the parse errors.
+
+        >>> (doc, errors) = Parser().parse_recovering("\\begin{a}x\\end{b}\n\n= Next =\n\n\\emph{y")
+        >>> [ (str(start_pos), message) for (start_pos, end_pos, message) in (error.args for error in errors) ]
+        [('1:11', "Mismatch environment 'b' (expecting 'a')"), ('5:1', 'Unfinished command before end of document')]
+        >>> [ element.markup_type for element in doc.content ]
+        ['environment', 'section']
+        """
+        if isinstance(source, Document):
+            doc = source
+        else:
+            doc = Document(filename, self.prepare_string_lexer(source))
+        errors = []
+        self.parse(doc, macro_cmd_arguments, errors)
+        return (doc, errors)
+
+    # the tokens at which the parse is resynchronized after an error
+    RESYNC_TOKEN_TYPES = { "section", "mdsection", "env_header", "env_footer", "end_of_input" }
+
+    def recover(self, state, tok, errors):
+        """Resynchronize the parse after an error for the token `tok`,
+        at the next section or environment boundary: `tok` itself if it
+        is one, or the next one (the input before is skipped).  The open
+        elements that would prevent the handling of the boundary are
+        closed (they end at the boundary), then it is handled, and its
+        own errors are recorded in `errors` as well.
+
+        Return whether the end of input is reached, and the last token.
+        """
+        lex = state.lex
+        state.unparsed_content.flush(state)
+        # the boundary at fault is handled again only if closing
+        # elements may help
+        if tok is not None and tok.token_type in Parser.RESYNC_TOKEN_TYPES \
+           and not self.close_before(state, tok):
+            tok = None
+        while True:
+            if tok is None or tok.token_type not in Parser.RESYNC_TOKEN_TYPES:
+                tok = lex.next_token()
+                while tok is None or tok.token_type not in Parser.RESYNC_TOKEN_TYPES:
+                    if tok is None:
+                        lex.next_text_run()
+                    tok = lex.next_token()
+                self.close_before(state, tok)
+
+            try:
+                return (state.handlers[tok.token_type](state, tok), tok)
+            except ParseError as error:
+                # the boundary itself is wrong: skip it
+                errors.append(error)
+                state.unparsed_content.flush(state)
+                tok = None
+
+    def close_before(self, state, tok):
+        """Close the open elements that prevent the handling of the
+        boundary token `tok` (cf. `recover`), return whether some
+        element is closed."""
+        if tok.token_type == "end_of_input":
+            stop = lambda element: False
+        elif tok.token_type in { "section", "mdsection" }:
+            stop = lambda element: element.markup_type not in { "command", "command_arg", "environment", "env_arg" }
+        elif tok.token_type == "env_footer":
+            # up to the matching environment, if any
+            stop = lambda element: element.markup_type == "environment" and element.env_name == tok.value.group(1)
+            if not any(stop(element) for element in state.element_stack + [ state.current_element ]):
+                return False
+        else:
+            return False
+
+        closed = False
+        while state.current_element is not state.doc and not stop(state.current_element):
+            state.current_element.end_pos = tok.start_pos
+            state.close()
+            closed = True
+        return closed
+
+    def finish(self, state, tok):
         # at the end of input
-        unparsed_content.flush(current_element)
+        state.unparsed_content.flush(state)
 
-        
-        while current_element != doc:
-            if current_element.markup_type == "command":
-                raise ParseError(current_element.start_pos, tok.start_pos, "Unfinished command before end of document")
-            elif current_element.markup_type == "environment":
-                raise ParseError(current_element.start_pos, tok.start_pos, "Unfinished environment before end of document")
+        while state.current_element != state.doc:
+            if state.current_element.markup_type == "command":
+                raise ParseError(state.current_element.start_pos, tok.start_pos, "Unfinished command before end of document")
+            elif state.current_element.markup_type == "environment":
+                raise ParseError(state.current_element.start_pos, tok.start_pos, "Unfinished environment before end of document")
             else:
                 # ok to close
-                current_element.end_pos = tok.start_pos
-                current_element = element_stack.pop()
+                state.current_element.end_pos = tok.start_pos
+                state.close()
+
+        state.emit("end", state.doc)
+
+    ###############################################
+    ### Incremental reparse                     ###
+    ###############################################
+    def reparse(self, doc, start, end, replacement):
+        """Update `doc` (parsed from a string) after the replacement
+        of the characters between the offsets `start` and `end` of its
+        input by the string `replacement`, and return the document.
+
+        Only the smallest section or environment enclosing the edit
+        is parsed again, and the positions after the edit are shifted.
+        If there is no such element (or if the edit changes the
+        structure around it) the whole input is parsed again, and
+        a new document is returned.
+        """
+        old_tokens = doc.lex.tokenizer.tokenizer_backend
+        if not isinstance(old_tokens, lexer.StringTokenizer):
+            raise ValueError("Cannot reparse a document not parsed from a string")
+        old_input = old_tokens.input_string
+        if not (0 <= start <= end <= len(old_input)):
+            raise ValueError("Wrong edit range: {}-{}".format(start, end))
+        input = old_input[:start] + replacement + old_input[end:]
+        lex = self.prepare_string_lexer(input)
 
-        # preparsing finished
+        if not self.is_local_edit(old_input[start:end]) or not self.is_local_edit(replacement):
+            return self.parse(Document(doc.filename, lex))
+
+        delta = len(replacement) - (end - start)
+        new_tokens = lex.tokenizer.tokenizer_backend
+        shift = PositionShift(end, old_tokens.position_at(end), new_tokens.position_at(end + delta))
+
+        # the candidate elements, from the innermost
+        path = enclosing_path(doc, start, end, old_input)
+        # the new elements are created with the positions after the shift
+        last_shift = doc.shift_log
+        doc.shift_log = shift
+        while path:
+            (parent, index) = path.pop()
+            element = parent.content[index]
+            try:
+                new_element = self.parse_region(doc, lex, element, element.end_pos.offset + delta)
+            except ParseError:
+                new_element = None
+            if new_element is not None:
+                break
+        else:
+            doc.shift_log = last_shift
+            return self.parse(Document(doc.filename, self.prepare_string_lexer(input)))
+
+        parent.content[index] = new_element
+        doc.index.remove_tree(element)
+        doc.index.add_tree(new_element)
+        # the positions after the edit (in the ancestors and in the
+        # elements following them) are shifted when they are next used
+        last_shift.next_shift = shift
+
+        doc.lex = lex
         return doc
 
+    # the markup that must not be added or removed by a local edit
+    # (inline preformated text may span several elements, and the
+    # macro definitions are not part of the tree)
+    NON_LOCAL_MARKUP = [ "`", "\\def" ]
+
+    def is_local_edit(self, text):
+        return not any(markup in text for markup in Parser.NON_LOCAL_MARKUP)
+
+    def parse_region(self, doc, lex, element, region_end):
+        """Parse again `element` from its (unchanged) start position,
+        up to the offset `region_end` of the edited input: the new
+        element is returned, or `None` if it is not a replacement
+        of the same kind ending at `region_end`."""
+        region = Markup(doc, doc.markup_type, element.start_pos, None)
+        state = Parser.ParseState(self, doc, sink=Parser.TreeBuilder(region).event, lex=lex)
+        lex.move_to(element.start_pos)
+        next_token = lex.next_token
+        parse_unrecognized = self.parse_unrecognized
+
+        while lex.pos.offset < region_end:
+            tok = next_token()
+            if tok is None:
+                if state.handlers[None](state, tok):
+                    break
+            elif state.handlers.get(tok.token_type, parse_unrecognized)(state, tok):
+                break
+
+        end_pos = lex.pos
+        if end_pos.offset != region_end:
+            return None
+        state.unparsed_content.flush(state)
+        # the sections are closed by the next one (or at the end of input)
+        while state.current_element is not doc:
+            if state.current_element.markup_type != "section":
+                return None
+            state.current_element.end_pos = end_pos
+            state.close()
+
+        if len(region.content) != 1:
+            return None
+        new_element = region.content[0]
+        if new_element.markup_type != element.markup_type or new_element.end_pos != end_pos:
+            return None
+        if element.markup_type == "section" and new_element.section_depth != element.section_depth:
+            return None
+        return new_element
+
+    ###############################################
+    ### Text (no token)                         ###
+    ###############################################
+    def parse_text(self, state, tok):
+        # just append the character (and the following plain text)
+        state.unparsed_content.append_run(state.lex)
+
+    def parse_text_in_command(self, state, tok):
+        lex = state.lex
+        current_element = state.current_element
+        # When closing an emphasis
+        if current_element.cmd_name in { "emph" , "strong" }:
+            next_char = lex.peek_char()
+            if next_char not in { '*', '_' }:
+                state.unparsed_content.append_run(lex)
+            elif current_element.cmd_name == "emph":
+                if current_element.cmd_opts.get('emph_type') == next_char:
+                    lex.next_char() # consume
+                    state.unparsed_content.flush(state)
+                    state.close()
+                else:
+                    state.unparsed_content.append_run(lex)
+            else: # strong
+                if current_element.cmd_opts.get('strong_type') == next_char:
+                    lex.next_chars(2) # consume two
+                    state.unparsed_content.flush(state)
+                    state.close()
+                else:
+                    state.unparsed_content.append_run(lex)
+
+        else: # in the other case just append the character
+            state.unparsed_content.append_run(lex)
+
+    def parse_unrecognized(self, state, tok):
+        # unrecognized token type
+        raise ParseError(tok.start_pos, tok.end_pos, "Unrecognized token type: {}".format(tok.token_type))
+
+    ###############################################
+    ### End of input                            ###
+    ###############################################
+    def parse_end_of_input(self, state, tok):
+        state.unparsed_content.flush(state)
+
+        while state.current_element.markup_type not in { "document", "subdoc", "macrocmddoc", "macroenvdoc", "macroenvfooterdoc" }:
+            if state.current_element.markup_type == "command":
+                raise ParseError(state.current_element.start_pos, tok.start_pos, "Unfinished command before end of document")
+            elif state.current_element.markup_type == "environment":
+                raise ParseError(state.current_element.start_pos, tok.start_pos, "Unfinished environment before end of document")
+            else:
+                # ok to close
+                state.current_element.end_pos = tok.start_pos
+                state.close()
+
+        return True # end of parse
+
+    ### Line comment ###
+    def parse_line_comment(self, state, tok):
+        pass # just skip this
+
+    ###############################################
+    ### Environments                            ###
+    ###############################################
+    def parse_env_header(self, state, tok):
+        state.unparsed_content.flush(state)
+        env = Environment(state.doc, tok.value.group(1), tok.value.group(2), tok.start_pos, tok.end_pos)
+        state.open(env)
+
+        # check if the environment has at least an argument
+        ntok = state.lex.peek_token()
+        if ntok is None:
+            pass  # special case: no more tokens (last command)
+        elif ntok.token_type == "open_curly":
+            env.parsing_argument = True  # the bracket is left for argument parsing
+        else:
+            env.parsing_argument = False  # command without argument
+
+    # start of argument  (or dummy bracket somewhere)
+    def parse_env_arg_open(self, state, tok):
+        current_element = state.current_element
+        if not (hasattr(current_element,"parsing_argument") and current_element.parsing_argument):
+            return self.parse_open_curly(state, tok)
+        # first argument
+        env_arg = EnvArg(state.doc, current_element, tok.start_pos)
+        state.open(env_arg)
+
+    # end of argument (or dummy bracket somewhere)
+    def parse_env_arg_close(self, state, tok):
+        state.unparsed_content.flush(state)
+        state.current_element.end_pos = tok.end_pos
+        # Pop parent element (environment)
+        state.close()
+
+        # check if the environment has at least a further argument
+        ntok = state.lex.peek_token()
+        if ntok is None: # no more token ? ==> ERROR !
+            raise ParseError(tok.start_pos, tok.end_pos, "Missing closing environment at end of input")
+        elif ntok.token_type == "open_curly":
+            state.current_element.parsing_argument = True
+        else:
+            state.current_element.parsing_argument = False
+            # keep the environment as current element for further argument or the body
+
+    def parse_env_footer(self, state, tok):
+        current_element = state.current_element
+        if current_element.markup_type != "environment":
+            raise ParseError(tok.start_pos, tok.end_pos, "Cannot close environment")
+        if current_element.env_name != tok.value.group(1):
+            raise ParseError(tok.start_pos, tok.end_pos, "Mismatch environment '{}' (expecting '{}')".format(tok.value.group(1), current_element.env_name))
+        state.unparsed_content.flush(state)
+
+        current_element.footer_start_pos = tok.start_pos
+        current_element.end_pos = tok.end_pos
+
+        # Pop parent element
+        state.close()
+
+    ###############################################
+    ### Commands                                ###
+    ###############################################
+    def parse_cmd_header(self, state, tok):
+        state.unparsed_content.flush(state)
+        cmd = Command(state.doc, tok.value.group(1), tok.value.group(2), tok.start_pos, tok.end_pos)
+
+        # check if the command has at least an arguemnt
+        ntok = state.lex.peek_token()
+        if ntok is None:
+            state.add(cmd)  # special case: no more tokens (last command)
+        elif ntok.token_type == "open_curly":
+            # the bracket is left for argument parsing
+            state.open(cmd)
+        else:
+            state.add(cmd)  # command without argument
+
+    # start of argument  (or dummy bracket somewhere)
+    def parse_cmd_arg_open(self, state, tok):
+        # first argument
+        cmd_arg = CommandArg(state.doc, state.current_element, tok.start_pos)
+        state.open(cmd_arg)
+
+    # end of argument (or dummy bracket somewhere)
+    def parse_cmd_arg_close(self, state, tok):
+        state.unparsed_content.flush(state)
+        state.current_element.end_pos = tok.end_pos
+        # Pop parent element (command)
+        state.close()
+
+        # check if the command has at least an arguemnt
+        ntok = state.lex.peek_token()
+        if ntok is None:
+            state.close()  # special case: no more tokens (last command, pop it)
+        elif ntok.token_type == "open_curly":
+            pass  # keep the command as current element, the bracket is left for argument parsing
+        else:
+            # pop the command (without more argument)
+            state.close()
+
+    def parse_cmd_pre_header(self, state, tok):
+        lex = state.lex
+        state.unparsed_content.flush(state)
+        cmd = Command(state.doc, tok.value.group(1), tok.value.group(2), tok.start_pos, tok.end_pos, preformated=True)
+        preformated = lex.next_until("}}}")
+        if preformated is None:
+            raise ParseError(tok.start_pos, lex.pos, "Preformated command unfinished (missing '}}}')")
+        cmd.content = preformated
+        lex.next_chars(3)
+        state.add(cmd)
+
+    def parse_open_curly(self, state, tok):
+        state.unparsed_content.append_str("{", tok.start_pos, tok.end_pos)
+
+    ###############################################
+    ### Sections (latex-style or markdown-style ###
+    ###############################################
+    def parse_section(self, state, tok):
+        if tok.token_type == "section":
+            # latex section markup
+            section_title = tok.value.group(2)
+            section_depth = depth_of_section(tok.value.group(1))
+        else:
+            # markdown section markup
+            section_title = tok.value.group(2)
+            section_depth = len(tok.value.group(1))
+            if tok.value.group(3) != "" and tok.value.group(3) != tok.value.group(1):
+                raise ParseError(tok.start_pos.next_char(tok.value.start(3) - tok.value.start()), tok.start_pos.next_char(tok.value.end(3) - tok.value.start()), 'Wrong section marker: should be "" or "{}"'.format(tok.value.group(1)))
+            if tok.value.group(4) != "" and not tok.value.group(4).isspace():
+                raise ParseError(tok.start_pos.next_char(tok.value.start(4) - tok.value.start()), tok.start_pos.next_char(tok.value.end(3) - tok.value.start()), "Unexpected text '{}' after section markup".format(tok.value.group(4)))
+
+        if state.current_element.markup_type == "command":
+            raise ParseError(state.current_element.start_pos, tok.start_pos, "Unfinished command before section")
+        elif state.current_element.markup_type == "environment":
+            raise ParseError(state.current_element.start_pos, tok.start_pos, "Unfinished environment before section")
+        # ok to parse new section
+        state.unparsed_content.flush(state)
+        # close all sections of greater or equal depth
+        while state.current_element.markup_type == "section" \
+              and state.current_element.section_depth >= section_depth: # TODO: fix probably needed for mixing inclusion and sectionnning
+            state.current_element.end_pos = tok.start_pos
+            state.close()
+        section = Section(state.doc, section_title, section_of_depth(section_depth), section_depth, tok.start_pos, tok.end_pos)
+        state.open(section)
+
+    ############################################
+    ### Markdown-style itemize and enumerate ###
+    ############################################
+    def parse_mdlist_item(self, state, tok):
+        doc = state.doc
+        mditem_indent = len(tok.value.group(1))
+        mditem_style = "itemize" if (tok.value.group(2)[0] == '-' or tok.value.group(2)[0] == '+') else "enumerate"
+
+        state.unparsed_content.flush(state)
+
+        continue_closing = True
+
+        while continue_closing:
+
+            dig_once_more = False
+
+            # TODO: fix probably needed for closing with subdocument
+            while state.current_element.markup_type not in { "command", "environment", "section", "document", "subdoc" }:
+                state.close()
+
+            current_element = state.current_element
+            if (current_element.markup_type == "environment") and (current_element.env_name in { "itemize", "enumerate" }) \
+            and (current_element.env_name == mditem_style):
+                try:
+                    if current_element.markdown_style:
+                        pass # ok
+                except AttributeError:
+                    raise ParseError(current_element.start_pos, tok.start_pos, "Mixing latex-style and markdown-style lists is forbidden")
+
+                if current_element.markdown_indent == mditem_indent:
+                    # add a further item at the same level
+                    mditem = Command(doc, "item", None, tok.start_pos, tok.end_pos)
+                    mditem.markdown_style = True
+                    state.add(mditem)
+                    continue_closing = False
+                elif current_element.markdown_indent > mditem_indent:
+                    # close one
+                    state.close()
+                    continue_closing = True
+                else: # dig one level more
+                    dig_once_more = True
+                    continue_closing = False
+
+            else:
+                dig_once_more = True
+                continue_closing = False
+
+            if dig_once_more:
+                mdlist = Environment(doc, mditem_style, None, tok.start_pos, tok.end_pos)
+                mdlist.markdown_style = True
+                mdlist.markdown_indent = mditem_indent
+                state.open_mdlist(mdlist)
+
+                mditem = Command(doc, "item", None, tok.start_pos, tok.end_pos)
+                mditem.markdown_style = True
+                state.add(mditem)
+
+        # loop if continue_closing == True
+
+        # and we're done
+
+    ###########################################
+    ### Inline preformated                  ###
+    ###########################################
+    def parse_inline_preformated(self, state, tok):
+        state.unparsed_content.flush(state)
+        preformated = Preformated(state.doc, tok.value.group(1), "inline", tok.start_pos, tok.end_pos)
+        state.emit("preformated", preformated)
+
+    ### Emphasis (normal) ###
+    def parse_emph(self, state, tok):
+        state.unparsed_content.flush(state)
+        cmd = Command(state.doc, "emph", {'emph_type': tok.value }, tok.start_pos, tok.end_pos)
+        state.open(cmd)
+
+    ### Strong emphasis ###
+    def parse_strong(self, state, tok):
+        state.unparsed_content.flush(state)
+        cmd = Command(state.doc, "strong", {'strong_type': tok.value }, tok.start_pos, tok.end_pos)
+        state.open(cmd)
+
+    ######################################################
+    ### Macros: commands and environments definitions  ###
+    ######################################################
+    ### command definition
+    def parse_def_cmd_header(self, state, tok):
+        lex = state.lex
+        state.unparsed_content.flush(state)
+
+        def_cmd_name = tok.value.group(1)
+        def_cmd_arity = 0
+        if tok.value.group(2) is not None:
+            def_cmd_arity = int(tok.value.group(2))
+
+        tok2 = lex.next_token()
+        if tok2.token_type != "open_curly":
+            raise ParseError(tok.end_pos, tok.end_pos.next_char(), "Missing '{' for \\defCommand body")
+
+        # prepare the template string
+        def_cmd_lex_start_pos = lex.pos
+        def_cmd_lex_str = lex.next_balanced('{', '}')
+        if def_cmd_lex_str is None:
+            raise ParseError(def_cmd_lex_start_pos, lex.pos, "Unexpected end of input while parsing \\defCommand body")
+
+        def_cmd_tpl = template.Template(def_cmd_lex_str,
+                                        globvars.TANGO_EVAL_GLOBAL_ENV,
+                                        escape_var='#',
+                                        escape_inline='@',
+                                        escape_block='@',
+                                        escape_block_open='{',
+                                        escape_block_close='}',
+                                        escape_emit_function='emit',
+                                        filename='<defCommand:{}>'.format(def_cmd_name),
+                                        base_pos=def_cmd_lex_start_pos)
+
+
+        # register the command
+        state.doc.register_def_command(def_cmd_name, DefCommand(state.doc, def_cmd_name, def_cmd_arity, tok.start_pos, tok.end_pos, def_cmd_tpl))
+
+    ### macro-command argument
+    def parse_macro_cmd_arg(self, state, tok): ### XXX: dead code ?
+        state.unparsed_content.flush(state)
+        arg_num = int(tok.value.group(1))
+        if state.macro_cmd_arguments is None or arg_num >= len(state.macro_cmd_arguments):
+            raise ParseError(tok.start_pos, tok.end_pos, "No such macro command argument: {}".format(arg_num))
+        command_arg_markup = state.macro_cmd_arguments[arg_num]
+        state.open(command_arg_markup)
+
+    ### environment definition
+    def parse_def_env_header(self, state, tok):
+        lex = state.lex
+
+        state.unparsed_content.flush(state)
+
+        def_env_name = tok.value.group(1)
+        def_env_arity = 0
+        if tok.value.group(2) is not None:
+            def_env_arity = int(tok.value.group(2))
+
+        tok2 = lex.next_token()
+        if tok2.token_type != "open_curly":
+            raise ParseError(tok.end_pos, tok.end_pos.next_char(), "Missing '{' for \\defEnvironment header body")
+
+
+        # prepare the template string for the header part
+        def_env_header_lex_start_pos = lex.pos
+        def_env_header_lex_str = lex.next_balanced('{', '}')
+        if def_env_header_lex_str is None:
+            raise ParseError(def_env_header_lex_start_pos, lex.pos, "Unexpected end of input while parsing \\defEnvironment header body")
+
+        def_env_header_tpl = template.Template(def_env_header_lex_str,
+                                               globvars.TANGO_EVAL_GLOBAL_ENV,
+                                               escape_var='#',
+                                               escape_inline='@',
+                                               escape_block='@',
+                                               escape_block_open='{',
+                                               escape_block_close='}',
+                                               escape_emit_function='emit',
+                                               filename='<defEnvironment:{}>'.format(def_env_name),
+                                               base_pos=def_env_header_lex_start_pos)
+
+        # prepare the template string for the footer part
+
+        tok2 = lex.next_token()
+        if tok2.token_type != "open_curly":
+            raise ParseError(tok.end_pos, tok.end_pos.next_char(), "Missing '{' for \\defEnvironment footer body")
+
+        def_env_footer_lex_start_pos = lex.pos
+        def_env_footer_lex_str = lex.next_balanced('{', '}')
+        if def_env_footer_lex_str is None:
+            raise ParseError(def_env_footer_lex_start_pos, lex.pos, "Unexpected end of input while parsing \\defEnvironment footer body")
+
+        def_env_footer_tpl = template.Template(def_env_footer_lex_str,
+                                               globvars.TANGO_EVAL_GLOBAL_ENV,
+                                               escape_var='#',
+                                               escape_inline='@',
+                                               escape_block='@',
+                                               escape_block_open='{',
+                                               escape_block_close='}',
+                                               escape_emit_function='emit',
+                                               filename='<defEnvironment:{}>'.format(def_env_name),
+                                               base_pos=def_env_footer_lex_start_pos)
+        # register the environement
+        state.doc.register_def_environment(def_env_name,  DefEnvironment(state.doc, def_env_name, def_env_arity, def_env_header_lex_start_pos, lex.pos, def_env_header_tpl, def_env_footer_tpl))
+
+
+    ###########################################
+    ### Special characters (newlines, etc.) ###
+    ###########################################
+    def parse_protected(self, state, tok):
+        state.unparsed_content.append_str(tok.value.group(0)[1:], tok.start_pos, tok.end_pos)
+
+    def parse_newline(self, state, tok):
+        lex = state.lex
+        state.unparsed_content.flush(state)
+        source = state.unparsed_content.source
+        if source is None:
+            newlines = tok.value
+            while lex.peek_char() == "\n" or lex.peek_char() == "\r":
+                newlines += lex.next_char()
+            newlines_markup = Newlines(state.doc, newlines, tok.start_pos, tok.end_pos)
+        else:
+            # the newlines are a span of the source
+            span_end = tok.end_pos.offset
+            while lex.peek_char() == "\n" or lex.peek_char() == "\r":
+                lex.next_char()
+                span_end += 1
+            newlines_markup = Newlines(state.doc, None, tok.start_pos, tok.end_pos,
+                                       source, tok.start_pos.offset, span_end)
+
+        ##  Special treatment for markdown lists
+        if newlines_markup.string_length() >= 2 or lex.at_eof():
+            # check if we need to finish some markdown list
+            top_mdlist = state.top_mdlist()
+            if top_mdlist: # found a markdown list to close
+                while state.current_element is not top_mdlist:
+                    state.close()
+
+                # close the top markdown list
+                state.close()
+
+
+        state.emit("newlines", newlines_markup)
+
+    def parse_spaces(self, state, tok):
+        state.unparsed_content.flush(state)
+        source = state.unparsed_content.source
+        if source is None:
+            state.emit("spaces", Spaces(state.doc, tok.value.group(0), tok.start_pos, tok.end_pos))
+        else:
+            state.emit("spaces", Spaces(state.doc, None, tok.start_pos, tok.end_pos,
+                                        source, tok.start_pos.offset, tok.end_pos.offset))
+
 
     def prepare_string_lexer(self, input):
-        tokens = lexer.Tokenizer(lexer.StringTokenizer(input))
-        lex = lexer.Lexer(tokens, *self.recognizers)
+        return self.prepare_lexer(lexer.make_string_tokenizer(input))
+
+    def prepare_file_lexer(self, filename):
+        return self.prepare_lexer(lexer.make_file_tokenizer(filename))
+
+    def prepare_lexer(self, tokens):
+        if self.compiled_lexer:
+            lex = lexer.CompiledLexer(tokens, recognizer_set=self.recognizer_set)
+        else:
+            lex = lexer.Lexer(tokens, recognizer_set=self.recognizer_set)
+        if self.profile is not None:
+            lex.enable_profiling(self.profile)
         return lex
         
-    def parse_from_string(self, input, filename="<string>"):
+    def parse_sub_string(self, input, make_doc, macro_cmd_arguments=None):
+        """Parse `input` in the document built by `make_doc` from
+        the lexer of the input (e.g. a macro expansion or an included
+        document), possibly while another parse is in progress."""
+        lex = self.prepare_string_lexer(input)
+        return self.parse(make_doc(lex), macro_cmd_arguments=macro_cmd_arguments)
+
+    def parse_from_string(self, input, filename="<string>", errors=None):
         self.filename = filename
         lex = self.prepare_string_lexer(input)
         doc = Document(self.filename, lex)            
-        return self.parse(doc)
-
-    def parse_from_file(self, filename):
-        f = open(filename, "r")
-        input = f.read()
-        f.close()
-        doc = self.parse_from_string(input, filename)
-        return doc
+        return self.parse(doc, errors=errors)
+
+    def parse_from_file(self, filename, errors=None):
+        """Parse the file `filename` (streamed if it is large), and
+        return the document (a best-effort one if a list of `errors`
+        is given, cf. `parse`)."""
+        if os.path.getsize(filename) < FILE_TOKENIZER_THRESHOLD:
+            f = open(filename, "r")
+            input = f.read()
+            f.close()
+            doc = self.parse_from_string(input, filename, errors)
+            return doc
+
+        # large file: streamed by the file tokenizer
+        self.filename = filename
+        lex = self.prepare_file_lexer(filename)
+        doc = Document(self.filename, lex)
+        return self.parse(doc, errors=errors)
 
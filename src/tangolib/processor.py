@@ -43,6 +43,13 @@ class DocumentProcessor:
         self.sec_processors[sec_depth] = sec_processor
 
         
+    def replace_content(self, markup, index, new_content):
+        '''Replace the element at `index` in the content of `markup`
+        by `new_content`, and update the index of the document.'''
+        self.document.index.remove_tree(markup.content[index])
+        markup.content[index] = new_content
+        self.document.index.add_tree(new_content)
+
     def process(self):
         # Stack[Markup * Int]   (doc/cmd/env, index in child, -1 for unprocessed)
         self.markup_stack = [(self.document, 0, None, -1)]
@@ -63,7 +70,7 @@ class DocumentProcessor:
                     if self.markup.cmd_name in self.document.known_def_commands():
                         new_content = self.document.fetch_def_command(self.markup.cmd_name).process(self.document, self.markup)
                         self.markup_stack.append((new_content, -1, self.source_markup, self.source_index))
-                        self.source_markup.content[self.source_index] = new_content
+                        self.replace_content(self.source_markup, self.source_index, new_content)
                     # Second case : normal command
                     elif self.markup.cmd_name in self.cmd_processors:
                         self.cmd_processors[self.markup.cmd_name].enter_command(self, self.markup)
@@ -71,11 +78,11 @@ class DocumentProcessor:
                         if self.markup.cmd_name in self.cmd_processors:
                             new_content, recursive = self.cmd_processors[self.markup.cmd_name].process_command(self, self.markup)
                             if new_content is None:
-                                self.source_markup.content[self.source_index] = SkipMarkup(self.markup.start_pos, self.markup.end_pos)
+                                self.replace_content(self.source_markup, self.source_index, SkipMarkup(self.markup.start_pos, self.markup.end_pos))
                             else: # new content
                                 if recursive:
                                     self.markup_stack.append(new_content, -1, self.source_markup, self.source_index)
-                                self.source_markup.content[self.source_index] = new_content
+                                self.replace_content(self.source_markup, self.source_index, new_content)
                     else:
                         self.command_stack.append(self.markup)
                 ### ENVIRONMENTS: entering processor
@@ -90,7 +97,7 @@ class DocumentProcessor:
                         self.markup.preformated = True # XXX: even more awful !
 
                         # self.markup_stack.append((header_content, -1, self.source_markup, self.source_index))
-                        self.source_markup.content[self.source_index] = header_content                     
+                        self.replace_content(self.source_markup, self.source_index, header_content)
                     # Second case: normal environment
                     elif self.markup.env_name in self.env_processors:
                         self.env_processors[self.markup.env_name].enter_environment(self, self.markup)
@@ -119,7 +126,7 @@ class DocumentProcessor:
                             if new_content is not None:
                                 if recursive:
                                     self.markup_stack.append((new_content, -1, self.source_markup, self.source_index))
-                                self.source_markup.content[self.source_index] = new_content
+                                self.replace_content(self.source_markup, self.source_index, new_content)
                     ### ENVIRONMENTS: leaving processing
                     elif self.markup.markup_type == "environment":
                         check_env = self.environment_stack.pop()
@@ -135,7 +142,7 @@ class DocumentProcessor:
                                 if new_content is not None:
                                     if recursive:
                                         self.markup_stack.append((new_content, -1, self.source_markup, self.source_index))
-                                    self.source_markup.content[self.source_index] = new_content
+                                    self.replace_content(self.source_markup, self.source_index, new_content)
                     elif self.markup.markup_type == "section":
                         check_sec = self.section_stack.pop()
                         assert check_sec == self.markup, "Invalid section stack (please report)"
@@ -148,7 +155,7 @@ class DocumentProcessor:
                         if new_content is not None:
                             if recursive:
                                 self.markup_stack.append((new_content, -1, self.source_markup, self.source_index))
-                            self.source_markup.content[self.source_index] = new_content
+                            self.replace_content(self.source_markup, self.source_index, new_content)
                 else: # process a child
                     child = self.markup.content[self.content_index]
                     self.markup_stack.append((self.markup, self.content_index+1, self.source_markup, self.source_index))
@@ -157,19 +164,19 @@ class DocumentProcessor:
                     elif isinstance(child, Text) and self.text_processor is not None:
                         ntext = self.text_processor.process_text(self, child)
                         if ntext is not None:
-                            self.markup.content[self.content_index] = ntext
+                            self.replace_content(self.markup, self.content_index, ntext)
                     elif isinstance(child, Preformated) and self.preformated_processor is not None:
                         npreformated = self.preformated_processor.process_preformated(self, child)
                         if npreformated is not None:
-                            self.markup.content[self.content_index] = npreformated
+                            self.replace_content(self.markup, self.content_index, npreformated)
                     elif isinstance(child, Spaces) and self.spaces_processor is not None:
                         nspaces = self.spaces_processor.process_spaces(self, child)
                         if nspaces is not None:
-                            self.markup.content[self.content_index] = nspaces                        
+                            self.replace_content(self.markup, self.content_index, nspaces)
                     elif isinstance(child, Newlines) and self.newlines_processor is not None:
                         nnewlines = self.newlines_processor.process_newlines(self, child)
                         if nnewlines is not None:
-                            self.markup.content[self.content_index] = nnewlines
+                            self.replace_content(self.markup, self.content_index, nnewlines)
                     elif isinstance(child, SkipMarkup):
                         pass # skip this markup
                     else:
@@ -3,7 +3,8 @@
 """
 
 from tangolib.processor import CommandProcessor, ProcessError
-from tangolib.markup import SkipMarkup, Preformated, SubDocument, search_content_by_types
+import tangolib.includecache
+from tangolib.markup import SkipMarkup, Preformated, search_content_by_types
 
 class TitleProcessor(CommandProcessor):
     def __init__(self):
@@ -40,32 +41,28 @@ class IncludeProcessor(CommandProcessor):
         if len(cmd.arguments) != 1:
             raise IncludeError("Cannot include document: expecting file name argument")            
 
-        sub_filename = search_content_by_types(cmd.content,{"text","preformated"})
+        sub_filename = search_content_by_types(cmd.arguments[0].content, {"text","preformated"})
         if not sub_filename:
             raise IncludeError("Cannot find include pathname")
         else:
             sub_filename = sub_filename.text
 
-        try:
-            sub_file = open(sub_filename, "r")
-        except OSError:
-            raise IncludeError("Cannot open included file: {}".format(sub_filename))
+        def read_sub_input():
+            try:
+                sub_file = open(sub_filename, "r")
+            except OSError:
+                raise IncludeError("Cannot open included file: {}".format(sub_filename))
+
+            try:
+                return sub_file.read()
+            except IOError:
+                raise IncludeError("Cannot read included file: {} (IO error)".format(sub_filename))
+            finally:
+                sub_file.close()
+
+        include_cache = tangolib.includecache.get_include_cache()
+        result_parsed = include_cache.parse_include(cmd.doc, sub_filename, cmd.start_pos, read_sub_input)
 
-        try:
-            sub_input = sub_file.read()
-        except IOError:
-            raise IncludeError("Cannot read included file: {} (IO error)".format(sub_filename))
-        finally:
-            sub_file.close()
-     
-
-        from tangolib.parser import Parser
-        parser = Parser()
-        sub_lex = parser.prepare_string_lexer(sub_input)
-        sub_doc = SubDocument(cmd.doc, sub_filename, cmd.start_pos, sub_lex)
-
-        result_parsed = parser.parse(sub_doc)
-   
         return (result_parsed, True)
 
 class CmdLineOptionProcessor(CommandProcessor):
@@ -0,0 +1,69 @@
+'''
+Test arena
+'''
+
+import unittest
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append("../src")
+
+from tangolib.parser import Parser
+
+INPUT = r"""= One =
+
+Some *text* and \mycmd[key=value]{an \emph{argument}}.
+
+\begin{itemize}
+\item first
+\item second
+\end{itemize}
+
+== Two ==
+
+\begin{center}
+\code{{{
+  preformated { text
+}}}
+\end{center}
+"""
+
+class TestArena(unittest.TestCase):
+    def test_round_trip(self):
+        doc = Parser().parse_from_string(INPUT)
+        arena = doc.to_arena()
+        self.assertEqual(arena.markup_type_of(0), "document")
+        self.assertEqual(arena.to_document().toxml(), doc.toxml())
+
+        # a subtree
+        index = arena.find("command", "mycmd")[0]
+        cmd = arena.to_document(index)
+        self.assertEqual(cmd.cmd_opts, { "key": "value" })
+        self.assertIs(cmd.arguments[0].cmd, cmd)
+        self.assertEqual(cmd.arguments[0].content[2].cmd_name, "emph")
+
+        code = arena.to_document(arena.find("command", "code")[0])
+        self.assertEqual(code.content, "\n  preformated { text\n")
+
+    def test_queries(self):
+        arena = Parser().parse_from_string(INPUT).to_arena()
+
+        self.assertEqual([ arena.name_of(index) for index in arena.find("section") ], ["One", "Two"])
+        self.assertEqual([ arena.name_of(index) for index in arena.find("command", "item") ],
+                         ["item", "item"])
+        self.assertEqual(arena.find("command", "nosuchcmd"), [])
+        self.assertEqual(arena.find("nosuchtype"), [])
+
+        # the offset of "argument"
+        path = arena.covering(INPUT.index("argument"))
+        self.assertEqual([ arena.markup_type_of(index) for index in path ],
+                         ["document", "section", "command", "command_arg", "command", "command_arg", "text"])
+        self.assertEqual(arena.name_of(path[-1]), "argument")
+
+        sizes = arena.subtree_sizes()
+        self.assertEqual(sizes[0], len(arena))
+        for index in range(len(arena)):
+            self.assertEqual(sizes[index], 1 + sum(sizes[child] for child in arena.children(index)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -54,6 +54,16 @@ class TestExtendedRegex(unittest.TestCase):
         self.assertTrue(m.group(1) == "   ")
         self.assertTrue(m.group(2) == "-")
         
+    def test_first_chars(self):
+        self.assertEqual(parser.REGEX_CMD_HEADER.first_chars(), r"\\")
+        self.assertEqual(parser.REGEX_MDSECTION.first_chars(), "=")
+        self.assertEqual(parser.REGEX_EMPH_UNDER.first_chars(), "_")
+        self.assertEqual(parser.REGEX_LINE_COMMENT.first_chars(), "%")
+        self.assertEqual(parser.REGEX_MDLIST_OPEN.first_chars(), r"{0}|\n".format(parser.REGEX_SPACE_STR))
+        self.assertEqual(ere.ERegex("(a|b?)c").first_chars(), "a|b|c")
+        self.assertIsNone(ere.ERegex("(a|b?)c*").first_chars())
+        self.assertIsNone(ere.ERegex(".x").first_chars())
+        
 
 if __name__ == '__main__':
     unittest.main()
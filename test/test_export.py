@@ -0,0 +1,90 @@
+'''
+Test export
+'''
+
+import io
+import json
+import unittest
+import xml.etree.ElementTree as ET
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append("../src")
+
+from tangolib.parser import Parser
+from tangolib.markup import Command, CommandArg, Preformated
+from tangolib.export import write_xml, write_jsonl
+
+INPUT = r"""= Fish & Chips =
+
+Some *text* <with> "quotes" and \mycmd[key=value]{an \emph{argument}}.
+
+\begin{itemize}
+\item first
+\end{itemize}
+
+\code{{{
+  if (a < b) { return; }
+}}}
+"""
+
+def deep_command(depth):
+    # \emph{\emph{...}} nested `depth` times
+    doc = Parser().parse_from_string("")
+    parent = doc
+    for _ in range(depth):
+        cmd = Command(doc, "emph", None, doc.start_pos, doc.start_pos)
+        parent.append(cmd)
+        arg = CommandArg(doc, cmd, doc.start_pos)
+        cmd.add_argument(arg)
+        parent = arg
+    return doc
+
+class TestExport(unittest.TestCase):
+    def test_xml(self):
+        doc = Parser().parse_from_string(INPUT)
+        out = io.StringIO()
+        write_xml(doc, out)
+
+        root = ET.fromstring(out.getvalue())
+        section = root.find("section")
+        self.assertEqual(section.get("title"), "Fish & Chips")
+        self.assertEqual(section.get("start_pos"), str(doc.content[0].start_pos))
+        self.assertEqual([ elem.text for elem in section.iter("text") ][2:4], ["<with>", "\"quotes\""])
+        code = [ elem for elem in section.iter("command") if elem.get("name") == "code" ][0]
+        self.assertIn("if (a < b) { return; }", code.text)
+        self.assertEqual(doc.toxml(), out.getvalue())
+
+        out = io.StringIO()
+        write_xml(doc, out, positions=False)
+        self.assertNotIn("start_pos", out.getvalue())
+
+        preformated = Preformated(doc, "x = 1", "python", doc.start_pos, doc.end_pos)
+        self.assertEqual(preformated.toxml(), '<preformated lang="python" start_pos="{}">x = 1</preformated>\n'.format(doc.start_pos))
+
+    def test_jsonl(self):
+        doc = Parser().parse_from_string(INPUT)
+        out = io.StringIO()
+        write_jsonl(doc, out)
+
+        records = [ json.loads(line) for line in out.getvalue().splitlines() ]
+        self.assertEqual(records[0]["type"], "document")
+        self.assertTrue(all(record["parent"] < record["id"] for record in records[1:]))
+        mycmd = [ record for record in records if record.get("name") == "mycmd" ][0]
+        self.assertEqual(mycmd["opts"], { "key": "value" })
+        cmd = [ elem for elem in doc.content[0].content if getattr(elem, "cmd_name", None) == "mycmd" ][0]
+        self.assertEqual(mycmd["start_pos"], list(cmd.start_pos))
+        self.assertEqual([ record["type"] for record in records if record["parent"] == mycmd["id"] ], ["command_arg"])
+
+    def test_deep_tree(self):
+        doc = deep_command(5000)
+        out = io.StringIO()
+        write_xml(doc, out, positions=False)
+        self.assertEqual(out.getvalue().count("<command_arg>"), 5000)
+
+        out = io.StringIO()
+        write_jsonl(doc, out, positions=False)
+        self.assertEqual(len(out.getvalue().splitlines()), 10001)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+'''
+Test include cache
+'''
+
+import os
+import tempfile
+import unittest
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append("../src")
+
+from tangolib.parser import Parser
+from tangolib.processor import DocumentProcessor
+from tangolib.processors import core
+from tangolib.includecache import IncludeCache, get_include_cache, prefetch_includes
+
+INCLUDED = r"""\defCommand{\hello}[1]{hello #1}
+Some *included* text.
+"""
+
+class TestIncludeCache(unittest.TestCase):
+    def setUp(self):
+        # the included files are named relatively to the temporary
+        # directory: its path may contain markup (e.g. a `_`)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.old_cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.filename = "included.tango.tex"
+        with open(self.filename, "w") as f:
+            f.write(INCLUDED)
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        self.tmp_dir.cleanup()
+
+    def read_input(self):
+        with open(self.filename) as f:
+            return f.read()
+
+    def test_hits_and_copies(self):
+        cache = IncludeCache()
+        doc = Parser().parse_from_string("main")
+
+        sub1 = cache.parse_include(doc, self.filename, doc.start_pos, self.read_input)
+        sub2 = cache.parse_include(doc, self.filename, doc.start_pos, self.read_input)
+        self.assertEqual(cache.stats(), { 'hits': 1, 'disk_hits': 0, 'misses': 1, 'prefetched': 0, 'entries': 1 })
+
+        self.assertIsNot(sub1, sub2)
+        self.assertIs(sub2.doc, doc)
+        self.assertEqual(sub1.toxml(), sub2.toxml())
+        self.assertIn("hello", doc.known_def_commands())
+
+        # the copies are independent
+        sub2.content.clear()
+        sub3 = cache.parse_include(doc, self.filename, doc.start_pos, self.read_input)
+        self.assertEqual(sub1.toxml(), sub3.toxml())
+
+        # a changed file is parsed again
+        with open(self.filename, "a") as f:
+            f.write("More text.\n")
+        sub4 = cache.parse_include(doc, self.filename, doc.start_pos, self.read_input)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(sub4.content[-2].text, "text.")
+
+    def test_disk_cache(self):
+        cache_dir = "cache"
+        doc = Parser().parse_from_string("main")
+
+        sub1 = IncludeCache(cache_dir).parse_include(doc, self.filename, doc.start_pos, self.read_input)
+
+        doc2 = Parser().parse_from_string("main")
+        cache = IncludeCache(cache_dir)
+        sub2 = cache.parse_include(doc2, self.filename, doc2.start_pos, self.read_input)
+        self.assertEqual((cache.hits, cache.disk_hits, cache.misses), (0, 1, 0))
+        self.assertEqual(sub1.toxml(), sub2.toxml())
+        self.assertIs(sub2.doc, doc2)
+
+        # the macros are loaded with the tree
+        def_cmd = doc2.fetch_def_command("hello")
+        self.assertEqual(def_cmd.cmd_arity, 1)
+        def_cmd.cmd_template.compile()
+        self.assertEqual(def_cmd.cmd_template.render({ '_1': "world" }), "hello world")
+
+        # a corrupted file is ignored
+        for name in os.listdir(cache_dir):
+            with open(os.path.join(cache_dir, name), "r+b") as f:
+                f.truncate(20)
+        sub3 = IncludeCache(cache_dir).parse_include(doc, self.filename, doc.start_pos, self.read_input)
+        self.assertEqual(sub1.toxml(), sub3.toxml())
+
+    def test_include_processor(self):
+        get_include_cache().clear()
+        input = "\\include{{{0}}}\n\\include{{{0}}}\n\\hello{{world}}\n".format(self.filename)
+        doc = Parser().parse_from_string(input)
+        processor = DocumentProcessor(doc)
+        core.register_core_processors(processor)
+        processor.process()
+
+        subdocs = [ elem for elem in doc.content if elem.markup_type == "subdoc" ]
+        self.assertEqual(len(subdocs), 2)
+        self.assertIsNot(subdocs[0], subdocs[1])
+        self.assertEqual(subdocs[1].start_pos.lpos, 2)
+        self.assertEqual(subdocs[0].content_toxml(), subdocs[1].content_toxml())
+
+    def test_prefetch(self):
+        outer_filename = "outer.tango.tex"
+        with open(outer_filename, "w") as f:
+            f.write("Outer \\include{{{}}}\n".format(self.filename))
+
+        cache = IncludeCache()
+        doc = Parser().parse_from_string("\\include{{{}}}\n".format(outer_filename))
+        self.assertEqual(prefetch_includes(doc, 2, cache), 2)
+        self.assertEqual(cache.prefetched, 2)
+
+        sub = cache.parse_include(doc, self.filename, doc.start_pos, self.read_input)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertIs(sub.doc, doc)
+        self.assertEqual(sub.content_toxml(), IncludeCache().parse_include(doc, self.filename, doc.start_pos, self.read_input).content_toxml())
+        self.assertIn("hello", doc.known_def_commands())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+'''
+Test the index of the documents
+'''
+
+import unittest
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append("../src")
+
+from tangolib.parser import Parser
+from tangolib.processor import DocumentProcessor, CommandProcessor
+from tangolib.markup import SkipMarkup
+from tangolib.generators.latex.latexgen import guess_document_class
+
+INPUT = r"""= One =
+\label{one}
+
+Some \emph{text} and \mycmd{an \emph{argument}}.
+
+\begin{itemize}
+\item first
+\item second
+\end{itemize}
+
+== Two ==
+\label{two}
+"""
+
+class TestIndex(unittest.TestCase):
+    def test_queries(self):
+        doc = Parser().parse_from_string(INPUT)
+
+        self.assertEqual([ sec.section_title for sec in doc.index.sections(1) ], ["One"])
+        self.assertEqual([ sec.section_title for sec in doc.index.sections(2) ], ["Two"])
+        self.assertEqual(doc.index.section_depths(), [1, 2])
+        # in document order
+        emphs = doc.index.commands("emph")
+        self.assertEqual([ emph.arguments[0].content[0].text for emph in emphs ], ["text", "argument"])
+        self.assertEqual(len(doc.index.commands("item")), 2)
+        self.assertEqual(len(doc.index.environments("itemize")), 1)
+        self.assertEqual(doc.index.labels("two"), [ doc.index.commands("label")[1] ])
+        self.assertEqual(doc.index.commands("nosuchcmd"), [])
+        self.assertEqual(doc.index.labels("three"), [])
+
+    def test_processing(self):
+        class SkipCommand(CommandProcessor):
+            def process_command(self, processing, cmd):
+                return (SkipMarkup(cmd.doc, cmd.start_pos, cmd.end_pos), False)
+
+        doc = Parser().parse_from_string("\\defCommand{\\hello}[1]{hello #1}\n"
+                                         + INPUT + "\\hello{\\emph{world}\\label{hello}}\n")
+        processor = DocumentProcessor(doc)
+        processor.register_command_processor("mycmd", SkipCommand())
+        processor.process()
+
+        # the macro-command is replaced by its expansion, and
+        # the command \mycmd by a skip (with its inner \emph)
+        self.assertEqual(doc.index.commands("hello"), [])
+        self.assertEqual(doc.index.commands("mycmd"), [])
+        emphs = doc.index.commands("emph")
+        self.assertEqual([ emph.arguments[0].content[0].text for emph in emphs ], ["text", "world"])
+        self.assertEqual(len(doc.index.labels("hello")), 1)
+
+    def test_reparse_and_arena(self):
+        parser = Parser()
+        doc = parser.parse_from_string(INPUT)
+        offset = INPUT.index("\\item second")
+        doc = parser.reparse(doc, offset, offset, "\\item zeroth\n")
+        self.assertEqual(len(doc.index.commands("item")), 3)
+        self.assertEqual(len(doc.index.environments("itemize")), 1)
+
+        doc = doc.to_arena().to_document()
+        self.assertEqual(len(doc.index.commands("item")), 3)
+        self.assertEqual([ cmd.arguments[0].content[0].text for cmd in doc.index.commands("label") ],
+                         ["one", "two"])
+
+    def test_document_class(self):
+        self.assertEqual(guess_document_class(Parser().parse_from_string(INPUT)), "article")
+        self.assertEqual(guess_document_class(Parser().parse_from_string("\\chapter{A}\n" + INPUT)), "book")
+        self.assertEqual(guess_document_class(Parser().parse_from_string("no section\n")), "article")
+
+if __name__ == '__main__':
+    unittest.main()
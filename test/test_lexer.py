@@ -56,7 +56,234 @@ class TestLexerString(unittest.TestCase):
         toks = [ tok for tok in lexer ]
         print("toks={}".format(toks))
         self.assertEqual([tok.token_type for tok in toks],['underscore', 'word', 'space', 'word', 'space', 'word', 'underscore'])
+
+    def test_unclosed_delimiters(self):
+        from tangolib.parser import Parser, REGEX_STRONG_STAR, REGEX_STRONG_UNDER, REGEX_EMPH_STAR, REGEX_EMPH_UNDER
+        regexps = { ("strong", '*'): REGEX_STRONG_STAR, ("strong", '_'): REGEX_STRONG_UNDER,
+                    ("emph", '*'): REGEX_EMPH_STAR, ("emph", '_'): REGEX_EMPH_UNDER }
+        delimiter_runs = [ rec for rec in Parser.prepare_recognizers() if isinstance(rec, tangolib.lexer.DelimiterRun) ]
+
+        # long lines of delimiters, many of them never closed on their line
+        for unit in ("**a *b ", "__a _b ", "a** b__ ", "*** ___ ", "x*y_z "):
+            line = unit * 500
+            input = line + "\n" + line + "\n"
+            for rec in delimiter_runs:
+                regexp = Regexp(rec.token_type, regexps[(rec.token_type, rec.char)])
+                tokens = make_string_tokenizer(input)
+                expected = make_string_tokenizer(input)
+                indexes = [] # the line indexes built for the first line
+                for offset in range(len(input)):
+                    tokens.set_pos(tangolib.lexer.ParsePosition(offset=offset))
+                    expected.set_pos(tangolib.lexer.ParsePosition(offset=offset))
+                    token = rec.recognize(tokens)
+                    self.assertEqual(token is None, regexp.recognize(expected) is None, (unit, rec, offset))
+                    if unit.startswith(("**a", "__a")) and rec.token_type == "strong":
+                        self.assertIsNone(token)
+                    index = tokens.line_delimiters.get(rec.char)
+                    if offset < len(line) and index is not None and not (indexes and indexes[-1] is index):
+                        indexes.append(index)
+                # each line is indexed once
+                self.assertLessEqual(len(indexes), 1, (unit, rec))
+
+    def test_positions(self):
+        tokens = tangolib.lexer.make_string_tokenizer("ab\ncd\n\nef")
+
+        tokens.forward(4)
+        self.assertEqual((tokens.pos.lpos, tokens.pos.cpos, tokens.pos.offset), (2, 2, 4))
+
+        tokens.forward(4)
+        self.assertEqual((tokens.pos.lpos, tokens.pos.cpos, tokens.pos.offset), (4, 2, 8))
+
+        tokens.set_pos(tangolib.lexer.ParsePosition(1, 3, 2))
+        self.assertEqual((tokens.pos.lpos, tokens.pos.cpos), (1, 3))
+        self.assertEqual(tokens.peek_line, "\n")
+
+        tokens.reset()
+        self.assertEqual((tokens.pos.lpos, tokens.pos.cpos), (1, 1))
+        self.assertEqual(tokens.peek_line, "ab\n")
+
+    def test_regexp_in_line(self):
+        word = Regexp("word", ere.ERegex(r'^([a-z]+)'))
+        spaces = Regexp("spaces", ere.ERegex(r'\s+'))
+        tokens = make_string_tokenizer("hello  world\nagain")
+
+        token = word.recognize(tokens)
+        self.assertEqual(token.value.group(1), "hello")
+        token = spaces.recognize(tokens)
+        self.assertEqual(token.end_pos.offset, 7)
+
+        # matching is anchored at the current position
+        token = word.recognize(tokens)
+        self.assertEqual(token.value.group(1), "world")
+        self.assertEqual((token.start_pos.cpos, token.end_pos.cpos), (8, 13))
+
+        # and bounded by the end of the current line
+        token = spaces.recognize(tokens)
+        self.assertEqual(token.value.group(0), "\n")
+        self.assertEqual((token.end_pos.lpos, token.end_pos.cpos), (2, 1))
         
 
+    def test_compiled_lexer(self):
+        from tangolib.parser import Parser
+        recognizers = Parser().recognizers
+        input = r"""\section{Intro}
+Some *emph* and __strong__ with \cmd[a=b]{x}{y} and `code` % comment
+\begin{itemize}
+\item my_var_name \{ protected \}
+\end{itemize}
+
+  - markdown item
+= Title =
+"""
+        def tokens_of(lexer_class):
+            lex = lexer_class(make_string_tokenizer(input), *recognizers)
+            toks = []
+            while not lex.at_eof():
+                tok = lex.next_token()
+                if tok is None:
+                    lex.next_char()
+                else:
+                    toks.append((tok.token_type, tok.start_pos.offset, tok.end_pos.offset))
+            return toks
+
+        toks = tokens_of(tangolib.lexer.CompiledLexer)
+        self.assertEqual(toks, tokens_of(tangolib.lexer.Lexer))
+        self.assertIn(("section", 0, 15), toks)
+
+        # the tokens are built from the master match: the fused
+        # recognizers never match again on their own
+        recognizers = Parser.prepare_recognizers()
+        calls = []
+        for rec in recognizers:
+            if rec.master_spec() is not None:
+                rec.recognize = lambda tokenizer, rec=rec: calls.append(rec.token_type)
+        self.assertEqual(toks, tokens_of(tangolib.lexer.CompiledLexer))
+        self.assertEqual(calls, [])
+
+    def test_dispatch(self):
+        from tangolib.parser import Parser
+        lex = tangolib.lexer.Lexer(make_string_tokenizer(""), *Parser().recognizers)
+        self.assertEqual(lex.candidates("a"), ())
+        self.assertEqual({rec.token_type for rec in lex.candidates("_")}, {"strong", "emph"})
+        self.assertEqual([rec.token_type for rec in lex.candidates("\n")], ["mdlist_open", "newline"])
+        self.assertEqual(len(lex.candidates(None)), len(lex.recognizers))
+
+    def test_lookahead(self):
+        from tangolib.parser import Parser
+        lex = tangolib.lexer.Lexer(make_string_tokenizer(r"\cmd{}{x}"), *Parser().recognizers)
+        recognized = []
+        recognize_token = lex.recognize_token
+        def counting_recognize_token():
+            token = recognize_token()
+            recognized.append(token)
+            return token
+        lex.recognize_token = counting_recognize_token
+
+        cmd = lex.next_token()
+        self.assertEqual(cmd.token_type, "cmd_header")
+        self.assertEqual(lex.peek_token().token_type, "open_curly")
+        self.assertEqual(lex.pos.offset, 4)
+        curly = lex.next_token()
+        lex.putback(curly)
+        self.assertIs(lex.next_token(), curly)
+        self.assertEqual(len(recognized), 2)
+
+        # consuming characters drops the lookahead
+        self.assertEqual(lex.peek_token(2).token_type, "open_curly")
+        self.assertEqual(lex.next_char(), "}")
+        self.assertEqual(lex.next_token().token_type, "open_curly")
+        self.assertIsNone(lex.peek_token())
+
+    def test_token_table(self):
+        from tangolib.parser import Parser
+        input = "\\section{S}\n\\cmd{x} and \\cmd{y}\n"
+        lex = tangolib.lexer.Lexer(make_string_tokenizer(input), *Parser().recognizers)
+        table = lex.token_table()
+        self.assertEqual(table.count("cmd_header"), 2)
+        self.assertEqual(table[0], ("section", 0, 11))
+        self.assertEqual(table[len(table) - 1], ("end_of_input", len(input), len(input)))
+        # positions are hashable values
+        self.assertEqual(len({tangolib.lexer.ParsePosition(1, 3, 2), tangolib.lexer.ParsePosition(1, 3, 2)}), 1)
+
+    def test_profiling(self):
+        from tangolib.parser import Parser
+        profile = tangolib.lexer.LexerProfile()
+        Parser(profile=profile).parse_from_string("\\cmd{x} and \\cmd{y}\n")
+        [cmd_profile] = [rec_profile for rec_profile in profile.recognizer_profiles()
+                         if rec_profile.token_type == "cmd_header"]
+        self.assertEqual((cmd_profile.hits, cmd_profile.misses), (2, 0))
+        self.assertEqual(profile.text_chars, len("xandy"))
+        self.assertIn('"text_chars": 5', profile.to_json())
+
+    def test_file_tokenizer(self):
+        import os
+        import tempfile
+        from tangolib.parser import Parser
+
+        input = "\\section{Sé}\n\nSome *text* with \\cmd{arg}\n\n  - item\n" * 20
+        with tempfile.NamedTemporaryFile("wb", delete=False) as f:
+            f.write(input.encode("utf-8"))
+
+        def tokens_of(tokenizer):
+            lex = tangolib.lexer.CompiledLexer(tokenizer, *Parser().recognizers)
+            toks = []
+            while not lex.at_eof():
+                tok = lex.next_token()
+                if tok is None:
+                    lex.next_char()
+                else:
+                    toks.append((tok.token_type, tok.start_pos.lpos, tok.start_pos.cpos, tok.end_pos.offset))
+            return toks
+
+        try:
+            expected = tokens_of(make_string_tokenizer(input))
+            for chunk_size in (1, 5, 64):
+                tokenizer = tangolib.lexer.make_file_tokenizer(f.name, chunk_size)
+                self.assertEqual(tokens_of(tokenizer), expected)
+                tokenizer.tokenizer_backend.close()
+        finally:
+            os.remove(f.name)
+
+    def test_file_tokenizer_unterminated_bodies(self):
+        import os
+        import tempfile
+        from tangolib.lexer import Lexer
+
+        chunk_size = 64
+        body = "some {text} in {a {long}} body\n" * 2000
+        with tempfile.NamedTemporaryFile("wb", delete=False) as f:
+            f.write(body.encode("utf-8"))
+
+        def scan(scan_body):
+            tokenizer = tangolib.lexer.make_file_tokenizer(f.name, chunk_size)
+            backend = tokenizer.tokenizer_backend
+            # the largest window while scanning
+            peak = [0]
+            extend = backend.extend
+            def peak_extend(*args):
+                extend(*args)
+                peak[0] = max(peak[0], len(backend.window))
+            backend.extend = peak_extend
+            lex = Lexer(tokenizer)
+            lex.next_chars(5)
+            try:
+                scan_body(lex)
+                return (peak[0], lex.pos)
+            finally:
+                backend.close()
+
+        try:
+            # the body is never closed: the scan reaches the end of the file,
+            # without decoding the rest of the file in the window
+            (peak, pos) = scan(lambda lex: self.assertIsNone(lex.next_until("}}}")))
+            self.assertLessEqual(peak, 4 * chunk_size)
+            self.assertEqual(pos.offset, len(body) - 2)
+
+            (peak, pos) = scan(lambda lex: self.assertIsNone(lex.next_balanced("{", "}")))
+            self.assertLessEqual(peak, 4 * chunk_size)
+            self.assertEqual((pos.offset, pos.lpos), (len(body), 2001))
+        finally:
+            os.remove(f.name)
+
 if __name__ == '__main__':
     unittest.main()
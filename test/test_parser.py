@@ -253,6 +253,57 @@ this is in section \emph{subsection 2.2}
         
         # TODO: validate the result
 
+    def test_mdlist_closing(self):
+        from tangolib.parser import ParseError
+
+        def structure(element):
+            # the lists, items and texts (without spaces and newlines)
+            if element.markup_type == "text":
+                return element.text
+            if element.markup_type == "environment":
+                name = ("md-" if getattr(element, "markdown_style", False) else "") + element.env_name
+            elif element.markup_type == "command":
+                name = element.cmd_name
+            else:
+                name = element.markup_type
+            return (name, [ structure(child) for child in element.content
+                            if child.markup_type not in { "spaces", "newlines" } ])
+
+        def parse(input):
+            return structure(Parser().parse_from_string(input))[1]
+
+        # the nested lists are closed at a lower indentation
+        self.assertEqual(parse("  - a\n    - b\n    - c\n  - d\n"),
+                         [("md-itemize", [("item", []), "a",
+                                          ("md-itemize", [("item", []), "b", ("item", []), "c"]),
+                                          ("item", []), "d"])])
+
+        # a blank line closes all the nested lists
+        self.assertEqual(parse("  - a\n    - b\n\ntext\n"),
+                         [("md-itemize", [("item", []), "a", ("md-itemize", [("item", []), "b"])]), "text"])
+        self.assertEqual(parse("  - a\n    - b\n\n\n  - c\n"),
+                         [("md-itemize", [("item", []), "a", ("md-itemize", [("item", []), "b"])]),
+                          ("md-itemize", [("item", []), "c"])])
+
+        # ... but not the lists outside the environment of the blank line
+        self.assertEqual(parse("  - a\n\\begin{center}\n    - b\n\nx\n\\end{center}\n  - c\n\ny\n"),
+                         [("md-itemize", [("item", []), "a",
+                                          ("center", [("md-itemize", [("item", []), "b"]), "x"]),
+                                          ("item", []), "c"]),
+                          "y"])
+
+        # the lists of an environment are closed (by a blank line) before its end
+        self.assertEqual(parse("\\begin{center}\n  - a\n    - b\n\n\\end{center}\nafter\n"),
+                         [("center", [("md-itemize", [("item", []), "a", ("md-itemize", [("item", []), "b"])])]),
+                          "after"])
+        with self.assertRaises(ParseError) as context:
+            parse("\\begin{center}\n  - a\n    - b\n\\end{center}\n")
+        self.assertEqual(context.exception.args[2], "Mismatch environment 'center' (expecting 'itemize')")
+
+        # and at the end of input (after a newline)
+        self.assertEqual(parse("  - a\n    - b\n"),
+                         [("md-itemize", [("item", []), "a", ("md-itemize", [("item", []), "b"])])])
+
         
     def test_inline_preformated(self):
         parser = Parser()
@@ -265,5 +316,291 @@ this is in section \emph{subsection 2.2}
 
         print("doc 11 = {}".format(ret))
 
+    def test_text_run(self):
+        parser = Parser()
+
+        ret = parser.parse_from_string("Some plain, text \\emph{this}.")
+
+        texts = [(elem.text, elem.start_pos.offset, elem.end_pos.offset)
+                 for elem in ret.content if elem.markup_type == "text"]
+        self.assertEqual(texts, [("Some", 0, 4), ("plain,", 5, 11),
+                                 ("text", 12, 16), (".", 28, 29)])
+
+    def test_emphasis(self):
+        parser = Parser()
+
+        ret = parser.parse_from_string("a *b* c\n__d__ my_var_name x**y\n")
+
+        cmds = [(elem.cmd_name, elem.cmd_opts, elem.start_pos.offset)
+                for elem in ret.content if elem.markup_type == "command"]
+        self.assertEqual(cmds, [("emph", {'emph_type': '*'}, 2),
+                                ("strong", {'strong_type': '_'}, 8),
+                                ("emph", {'emph_type': '_'}, 16)])
+        self.assertEqual(ret.content[2].content[0].text, "b")
+
+    def test_nested_emphasis(self):
+        from tangolib.markup import SubDocument
+
+        parser = Parser.shared()
+        outer_input = "x *a b* c __d__ e f_g\n"
+        inner_input = "y _h_ **i j** k\n"
+
+        def outer_events(nested):
+            events = []
+            for event in parser.iter_events(outer_input):
+                events.append((event.event_type, event.markup.markup_type, event.start_pos, event.end_pos))
+                # a sub-parse in the middle of a line with delimiters
+                if event.event_type == "start" and event.markup.markup_type == "command":
+                    nested()
+            return events
+
+        inner_xml = parser.parse_from_string(inner_input).toxml()
+        expected = outer_events(lambda: None)
+        sub_xmls = []
+        def nested():
+            doc = parser.parse_from_string("")
+            sub = parser.parse_sub_string(inner_input, lambda lex: SubDocument(doc, "<sub>", doc.start_pos, lex))
+            sub_xmls.append(sub.content_toxml())
+        self.assertEqual(outer_events(nested), expected)
+        self.assertEqual(len(sub_xmls), 2)
+        for sub_xml in sub_xmls:
+            self.assertIn(sub_xml.strip(), inner_xml)
+
+    def test_token_handlers(self):
+        from tangolib.parser import ParseError
+        parser = Parser()
+
+        # a handler specific to the markup type, or the one for any markup type
+        self.assertEqual(parser.handlers_of("environment")["open_curly"], parser.parse_env_arg_open)
+        self.assertEqual(parser.handlers_of("command")["open_curly"], parser.parse_cmd_arg_open)
+        self.assertEqual(parser.handlers_of("command_arg")["open_curly"], parser.parse_open_curly)
+        self.assertEqual(parser.handlers_of("env_arg")["close_curly"], parser.parse_env_arg_close)
+        self.assertNotIn("close_curly", parser.handlers_of("environment"))
+
+        # unexpected tokens (no handler for the markup type, nor for any)
+        for (input, offset) in (("a } b", 2),
+                                ("\\begin{a}x } y\\end{a}", 11),
+                                ("\\cmd{x} }", 8)):
+            with self.assertRaises(ParseError) as context:
+                parser.parse_from_string(input)
+            (start_pos, end_pos, message) = context.exception.args
+            self.assertEqual((start_pos.offset, end_pos.offset), (offset, offset + 1))
+            self.assertEqual(message, "Unrecognized token type: close_curly")
+
+        # a handler for any markup type, failing in an argument
+        with self.assertRaises(ParseError) as context:
+            parser.parse_from_string("\\cmd{\\end{a}}")
+        self.assertEqual(context.exception.args[2], "Cannot close environment")
+
+    def test_bulk_bodies(self):
+        import os
+        import tempfile
+        import tangolib.lexer
+        from tangolib.markup import Document
+        from tangolib.parser import ParseError
+
+        parser = Parser()
+
+        def parse_file(input, chunk_size):
+            # the bodies can span several chunks of the file tokenizer
+            with tempfile.NamedTemporaryFile("w", delete=False) as f:
+                f.write(input)
+            tokenizer = tangolib.lexer.make_file_tokenizer(f.name, chunk_size)
+            try:
+                return parser.parse(Document(f.name, parser.prepare_lexer(tokenizer)))
+            finally:
+                tokenizer.tokenizer_backend.close()
+                os.remove(f.name)
+
+        parsers = [ parser.parse_from_string,
+                    lambda input: parse_file(input, 3),
+                    lambda input: parse_file(input, 64) ]
+
+        for parse in parsers:
+            # a preformated body, with unbalanced curly brackets
+            input = "a \\cmd{{{x {{ y\n} z}}} b\n"
+            doc = parse(input)
+            [cmd] = [ elem for elem in doc.content if elem.markup_type == "command" ]
+            self.assertEqual(cmd.content, "x {{ y\n} z")
+            # the next element starts after the closing '}}}'
+            after = doc.content[doc.content.index(cmd) + 1]
+            self.assertEqual((after.start_pos.offset, after.start_pos.lpos, after.start_pos.cpos),
+                             (input.index("}}}") + 3, 2, 7))
+
+            # nested and balanced curly brackets in the macro bodies
+            input = "\\defCommand{\\hello}[1]{a {b {c}} #1 }\\defEnvironment{e}{<{x}>}{{</>}}after\n"
+            doc = parse(input)
+            self.assertEqual(doc.fetch_def_command("hello").cmd_template.template, "a {b {c}} #1 ")
+            def_env = doc.fetch_def_environment("e")
+            self.assertEqual((def_env.env_header_tpl.template, def_env.env_footer_tpl.template),
+                             ("<{x}>", "{</>}"))
+            self.assertEqual(def_env.env_end_pos.offset, input.index("after"))
+            self.assertEqual(doc.content[0].text, "after")
+            self.assertEqual(doc.content[0].start_pos.offset, input.index("after"))
+
+            # unterminated bodies: the error spans the body up to the end of input
+            for (input, start, end, message) in (
+                    ("a \\cmd{{{unfinished\nbody", 2, 22, "Preformated command unfinished (missing '}}}')"),
+                    ("\\defCommand{\\hello}{a {b}", 20, 25, "Unexpected end of input while parsing \\defCommand body"),
+                    ("\\defEnvironment{e}{x {y}", 19, 24, "Unexpected end of input while parsing \\defEnvironment header body"),
+                    ("\\defEnvironment{e}{x}{y {z}\n", 22, 28, "Unexpected end of input while parsing \\defEnvironment footer body")):
+                with self.assertRaises(ParseError) as context:
+                    parse(input)
+                (start_pos, end_pos, error_message) = context.exception.args
+                self.assertEqual((start_pos.offset, end_pos.offset, error_message), (start, end, message))
+
+    def test_shared_parser(self):
+        from tangolib.markup import SubDocument
+
+        parser = Parser.shared()
+        self.assertIs(parser, Parser.shared())
+        self.assertIs(Parser().recognizer_set, parser.recognizer_set)
+
+        # a sub-parse while another parse is in progress
+        outer = parser.prepare_string_lexer("\\include{a} text")
+        doc = parser.parse_from_string("outer \\emph{x}")
+        sub = parser.parse_sub_string("inner *y*", lambda lex: SubDocument(doc, "<sub>", doc.start_pos, lex))
+        self.assertEqual(sub.content[0].text, "inner")
+        self.assertEqual(sub.content[2].cmd_name, "emph")
+        self.assertEqual(outer.next_token().token_type, "cmd_header")
+
+    def test_iter_events(self):
+        parser = Parser()
+        input = "= Intro =\n\nSome words \\emph{here}.\n\n== Details ==\n\n  - one\n  - two\n"
+
+        titles = [event.markup.section_title for event in parser.iter_events(input)
+                  if event.event_type == "start" and event.markup.markup_type == "section"]
+        self.assertEqual(titles, ["Intro", "Details"])
+
+        nb_words = sum(len(event.markup.text.split()) for event in parser.iter_events(input)
+                       if event.event_type == "text")
+        self.assertEqual(nb_words, 6)
+
+        # the elements are not added to their parent
+        events = list(parser.iter_events(input))
+        self.assertEqual(events[0].markup.content, [])
+        self.assertEqual([ event.event_type for event in events ].count("start"),
+                         [ event.event_type for event in events ].count("end"))
+
+    def test_reparse(self):
+        parser = Parser()
+        input = "= One =\n\nfirst *text*\n\n\\begin{itemize}\n\\item a\n\\item b\n\\end{itemize}\n\n= Two =\n\nlast text\n"
+        doc = parser.parse_from_string(input)
+
+        # an edit in the environment of the first section
+        start = input.index("\\item b") + 6
+        new_doc = parser.reparse(doc, start, start + 1, "bb\n\\item c")
+        new_input = input[:start] + "bb\n\\item c" + input[start + 1:]
+        self.assertIs(new_doc, doc)
+        self.assertEqual(new_doc.toxml(), parser.parse_from_string(new_input).toxml())
+
+        # a new section: the whole input is parsed again
+        start = new_input.index("last")
+        newer_doc = parser.reparse(new_doc, start, start, "= Three =\n")
+        newer_input = new_input[:start] + "= Three =\n" + new_input[start:]
+        self.assertIsNot(newer_doc, new_doc)
+        self.assertEqual(newer_doc.toxml(), parser.parse_from_string(newer_input).toxml())
+
+    def test_reparse_positions(self):
+        def positions(element):
+            yield (element.markup_type, element.start_pos, element.end_pos)
+            for child in getattr(element, "content", ()):
+                if not isinstance(child, str):
+                    yield from positions(child)
+
+        parser = Parser()
+        input = "= One =\n\n\\begin{itemize}\n\\item a\n\\end{itemize}\n\n= Two =\n\nlast *text*\n"
+        doc = parser.parse_from_string(input)
+        sections = doc.index.sections(1)
+
+        # several edits before the positions are read again
+        for text in ("bb", "\n\\item c", "\\item d\n"):
+            start = input.index("\\end{itemize}")
+            input = input[:start] + text + input[start:]
+            doc = parser.reparse(doc, start, start, text)
+
+        self.assertEqual(list(positions(doc)), list(positions(parser.parse_from_string(input))))
+        self.assertEqual(sections[1].start_pos.offset, input.index("= Two ="))
+        self.assertEqual(sections[1].header_end_pos,
+                         parser.parse_from_string(input).index.sections(1)[1].header_end_pos)
+
+    def test_text_spans(self):
+        input = "Some *plain*  text,\n\n\\{more\\} text\n"
+        doc = Parser(text_spans=True).parse_from_string(input)
+
+        spans = [ elem for elem in doc.content if elem.markup_type in { "text", "spaces", "newlines" } ]
+        self.assertIs(spans[0].source, input)
+        self.assertEqual([ elem.string_length() for elem in spans[:4] ], [4, 1, 2, 5])
+
+        # the same strings as without the spans
+        strings = [ elem for elem in Parser().parse_from_string(input).content
+                    if elem.markup_type in { "text", "spaces", "newlines" } ]
+        self.assertTrue(all(elem.source is None for elem in strings))
+        self.assertEqual([ elem.get_string() for elem in spans ], [ elem.get_string() for elem in strings ])
+        self.assertEqual(spans[3].text, "text,")
+        self.assertEqual(spans[4].newlines, "\n\n")
+        self.assertIsNone(spans[3].source)
+
+        spans[3].text = "words"
+        self.assertEqual(spans[3].string_length(), 5)
+
+    def test_compact_nodes(self):
+        doc = Parser().parse_from_string("\\begin{center}\\emph{a} b\\end{center}\n\n  - item\n")
+
+        env = doc.content[0]
+        self.assertFalse(hasattr(env, "__dict__"))
+        self.assertFalse(hasattr(env, "markdown_style"))
+        self.assertFalse(hasattr(env.content[0], "__dict__"))
+        self.assertEqual(env.parsing_argument, False)
+        mdlist = doc.content[-2]
+        self.assertEqual((mdlist.markdown_style, mdlist.markdown_indent), (True, 2))
+        with self.assertRaises(AttributeError):
+            env.content[2].extra = "no such field"
+
+        # the documents can still be annotated (e.g. by the processors)
+        doc.title = "title"
+
+    def test_recovering(self):
+        parser = Parser()
+        input = "= One =\n\n\\begin{itemize}\n\\item a\n\\end{enumerate}\n\n= Two =\n\nc \\macroCommandArgument[0] d\n\n= Three =\n\n\\emph{b\n"
+
+        (doc, errors) = parser.parse_recovering(input)
+        self.assertEqual([ error.args[0].lpos for error in errors ], [5, 9, 13])
+        self.assertEqual([ elem.section_title for elem in doc.content if elem.markup_type == "section" ],
+                         ["One", "Two", "Three"])
+
+        # no error: the same document as the normal parse
+        input = "= One =\n\n\\begin{itemize}\n\\item a\n\\end{itemize}\n\n= Two =\n\n\\emph{b}\n"
+        (doc, errors) = parser.parse_recovering(input)
+        self.assertEqual(errors, [])
+        self.assertEqual(repr(doc), repr(parser.parse_from_string(input)))
+
+    def test_recovering_file(self):
+        import os
+        import tempfile
+        import tangolib.parser
+        from tangolib.parser import ParseError
+
+        parser = Parser()
+        input = "= One =\n\n\\begin{itemize}\n\\item a\n\\end{enumerate}\n\n= Two =\n\n\\emph{b}\n"
+        with tempfile.NamedTemporaryFile("w", delete=False) as f:
+            f.write(input)
+
+        threshold = tangolib.parser.FILE_TOKENIZER_THRESHOLD
+        try:
+            (expected, expected_errors) = parser.parse_recovering(input, f.name)
+            # read in memory, then streamed by the file tokenizer
+            for tangolib.parser.FILE_TOKENIZER_THRESHOLD in (threshold, 1):
+                errors = []
+                doc = parser.parse_from_file(f.name, errors)
+                self.assertEqual([ error.args for error in errors ],
+                                 [ error.args for error in expected_errors ])
+                self.assertEqual(repr(doc), repr(expected))
+                with self.assertRaises(ParseError):
+                    parser.parse_from_file(f.name)
+        finally:
+            tangolib.parser.FILE_TOKENIZER_THRESHOLD = threshold
+            os.remove(f.name)
+
 if __name__ == '__main__':
     unittest.main()
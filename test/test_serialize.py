@@ -0,0 +1,89 @@
+'''
+Test serialize
+'''
+
+import io
+import unittest
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append("../src")
+
+from tangolib.parser import Parser
+from tangolib.serialize import dump, dumps, load, loads, SerializationError, FORMAT_VERSION, MAGIC
+
+INPUT = r"""= One =
+
+Some *text* and \mycmd[key=value,n=2]{an \emph{argument}}.
+
+\begin{itemize}
+\item first
+\item second
+\end{itemize}
+
+== Two ==
+
+\code{{{
+  preformated { text
+}}}
+"""
+
+class TestSerialize(unittest.TestCase):
+    def test_round_trip(self):
+        doc = Parser().parse_from_string(INPUT)
+        loaded = loads(dumps(doc))
+        self.assertEqual(loaded.toxml(), doc.toxml())
+        self.assertIn("</section>", loaded.toxml())
+
+        cmd = loaded.content[0].content[7]
+        self.assertEqual((cmd.cmd_name, cmd.cmd_opts), ("mycmd", { "key": "value", "n": "2" }))
+        self.assertIs(cmd.arguments[0].cmd, cmd)
+        self.assertEqual(cmd.header_end_pos, doc.content[0].content[7].header_end_pos)
+
+        # through a file
+        f = io.BytesIO()
+        dump(doc, f)
+        f.seek(0)
+        self.assertEqual(load(f).toxml(), doc.toxml())
+
+    def test_errors(self):
+        data = dumps(Parser().parse_from_string(INPUT))
+
+        with self.assertRaises(SerializationError):
+            loads(b"NOT A TREE")
+        with self.assertRaises(SerializationError):
+            loads(MAGIC + bytes([FORMAT_VERSION + 1]) + data[len(MAGIC) + 1:])
+        with self.assertRaises(SerializationError):
+            loads(data[:len(data) // 2])
+        with self.assertRaises(SerializationError):
+            loads(data + b"\0")
+
+    def test_no_import(self):
+        import os
+        import sys
+        import tempfile
+
+        data = dumps(Parser().parse_from_string(INPUT))
+
+        # a module (with a name of the same length) that must not be imported
+        module_name = "tango_evil_mod1"
+        self.assertEqual(len(module_name), len("tangolib.markup"))
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, module_name + ".py"), "w") as f:
+            f.write("raise RuntimeError('imported')\n")
+        sys.path.insert(0, directory)
+        try:
+            with self.assertRaises(SerializationError):
+                loads(data.replace(b"tangolib.markup", module_name.encode("ascii")))
+            self.assertNotIn(module_name, sys.modules)
+            # not a markup class, even in the markup module
+            self.assertIn(b"Environment", data)
+            with self.assertRaises(SerializationError):
+                loads(data.replace(b"Environment", b"MarkupError"))
+        finally:
+            sys.path.remove(directory)
+            os.remove(os.path.join(directory, module_name + ".py"))
+            os.rmdir(directory)
+
+if __name__ == '__main__':
+    unittest.main()